@@ -0,0 +1,38 @@
+"""Compute referral paths for users approved before paths were stored.
+
+Walks the referral tree from its roots one level at a time and compares
+each approved user's stored path with the computed one:
+
+    python backfill_referral_paths.py         # report only
+    python backfill_referral_paths.py --fix   # write the missing/wrong paths
+"""
+import argparse
+import asyncio
+import logging
+
+logger = logging.getLogger("godly_bot")
+
+
+async def backfill(fix, batch_size):
+    import bot
+
+    result = await bot.users_repo.rebuild_referral_paths(fix=fix, batch_size=batch_size)
+    logger.info(
+        f"Referral paths: {result['checked']} user(s) checked, {len(result['mismatched'])} "
+        f"{'rewritten' if fix else 'missing or wrong'}."
+    )
+    if result["unreached"]:
+        logger.warning(f"{result['unreached']} approved user(s) sit in a referral cycle and were left as they are.")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fix", action="store_true", help="write the computed paths")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.fix, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""Store `username_key` for users who registered before it existed.
+
+Until then those users only match their exact username, case included:
+
+    python backfill_username_keys.py         # report only
+    python backfill_username_keys.py --fix   # store the missing keys
+"""
+import argparse
+import asyncio
+import logging
+
+logger = logging.getLogger("godly_bot")
+
+
+async def backfill(fix, batch_size):
+    import bot
+
+    missing = await bot.users_repo.backfill_username_keys(fix=fix, batch_size=batch_size)
+    logger.info(f"Username keys: {missing} user(s) {'updated' if fix else 'without one'}.")
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fix", action="store_true", help="store the missing keys")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.fix, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
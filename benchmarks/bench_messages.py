@@ -0,0 +1,65 @@
+"""Per-message render cost: the compiled catalog against building every message per call.
+
+"per call" mimics the old get_messages(): format every template of the
+language, then keep one. "catalog" is MessageCatalog.render():
+
+    python benchmarks/bench_messages.py --number 20000
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catalog import MessageCatalog, field_names  # noqa: E402
+
+LOCALES = os.path.join(ROOT, "locales")
+FEE = 5000
+CONSTANTS = {"fee": FEE}
+# Sample values for the fields a message fills in per call; any other field gets SAMPLE
+FIELDS = {"renewal_date": "25 July 2025"}
+SAMPLE = 3
+
+
+def load_raw():
+    raw = {}
+    for filename in os.listdir(LOCALES):
+        with open(os.path.join(LOCALES, filename), encoding="utf-8") as f:
+            raw[os.path.splitext(filename)[0]] = json.load(f)
+    return raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="renders per message")
+    parser.add_argument("--lang", default="fr")
+    args = parser.parse_args()
+
+    raw = load_raw()[args.lang]
+    catalog = MessageCatalog.from_directory(LOCALES, constants=CONSTANTS)
+    # Each message's own fields, as a handler would pass them
+    fields = {
+        key: {name: FIELDS.get(name, SAMPLE) for name in field_names(template) if name not in CONSTANTS}
+        for key, template in raw.items()
+    }
+    every_field = {name: value for values in fields.values() for name, value in values.items()}
+
+    def per_call(key):
+        return {k: t.format(**CONSTANTS, **every_field) for k, t in raw.items()}[key]
+
+    def compiled(key):
+        return catalog.render(key, args.lang, **fields[key])
+
+    print(f"{'message':<22} {'per call us':>12} {'catalog us':>12} {'speedup':>8}")
+    for key in raw:
+        assert per_call(key) == compiled(key), key
+        before = timeit.timeit(lambda: per_call(key), number=args.number) / args.number * 1e6
+        after = timeit.timeit(lambda: compiled(key), number=args.number) / args.number * 1e6
+        print(f"{key:<22} {before:>12.2f} {after:>12.3f} {before / after:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Measure startup time from `import bot` to the first handled update.
+
+Each run is a fresh process. "lazy" is the bot as it is; "eager" repeats
+what the bot used to do on import (connect, then issue every create_index
+one by one) before anything else, for comparison. Phases reported:
+
+  * import: `import bot`
+  * ready:  application initialised and post_init run (persistence loaded)
+  * first update: a /aboutus command handled and its reply sent
+
+By default MongoDB is the in-memory mongomock stand-in. It has no network
+latency, so add a simulated round-trip time or point it at a real server:
+
+    python benchmarks/bench_startup.py --runs 5 --rtt-ms 30
+    python benchmarks/bench_startup.py --runs 5 --mongo-uri mongodb://localhost:27017
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import statistics  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SlowCollection:
+    """A mongomock collection whose every call first waits one round-trip."""
+
+    def __init__(self, collection, rtt):
+        self.collection = collection
+        self.rtt = rtt
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self.rtt)
+            return attr(*args, **kwargs)
+        return call
+
+
+class SlowClient:
+    def __init__(self, rtt):
+        import mongomock
+        self.client = mongomock.MongoClient()
+        self.rtt = rtt
+
+    def __getitem__(self, db_name):
+        database = self.client[db_name]
+        rtt = self.rtt
+
+        class SlowDatabase:
+            def __getitem__(self, name):
+                return SlowCollection(database[name], rtt)
+        return SlowDatabase()
+
+    def close(self):
+        pass
+
+
+async def first_update(bot, since):
+    from telegram import Update
+    from telegram.ext import Application
+
+    from bench_update_latency import command_update
+    from stub_telegram import StubTelegram
+
+    stub = StubTelegram()
+    await stub.start()
+    application = bot.build_application(
+        Application.builder().token(bot.settings.BOT_TOKEN).base_url(stub.base_url).persistence(bot.persistence)
+    )
+    try:
+        await application.initialize()
+        await bot.on_startup(application)
+        ready = time.perf_counter() - since
+        await application.process_update(Update.de_json(command_update(1), application.bot))
+        handled = time.perf_counter() - since
+        # Same order as run_polling: post_shutdown runs after persistence is flushed
+        await application.shutdown()
+        await bot.on_shutdown(application)
+    finally:
+        await stub.stop()
+    return ready, handled
+
+
+def child(mode, mongo_uri, rtt_ms):
+    os.environ["METRICS_ENABLED"] = "false"
+    if mongo_uri:
+        os.environ["MONGO_URI"] = mongo_uri
+        os.environ["MONGO_DB_NAME"] = "godly_bench_startup"
+    else:
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+    sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+    import bot
+    if not mongo_uri and rtt_ms:
+        bot.mongo.client_factory = lambda uri, **options: SlowClient(rtt_ms / 1000)
+    if mode == "eager":
+        from database import INDEXES
+        db = bot.mongo.db
+        for name, models in INDEXES.items():
+            for model in models:
+                db[name].create_indexes([model])
+    imported = time.perf_counter() - STARTED
+    ready, handled = asyncio.run(first_update(bot, STARTED))
+    print(json.dumps({"import": imported, "ready": ready, "first_update": handled}))
+
+
+def run(mode, runs, mongo_uri, rtt_ms):
+    samples = []
+    for _ in range(runs):
+        command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--rtt-ms", str(rtt_ms)]
+        if mongo_uri:
+            command += ["--mongo-uri", mongo_uri]
+        output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {phase: statistics.median(s[phase] for s in samples) for phase in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo-uri", help="use a real MongoDB instead of mongomock")
+    parser.add_argument("--rtt-ms", type=float, default=0, help="simulated round-trip time for mongomock calls")
+    parser.add_argument("--child", choices=["lazy", "eager"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.mongo_uri, args.rtt_ms)
+        return
+    print(f"{'mode':<6} {'import ms':>10} {'ready ms':>10} {'first update ms':>16}   (median of {args.runs})")
+    for mode in ("eager", "lazy"):
+        result = run(mode, args.runs, args.mongo_uri, args.rtt_ms)
+        print(
+            f"{mode:<6} {result['import'] * 1000:>10.1f} {result['ready'] * 1000:>10.1f} "
+            f"{result['first_update'] * 1000:>16.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
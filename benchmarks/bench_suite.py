@@ -0,0 +1,387 @@
+"""Benchmark the main handlers and the monthly report against a synthetic user base.
+
+Runs `start`, `my_info`, `referral_earnings`, `admin_callback` and
+`send_monthly_referral_report` against N synthetic users with a fake Bot
+that records every call, and reports per handler:
+
+  * latency percentiles (p50/p95/p99),
+  * Mongo round-trips per call,
+  * peak Python memory (tracemalloc),
+  * throughput in updates per second when calls run concurrently.
+
+By default it uses the in-memory mongomock stand-in, which has no indexes
+and is only practical up to ~10k users. Point it at a local mongod for the
+larger sizes:
+
+    python benchmarks/bench_suite.py --sizes 10000
+    python benchmarks/bench_suite.py --mongo-uri mongodb://localhost:27017 --sizes 10000,100000,1000000
+
+Results are compared with a stored baseline (`--baseline`, written with
+`--save-baseline`). Any handler whose p95 latency, round-trips or peak
+memory regresses by more than `--tolerance` is flagged and the script
+exits non-zero. The committed `benchmarks/baseline.json` is the reference
+for the mongomock 10k size; its "_meta" entry records the machine and
+settings it was taken with, since latencies only compare on similar
+hardware. Round-trips compare anywhere.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from ledger import PayoutLedger  # noqa: E402
+from notifications import NotificationDispatcher  # noqa: E402
+from repository import UserRepository  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+HANDLERS = ("start", "my_info", "referral_earnings", "admin_callback")
+# Collection methods that cost one server round-trip each
+ROUND_TRIP_METHODS = {
+    "find_one", "find_one_and_update", "update_one", "update_many", "insert_one", "insert_many",
+    "delete_one", "replace_one", "count_documents", "aggregate", "bulk_write", "find",
+}
+
+
+class CountingCollection:
+    """Collection proxy that counts round-trips. getMore batches are not counted."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in ROUND_TRIP_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self.round_trips += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class RecordingBot:
+    def __init__(self):
+        self.calls = 0
+        self.username = "godly_bench_bot"
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+
+    async def send_document(self, chat_id, document, **kwargs):
+        # In chunks, so the upload itself doesn't show up in the report's peak memory
+        self.calls += 1
+        while document.read(65536):
+            pass
+
+
+class FakeMessage:
+    def __init__(self, text=""):
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        pass
+
+
+class FakeCallbackQuery:
+    def __init__(self, data):
+        self.data = data
+        self.message = SimpleNamespace(text="Submission")
+        self.from_user = SimpleNamespace(id=bot.settings.ADMIN_CHAT_ID, first_name="Admin")
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        pass
+
+
+def make_update(user_id, callback_data=None):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="Bench"),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=FakeMessage("/start"),
+        callback_query=FakeCallbackQuery(callback_data) if callback_data else None,
+    )
+
+
+def synthetic_users(size, seed):
+    """Yield users with a skewed referral tree: a few godfathers refer most users."""
+    rng = random.Random(seed)
+    now = datetime.now()
+    for user_id in range(1, size + 1):
+        status = rng.choices(["Approved", "Pending", "Rejected"], [0.8, 0.15, 0.05])[0]
+        registered = now - timedelta(days=rng.randrange(0, 365), seconds=rng.randrange(86400))
+        godfather = None
+        if user_id > 1 and rng.random() < 0.7:
+            godfather = min(user_id - 1, int(rng.paretovariate(0.8)))
+        user = {
+            "user_id": user_id,
+            "telegram_id": user_id,
+            "telegram_username": f"user{user_id}",
+            "name": f"User {user_id}",
+            "phone": f"6{user_id:08d}",
+            "email": f"user{user_id}@example.com",
+            "godfather": godfather,
+            "payment_method": rng.choice(["mtn", "orange"]),
+            "transaction_id": f"TX{user_id}",
+            "language": rng.choice(["en", "fr"]),
+            "status": status,
+            "registration_date": registered,
+        }
+        if status == "Approved":
+            user["subscription_start_date"] = registered
+            user["subscription_renewal_date"] = datetime.combine(bot.calculate_renewal_date(), datetime.min.time())
+        yield user
+
+
+def populate(db, size, seed, chunk=10000):
+    for name in ("users", "outbox", "ledger", "ledger_totals"):
+        db[name].drop()
+    bot.ensure_indexes(db)
+    batch = []
+    for user in synthetic_users(size, seed):
+        batch.append(user)
+        if len(batch) >= chunk:
+            db.users.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.users.insert_many(batch, ordered=False)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct * len(ordered)))] if ordered else 0.0
+
+
+class Harness:
+    def __init__(self, db, concurrency):
+        self.collection = CountingCollection(db.users)
+        self.repo = UserRepository(self.collection, max_workers=concurrency, renewal_day=bot.settings.RENEWAL_DAY)
+        self.fake_bot = RecordingBot()
+        self.notifier = NotificationDispatcher(
+            db.outbox, self.repo.run, concurrency=concurrency, global_rate=0, chat_interval=0
+        )
+        self.ledger = PayoutLedger(db, self.repo.run, renewal_day=bot.settings.RENEWAL_DAY)
+        self.ledger.entries = CountingCollection(db.ledger)
+        self.ledger.totals = CountingCollection(db.ledger_totals)
+        self.context = SimpleNamespace(bot=self.fake_bot, args=[], user_data={})
+        bot.users_repo = self.repo
+        bot.notifier = self.notifier
+        bot.ledger = self.ledger
+
+    def round_trips(self):
+        return self.collection.round_trips + self.ledger.entries.round_trips + self.ledger.totals.round_trips
+
+    async def call(self, handler, update):
+        await getattr(bot, handler)(update, self.context)
+
+    async def measure_handler(self, handler, updates, concurrency, concurrent_updates=None):
+        latencies = []
+        round_trips = self.round_trips()
+        for update in updates:
+            started = time.perf_counter()
+            await self.call(handler, update)
+            latencies.append(time.perf_counter() - started)
+        per_call = (self.round_trips() - round_trips) / len(updates)
+        await self.notifier.join()
+
+        # Throughput: the same kind of update, many in flight at once. Memory is
+        # traced here rather than in the latency pass, since tracing slows every call.
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(update):
+            async with semaphore:
+                await self.call(handler, update)
+
+        concurrent_updates = concurrent_updates or updates
+        tracemalloc.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(update) for update in concurrent_updates))
+        throughput = len(concurrent_updates) / (time.perf_counter() - started)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await self.notifier.join()
+        return {
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "round_trips": per_call,
+            "peak_kb": peak / 1024,
+            "updates_per_s": throughput,
+        }
+
+    async def measure_report(self):
+        application = SimpleNamespace(bot=self.fake_bot)
+        period = bot.last_completed_period()
+        round_trips = self.round_trips()
+        started = time.perf_counter()
+        await bot.send_monthly_referral_report(application)
+        elapsed = time.perf_counter() - started
+        round_trips = self.round_trips() - round_trips
+        await self.notifier.join()
+        # Second, traced run for peak memory; reopen the period so it is not a no-op
+        self.ledger.entries.delete_one({"_id": f"settlement:{period}"})
+        tracemalloc.start()
+        await bot.send_monthly_referral_report(application)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await self.notifier.join()
+        return {
+            "p50_ms": elapsed * 1000,
+            "p95_ms": elapsed * 1000,
+            "p99_ms": elapsed * 1000,
+            "round_trips": round_trips,
+            "peak_kb": peak / 1024,
+            "updates_per_s": 1 / elapsed,
+        }
+
+
+def pick_users(db, status, count, rng):
+    ids = [doc["user_id"] for doc in db.users.find({"status": status}, {"_id": 0, "user_id": 1}).limit(count * 5)]
+    rng.shuffle(ids)
+    return ids[:count]
+
+
+async def run_size(db, size, iterations, concurrency, seed):
+    rng = random.Random(seed)
+    harness = Harness(db, concurrency)
+    await harness.repo.rebuild_referral_counts(fix=True)
+    await harness.ledger.import_history(db.users, bot.settings.REFERRAL_REWARD, now=datetime(2000, 1, 1))
+    await harness.notifier.start(harness.fake_bot, restore=False)
+    try:
+        approved = pick_users(db, "Approved", iterations, rng)
+        sample = [rng.randrange(1, size + 1) for _ in range(iterations)]
+        # Two distinct sets of pending users: one for the timed pass, one for the concurrent pass
+        pending = pick_users(db, "Pending", iterations * 2, rng)
+        workloads = {
+            "start": [make_update(user_id) for user_id in approved + sample[: iterations // 2]],
+            "my_info": [make_update(user_id) for user_id in sample],
+            "referral_earnings": [make_update(user_id) for user_id in sample],
+            "admin_callback": [
+                make_update(bot.settings.ADMIN_CHAT_ID, f"approve_{user_id}") for user_id in pending[:iterations]
+            ],
+        }
+        # The concurrent admin_callback pass must approve fresh users, not re-approve the timed ones
+        concurrent_approvals = [
+            make_update(bot.settings.ADMIN_CHAT_ID, f"approve_{user_id}") for user_id in pending[iterations:]
+        ]
+        results = {}
+        for handler in HANDLERS:
+            if workloads[handler]:
+                results[handler] = await harness.measure_handler(
+                    handler, workloads[handler], concurrency,
+                    concurrent_approvals if handler == "admin_callback" else None,
+                )
+        results["send_monthly_referral_report"] = await harness.measure_report()
+        return results
+    finally:
+        await harness.notifier.stop()
+        harness.repo.close()
+
+
+def connect(mongo_uri):
+    if mongo_uri:
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri)["godly_bench"]
+    import mongomock
+    return mongomock.MongoClient()["godly_bench"]
+
+
+def run_suite(sizes, iterations=200, concurrency=16, mongo_uri=None, seed=25):
+    db = connect(mongo_uri)
+    results = {}
+    for size in sizes:
+        populate(db, size, seed)
+        results[str(size)] = asyncio.run(run_size(db, size, iterations, concurrency, seed))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """List (size, handler, metric, baseline, current) for every regression beyond `tolerance`."""
+    regressions = []
+    for size, handlers in results.items():
+        for handler, metrics in handlers.items():
+            previous = baseline.get(size, {}).get(handler)
+            if not previous:
+                continue
+            for metric in ("p95_ms", "round_trips", "peak_kb"):
+                if metrics[metric] > previous[metric] * (1 + tolerance) and metrics[metric] - previous[metric] > 1e-9:
+                    regressions.append((size, handler, metric, previous[metric], metrics[metric]))
+    return regressions
+
+
+def baseline_meta(args, sizes):
+    """The machine and settings a baseline was taken with."""
+    return {
+        "machine": f"{platform.machine()} {platform.processor() or ''}".strip(),
+        "cpus": os.cpu_count(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "backend": "mongod" if args.mongo_uri else "mongomock",
+        "sizes": sizes,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "saved_at": datetime.utcnow().strftime("%Y-%m-%d"),
+    }
+
+
+def print_results(results):
+    header = f"{'users':>8} {'handler':<30} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'trips':>7} {'peak KB':>10} {'upd/s':>9}"
+    print(header)
+    print("-" * len(header))
+    for size, handlers in results.items():
+        for handler, m in handlers.items():
+            print(f"{size:>8} {handler:<30} {m['p50_ms']:>9.2f} {m['p95_ms']:>9.2f} {m['p99_ms']:>9.2f} "
+                  f"{m['round_trips']:>7.2f} {m['peak_kb']:>10.1f} {m['updates_per_s']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", help="comma-separated user counts (default 10000, or 10k/100k/1M with --mongo-uri)")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per handler and size")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mongo-uri", help="use a real (local) mongod instead of mongomock")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression before flagging (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    default_sizes = "10000,100000,1000000" if args.mongo_uri else "10000"
+    sizes = [int(size) for size in (args.sizes or default_sizes).split(",")]
+    results = run_suite(sizes, args.iterations, args.concurrency, args.mongo_uri)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"_meta": baseline_meta(args, sizes), **results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        meta = baseline.pop("_meta", None)
+        if meta:
+            print(f"\nBaseline: {meta['backend']}, {meta['iterations']} iterations, concurrency {meta['concurrency']}, "
+                  f"on {meta['machine']} ({meta['cpus']} CPUs, Python {meta['python']}), {meta['saved_at']}")
+        regressions = compare(results, baseline, args.tolerance)
+        for size, handler, metric, before, after in regressions:
+            print(f"REGRESSION {size} users, {handler}: {metric} {before:.2f} -> {after:.2f}")
+        if regressions:
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
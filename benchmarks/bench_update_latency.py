@@ -0,0 +1,107 @@
+"""Compare update-to-reply latency for polling and webhook ingestion.
+
+Runs the real application against a local stub Bot API server, feeds it
+/aboutus commands one at a time and times how long each takes to produce
+its sendMessage. Needs the same environment as the bot itself:
+
+    python benchmarks/bench_update_latency.py --updates 200
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import sys
+import time
+
+import httpx
+from telegram.ext import Application
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from stub_telegram import StubTelegram  # noqa: E402
+
+SECRET = "bench-secret"
+
+
+def command_update(update_id, text="/aboutus", user_id=42):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def measure(mode, updates):
+    stub = StubTelegram()
+    await stub.start()
+    application = bot.build_application(
+        Application.builder().token(bot.settings.BOT_TOKEN).base_url(stub.base_url)
+    )
+    await application.initialize()
+    await application.start()
+    port = free_port()
+    if mode == "webhook":
+        await application.updater.start_webhook(
+            listen="127.0.0.1", port=port, url_path="telegram", webhook_url=f"http://127.0.0.1:{port}/telegram",
+            secret_token=SECRET, allowed_updates=bot.allowed_update_types(application),
+        )
+    else:
+        await application.updater.start_polling(
+            poll_interval=0, timeout=10, allowed_updates=bot.allowed_update_types(application)
+        )
+    latencies = []
+    try:
+        async with httpx.AsyncClient() as client:
+            for update_id in range(1, updates + 1):
+                reply = stub.wait_for_message(42)
+                started = time.perf_counter()
+                if mode == "webhook":
+                    await client.post(
+                        f"http://127.0.0.1:{port}/telegram", json=command_update(update_id),
+                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+                    )
+                else:
+                    stub.push_update(command_update(update_id))
+                latencies.append((await asyncio.wait_for(reply, 10)) - started)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await stub.stop()
+    return latencies
+
+
+def summarize(mode, latencies):
+    ordered = sorted(latencies)
+    pct = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000  # noqa: E731
+    print(f"{mode:>8}: mean {statistics.mean(latencies) * 1000:6.2f} ms | "
+          f"p50 {pct(0.50):6.2f} ms | p95 {pct(0.95):6.2f} ms | p99 {pct(0.99):6.2f} ms")
+
+
+def main():
+    for noisy in ("httpx", "tornado.access", "telegram"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=200)
+    args = parser.parse_args()
+    for mode in ("polling", "webhook"):
+        summarize(mode, asyncio.run(measure(mode, args.updates)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Replay a command mix against the user repository with and without the cache.
+
+Counts Mongo round-trips (find_one calls) and wall time for each run:
+
+    python benchmarks/bench_user_cache.py --users 2000 --commands 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+import mongomock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import TTLCache  # noqa: E402
+from repository import UserRepository  # noqa: E402
+
+# Approximate share of each command in production traffic and the lookups it makes
+COMMAND_MIX = [
+    ("myinfo", 0.35),
+    ("start", 0.20),
+    ("renew", 0.10),
+    ("referral_earnings", 0.20),
+    ("approve", 0.10),
+    ("register", 0.05),
+]
+
+
+class CountingCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self.round_trips += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+def populate(collection, users):
+    collection.insert_many([
+        {
+            "user_id": user_id,
+            "name": f"User {user_id}",
+            "godfather": random.randrange(users) if user_id % 3 else None,
+            "status": "Approved",
+            "registration_date": datetime.utcnow(),
+        }
+        for user_id in range(users)
+    ])
+
+
+def build_workload(users, commands, seed):
+    rng = random.Random(seed)
+    names, weights = zip(*COMMAND_MIX)
+    # Heavy users dominate traffic, so draw user ids from a skewed distribution
+    return [
+        (rng.choices(names, weights)[0], int(rng.expovariate(10 / users)) % users)
+        for _ in range(commands)
+    ]
+
+
+async def replay(repo, workload):
+    for command, user_id in workload:
+        if command in ("myinfo", "start", "renew"):
+            await repo.get_user(user_id)
+        elif command == "referral_earnings":
+            await repo.get_referral_counts(user_id)
+        elif command == "approve":
+            await repo.get_user(user_id)
+            previous = await repo.set_status(user_id, "Approved")
+            if previous and previous.get("godfather") is not None:
+                await repo.get_user(previous["godfather"])
+        elif command == "register":
+            await repo.save_registration(user_id, {"status": "Pending"})
+
+
+def run(users, commands, cache_size, ttl, seed):
+    workload = build_workload(users, commands, seed)
+    results = {}
+    for label, cache in (("no cache", None), ("cache", TTLCache(maxsize=cache_size, ttl=ttl))):
+        collection = CountingCollection(mongomock.MongoClient().db.users)
+        random.seed(seed)
+        populate(collection.collection, users)
+        repo = UserRepository(collection, max_workers=4, cache=cache)
+        started = time.perf_counter()
+        asyncio.run(replay(repo, workload))
+        results[label] = (collection.round_trips, time.perf_counter() - started, cache)
+        repo.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--commands", type=int, default=5000)
+    parser.add_argument("--cache-size", type=int, default=1000)
+    parser.add_argument("--ttl", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=25)
+    args = parser.parse_args()
+
+    results = run(args.users, args.commands, args.cache_size, args.ttl, args.seed)
+    baseline = results["no cache"][0]
+    for label, (round_trips, elapsed, cache) in results.items():
+        saved = 1 - round_trips / baseline if baseline else 0.0
+        print(f"{label:>8}: {round_trips:>7} round-trips ({saved:.1%} saved), {elapsed:.2f}s")
+        if cache is not None:
+            print(f"          {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
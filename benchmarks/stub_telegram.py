@@ -0,0 +1,96 @@
+"""Minimal local stand-in for the Telegram Bot API, for benchmarks.
+
+Serves ``/bot<token>/<method>`` on localhost. getUpdates long-polls on an
+in-memory queue fed by `push_update`, and every sendMessage is recorded
+with its arrival time so callers can measure end-to-end latency.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Godly", "username": "godly_stub_bot"}
+
+
+class StubTelegram:
+    def __init__(self):
+        self.updates = []
+        self.sent = []
+        self._new_update = asyncio.Event()
+        self._sent_waiters = {}
+        self._server = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", _MethodHandler, {"stub": self})])
+        sockets = bind_sockets(0, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        self._server = HTTPServer(app)
+        self._server.add_sockets(sockets)
+
+    async def stop(self):
+        self._server.stop()
+        await self._server.close_all_connections()
+
+    def push_update(self, update):
+        self.updates.append(update)
+        self._new_update.set()
+
+    def wait_for_message(self, chat_id):
+        """Future resolving to the arrival time of the next sendMessage to `chat_id`."""
+        future = asyncio.get_running_loop().create_future()
+        self._sent_waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    async def handle(self, method, params):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0)))
+        if method == "sendMessage":
+            arrived = time.perf_counter()
+            chat_id = int(params["chat_id"])
+            self.sent.append((chat_id, params["text"], arrived))
+            waiters = self._sent_waiters.get(chat_id)
+            if waiters:
+                waiters.pop(0).set_result(arrived)
+            return {"message_id": len(self.sent), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params["text"]}
+        return True
+
+    async def _get_updates(self, offset, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            pending = [u for u in self.updates if u["update_id"] >= offset]
+            if pending or time.monotonic() >= deadline:
+                self.updates = pending
+                return pending
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, stub):
+        self.stub = stub
+
+    async def post(self, token, method):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(self.request.body or b"{}")
+        else:
+            params = dict(parse_qsl(self.request.body.decode()))
+        result = await self.stub.handle(method, params)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"ok": True, "result": result}))
+
+    get = post
@@ -1,7 +1,10 @@
+import asyncio
 import logging
-from datetime import datetime, date
+import os
+from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
 from telegram import Update, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -11,11 +14,26 @@ from telegram.ext import (
     CallbackQueryHandler,
     ConversationHandler,
 )
-from pymongo import MongoClient, ASCENDING
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from bson.objectid import ObjectId
 from rich.logging import RichHandler
 from config import settings
+from repository import COUNTED_STATUSES, UserRepository, descendants_prefix, path_depth
+from cache import TTLCache
+from notifications import NotificationDispatcher
+from persistence import MongoPersistence
+from expiry import run_renewal_cycle
+from ledger import PayoutLedger
+from database import MongoConnection, ensure_indexes
+from catalog import MessageCatalog
+from dashboard import Dashboard
+from dispatch import PerChatUpdateProcessor
+from exports import CsvExport
+from jobs import JobScheduler
+from metrics import (
+    Metrics, MetricsServer, MongoCommandListener, MongoPoolListener, InstrumentedRequest, instrument_handlers
+)
 
 # --- Logging ---
 logging.basicConfig(
@@ -27,23 +45,73 @@ logging.basicConfig(
 logger = logging.getLogger("godly_bot")
 
 # --- MongoDB Integration ---
-def init_mongodb():
-    try:
-        client = MongoClient(settings.MONGO_URI)
-        db = client[settings.MONGO_DB_NAME]
-        users = db.users
-        # Indexes for performance
-        users.create_index([("user_id", ASCENDING)], unique=True)
-        users.create_index([("telegram_username", ASCENDING)])
-        users.create_index([("godfather", ASCENDING)])
-        users.create_index([("status", ASCENDING)])
-        logger.info("Connected to MongoDB and ensured indexes.")
-        return users
-    except Exception as e:
-        logger.critical(f"MongoDB connection/indexing failed: {e}")
-        exit(1)
+# Nothing here touches the network: the client is created on first use,
+# which is when the application loads its persistence on startup.
+metrics = Metrics()
 
-users_collection = init_mongodb()
+def mongo_client_options(name, pool_size, read_preference):
+    return {
+        "appname": f"godly-bot-{name}",
+        "maxPoolSize": pool_size,
+        "minPoolSize": min(settings.MONGO_MIN_POOL_SIZE, pool_size),
+        "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": settings.MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": settings.MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "readPreference": read_preference,
+        "event_listeners": [MongoCommandListener(metrics), MongoPoolListener(metrics, name)],
+    }
+
+mongo = MongoConnection(
+    settings.MONGO_URI, settings.MONGO_DB_NAME,
+    **mongo_client_options("main", settings.MONGO_MAX_POOL_SIZE, settings.MONGO_READ_PREFERENCE),
+)
+# Reports and analytics get their own client: its own, smaller pool, reading from secondaries when there are any
+reports_mongo = MongoConnection(
+    settings.MONGO_URI, settings.MONGO_DB_NAME,
+    **mongo_client_options("reports", settings.MONGO_REPORT_POOL_SIZE, settings.MONGO_REPORT_READ_PREFERENCE),
+)
+users_collection = mongo.collection("users")
+users_repo = UserRepository(
+    users_collection,
+    max_workers=settings.MONGO_MAX_WORKERS,
+    renewal_day=settings.RENEWAL_DAY,
+    cache=TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL),
+    usernames=TTLCache(maxsize=settings.USERNAME_CACHE_SIZE, ttl=settings.USERNAME_CACHE_TTL),
+    reports=reports_mongo.collection("users"),
+    report_workers=settings.MONGO_REPORT_WORKERS,
+)
+notifier = NotificationDispatcher(
+    users_collection.database.outbox,
+    users_repo.run,
+    concurrency=settings.NOTIFY_CONCURRENCY,
+    global_rate=settings.NOTIFY_GLOBAL_RATE,
+    chat_interval=settings.NOTIFY_CHAT_INTERVAL,
+    max_attempts=settings.NOTIFY_MAX_ATTEMPTS,
+    lease_seconds=settings.NOTIFY_LEASE_SECONDS,
+)
+persistence = MongoPersistence(
+    users_collection.database, users_repo.run, update_interval=settings.PERSISTENCE_INTERVAL
+)
+ledger = PayoutLedger(
+    users_collection.database,
+    users_repo.run,
+    renewal_day=settings.RENEWAL_DAY,
+    reports_database=users_repo.reports.database,
+    run_report=users_repo.run_report,
+)
+# Reads the primary, since events are applied on top of its snapshot, but on the report workers
+dashboard = Dashboard(
+    users_collection, users_repo.run_report, renewal_day=settings.RENEWAL_DAY, max_age=settings.DASHBOARD_MAX_AGE
+)
+users_repo.status_listeners.append(dashboard.on_status_change)
+job_scheduler = JobScheduler(
+    users_collection.database,
+    users_repo.run,
+    lease_seconds=settings.SCHEDULER_LEASE_SECONDS,
+    tick_seconds=settings.SCHEDULER_TICK_SECONDS,
+    misfire_grace=settings.SCHEDULER_MISFIRE_SECONDS,
+)
 
 # --- Conversation States ---
 (
@@ -57,54 +125,18 @@ users_collection = init_mongodb()
 ) = range(7)
 
 # --- Bot Text & Messages ---
-def get_messages(lang, renewal_date_str=""):
-    post_approval_fr = (
-        "Vous recevrez une somme de 2000 FCFA chaque fois qu’un nouveau compte est créé et une somme globale lorsque les différents "
-        "individus parrainés par vous paient leurs abonnements de 5000 FCFA à la fin du mois (25 de chaque mois).\n\n"
-        "Tous les paiements sont faits le 25 de chaque mois et les comptes qui manqueront de payer seront automatiquement supprimés.\n\n"
-        "Profitez au maximum de notre service de parrainage et gagnez plus grâce à l’achat et la revente des crypto."
-    )
-    post_approval_en = (
-        "You will receive a sum of 2000 FCFA each time a new account is created and a global amount when the different individuals "
-        "sponsored by you pay their subscriptions of 5000 FCFA at the end of the month (25th of each month).\n\n"
-        "All payments are made on the 25th of each month and accounts that fail to pay will be automatically deleted.\n\n"
-        "Make the most of our referral service and earn more by buying and reselling crypto."
-    )
-    return {
-        'welcome': "🎉 Welcome to our referral system! / Bienvenue dans notre système de parrainage!\n\n"
-                   "Please choose your language / Choisissez votre langue:",
-        'ask_name': {'fr': "📝 Entrez votre nom complet:", 'en': "📝 Please enter your full name:"}[lang],
-        'ask_number': {
-            'fr': "📞 Entrez votre numéro de téléphone (Ex: 67...).\n\n⚠️ Ce numéro sera utilisé pour recevoir vos paiements de parrainage. Assurez-vous qu'il est correct.",
-            'en': "📞 Please enter your phone number (e.g., 67...).\n\n⚠️ This number will be used to receive your referral payments. Make sure it is correct."
-        }[lang],
-        'ask_email': {'fr': "📧 Entrez votre adresse e-mail:", 'en': "📧 Please enter your email address:"}[lang],
-        'ask_godfather': {'fr': "👨‍👦 Entrez le numéro d'utilisateur Telegram de votre parrain (ou envoyez 'skip' si vous n'en avez pas):", 'en': "👨‍👦 Please enter your godfather's Telegram user ID (or send 'skip' if you don't have one):"}[lang],
-        'choose_payment': {'fr': f"✅ Informations enregistrées ! Pour activer votre compte, veuillez payer les frais d'abonnement de **{settings.SUBSCRIPTION_FEE} FCFA**. Choisissez votre mode de paiement :", 'en': f"✅ Information saved! To activate your account, please pay the **{settings.SUBSCRIPTION_FEE} FCFA** subscription fee. Choose your payment method:"}[lang],
-        'pending_approval': {'fr': "⏳ Votre paiement est en cours de vérification. Vous recevrez une notification de l'administrateur très bientôt.", 'en': "⏳ Your payment is being verified. You will receive a notification from the admin very soon."}[lang],
-        'approved_message': {
-            'fr': f"✅ **Félicitations ! Votre compte est approuvé.**\n\n"
-                  f"Votre prochain renouvellement est le **{renewal_date_str}**.\n\n"
-                  f"**Règles de Parrainage :**\n{post_approval_fr}",
-            'en': f"✅ **Congratulations! Your account has been approved.**\n\n"
-                  f"Your next renewal is on **{renewal_date_str}**.\n\n"
-                  f"**Referral Rules:**\n{post_approval_en}"
-        }[lang],
-        'rejected_message': {'fr': "❌ **Paiement Refusé**\n\nDésolé, votre paiement n'a pas pu être vérifié. Veuillez vérifier les détails de la transaction et contacter un administrateur si vous pensez qu'il s'agit d'une erreur.", 'en': "❌ **Payment Rejected**\n\nSorry, your payment could not be verified. Please check the transaction details and contact an admin if you believe this is an error."}[lang],
-        'cancel': {'fr': "❌ Inscription annulée. Tapez /start pour recommencer.", 'en': "❌ Registration cancelled. Type /start to begin again."}[lang],
-        'error': {'fr': "❌ Une erreur de base de données s'est produite. Veuillez réessayer ou contacter un administrateur.", 'en': "❌ A database error occurred. Please try again or contact an admin."}[lang]
-    }
+# One locales/<language>.json per language; adding a file adds the language
+catalog = MessageCatalog.from_directory(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales"),
+    constants={"fee": settings.SUBSCRIPTION_FEE},
+)
 
-PAYMENT_DETAILS = {
-    'mtn': {
-        'fr': f"📱 **Paiement par MTN Mobile Money**\n\nVeuillez transférer **{settings.SUBSCRIPTION_FEE} FCFA** au numéro suivant:\nNuméro: `+2376759770720`\nNom: `ROSETTE GUIFABE PABAME`\n\nAprès le paiement, revenez ici et envoyez l'ID de la transaction pour vérification.",
-        'en': f"📱 **MTN Mobile Money Payment**\n\nPlease transfer **{settings.SUBSCRIPTION_FEE} FCFA** to the following number:\nNumber: `+2376759770720`\nName: `ROSETTE GUIFABE PABAME`\n\nAfter payment, come back here and send the Transaction ID for verification."
-    },
-    'orange': {
-        'fr': f"🍊 **Paiement par Orange Money**\n\nVeuillez transférer **{settings.SUBSCRIPTION_FEE} FCFA** au numéro suivant:\nNuméro: `+237699644540`\nNom: `GAHUIS FABASSO TOUOFFO`\n\nAprès le paiement, revenez ici et envoyez l'ID de la transaction pour vérification.",
-        'en': f"🍊 **Orange Money Payment**\n\nPlease transfer **{settings.SUBSCRIPTION_FEE} FCFA** to the following number:\nNumber: `+237699644540`\nName: `GAHUIS FABASSO TOUOFFO`\n\nAfter payment, come back here and send the Transaction ID for verification."
-    }
-}
+LANGUAGE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(catalog.render('language_name', lang), callback_data=f'lang_{lang}')]
+    for lang in catalog.languages
+])
+
+ADMIN_FILTER = filters.Chat(chat_id=settings.ADMIN_CHAT_ID)
 
 MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
     [
@@ -121,35 +153,55 @@ def calculate_renewal_date() -> date:
     renewal_date = next_month.replace(day=settings.RENEWAL_DAY)
     return renewal_date
 
-def normalize_godfather(godfather_input):
+def current_referral_period(now=None):
+    """Return (start, end) of the referral period running since the last renewal day.
+
+    In UTC, like the ledger's period keys, so a report never settles a period still receiving rewards.
+    """
+    now = now or datetime.utcnow()
+    last_25th = now.replace(day=settings.RENEWAL_DAY)
+    if now.day < settings.RENEWAL_DAY:
+        last_25th = last_25th - relativedelta(months=1)
+    period_start = last_25th.replace(hour=0, minute=0, second=0, microsecond=0)
+    period_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return period_start, period_end
+
+async def normalize_godfather(godfather_input):
     """Always store godfather as user_id (int) if possible, else None."""
     try:
         return int(godfather_input)
     except (ValueError, TypeError):
-        # Try to resolve username to user_id
-        user = users_collection.find_one({"telegram_username": godfather_input})
-        return user["user_id"] if user else None
+        return await users_repo.resolve_username(godfather_input)
+
+async def referral_from_link(context, user_id):
+    """The godfather named by a t.me/<bot>?start=<user_id or username> link, if any."""
+    if not context.args:
+        return None
+    godfather_id = await normalize_godfather(context.args[0])
+    return godfather_id if godfather_id != user_id else None
 
 # --- Conversation Handlers ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
     logger.info(f"User {user.id} ({user.username}) started the bot.")
-    existing_user = users_collection.find_one({"user_id": user.id})
+    existing_user = await users_repo.get_user(user.id)
+    if existing_user and existing_user.get('telegram_username') != user.username:
+        await users_repo.update_username(user.id, user.username)
     if existing_user and existing_user.get('status') == 'Approved':
         lang = existing_user.get('language', 'en')
         renewal_date = existing_user.get('subscription_renewal_date').strftime('%d %B %Y')
-        await update.message.reply_text({
-            'fr': f"👋 Re-bonjour! Votre compte est déjà actif. Votre prochain renouvellement est le {renewal_date}.",
-            'en': f"👋 Welcome back! Your account is already active. Your next renewal date is {renewal_date}."
-        }[lang], reply_markup=MAIN_MENU_KEYBOARD)
+        await update.message.reply_text(
+            catalog.render('welcome_back', lang, renewal_date=renewal_date), reply_markup=MAIN_MENU_KEYBOARD
+        )
         return ConversationHandler.END
 
-    keyboard = [
-        [InlineKeyboardButton("🇫🇷 Français", callback_data='lang_fr')],
-        [InlineKeyboardButton("🇬🇧 English", callback_data='lang_en')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(get_messages('en', '')['welcome'], reply_markup=reply_markup)
+    # Kept until registration, so the godfather question is skipped; a /start without a link forgets it
+    referred_by = await referral_from_link(context, user.id)
+    if referred_by is not None:
+        context.user_data['referred_by'] = referred_by
+    else:
+        context.user_data.pop('referred_by', None)
+    await update.message.reply_text(catalog.render('welcome', 'en'), reply_markup=LANGUAGE_KEYBOARD)
     return LANGUAGE_SELECTION
 
 async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -157,40 +209,45 @@ async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     lang = query.data.split('_')[1]
     context.user_data['language'] = lang
-    messages = get_messages(lang)
-    await query.edit_message_text(text=messages['ask_name'])
+    await query.edit_message_text(text=catalog.render('ask_name', lang))
     return NAME_INPUT
 
 async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['name'] = update.message.text.strip()
     lang = context.user_data['language']
-    await update.message.reply_text(get_messages(lang)['ask_number'])
+    await update.message.reply_text(catalog.render('ask_number', lang))
     return NUMBER_INPUT
 
 async def handle_number(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['phone'] = update.message.text.strip()
     lang = context.user_data['language']
-    await update.message.reply_text(get_messages(lang)['ask_email'])
+    await update.message.reply_text(catalog.render('ask_email', lang))
     return EMAIL_INPUT
 
+async def ask_payment_method(update: Update, lang) -> int:
+    keyboard = [
+        [InlineKeyboardButton("📱 MTN Mobile Money", callback_data='payment_mtn')],
+        [InlineKeyboardButton("🍊 Orange Money", callback_data='payment_orange')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(catalog.render('choose_payment', lang), reply_markup=reply_markup, parse_mode='Markdown')
+    return PAYMENT_METHOD
+
 async def handle_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data['email'] = update.message.text.strip().lower()
     lang = context.user_data['language']
-    await update.message.reply_text(get_messages(lang)['ask_godfather'])
+    if context.user_data.get('referred_by') is not None:
+        context.user_data['godfather'] = context.user_data['referred_by']
+        return await ask_payment_method(update, lang)
+    await update.message.reply_text(catalog.render('ask_godfather', lang))
     return GODFATHER_INPUT
 
 async def handle_godfather(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     godfather_input = update.message.text.strip()
-    godfather_id = None if godfather_input.lower() == 'skip' else normalize_godfather(godfather_input)
+    godfather_id = None if godfather_input.lower() == 'skip' else await normalize_godfather(godfather_input)
     context.user_data['godfather'] = godfather_id
     lang = context.user_data['language']
-    keyboard = [
-        [InlineKeyboardButton("📱 MTN Mobile Money", callback_data='payment_mtn')],
-        [InlineKeyboardButton("🍊 Orange Money", callback_data='payment_orange')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(get_messages(lang)['choose_payment'], reply_markup=reply_markup, parse_mode='Markdown')
-    return PAYMENT_METHOD
+    return await ask_payment_method(update, lang)
 
 async def payment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
@@ -198,7 +255,7 @@ async def payment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     payment_method = query.data.split('_')[1]
     context.user_data['payment_method'] = payment_method
     lang = context.user_data['language']
-    instructions = PAYMENT_DETAILS[payment_method][lang]
+    instructions = catalog.render(f'payment_{payment_method}', lang)
     await query.edit_message_text(text=instructions, parse_mode='Markdown')
     return TRANSACTION_ID
 
@@ -221,16 +278,26 @@ async def handle_transaction_id(update: Update, context: ContextTypes.DEFAULT_TY
         "registration_date": datetime.utcnow()
     }
     try:
-        users_collection.update_one(
-            {"user_id": user.id},
-            {"$set": user_data},
-            upsert=True
+        # The duplicate check is one indexed lookup, run alongside the write
+        before, duplicates = await asyncio.gather(
+            users_repo.save_registration(user.id, user_data),
+            users_repo.transaction_duplicates(user.id, user_data['payment_method'], user_data['transaction_id']),
         )
         logger.info(f"User data for {user.id} saved/updated in MongoDB.")
+        # Used up: registering again after a rejection or expiry asks for the godfather again
+        context.user_data.pop('referred_by', None)
+        if before and before.get("status") in COUNTED_STATUSES and before.get("godfather"):
+            # Renewing after expiry: counted again once approved again; the reward already paid stands
+            await users_repo.adjust_referral_counts(
+                before["godfather"], before.get("registration_date") or user_data["registration_date"], -1
+            )
         await update.message.reply_text(
-            get_messages(lang)['pending_approval'],
+            catalog.render('pending_approval', lang),
             reply_markup=MAIN_MENU_KEYBOARD
         )
+        if settings.ADMIN_DIGEST_MINUTES:
+            # Summed up with the other new submissions by send_pending_digest
+            return ConversationHandler.END
         # Forward details to admin
         godfather_display = user_data['godfather'] if user_data['godfather'] else "None"
         admin_message = (
@@ -243,24 +310,62 @@ async def handle_transaction_id(update: Update, context: ContextTypes.DEFAULT_TY
             f"💳 **Method:** {user_data['payment_method'].upper()}\n"
             f"🧾 **Transaction ID:** `{user_data['transaction_id']}`\n"
         )
+        if duplicates:
+            admin_message += "\n⚠️ **DUPLICATE TRANSACTION ID** — already submitted by:\n" + "\n".join(
+                format_duplicate_user(duplicate) for duplicate in duplicates
+            )
         keyboard = [
             [InlineKeyboardButton("✅ Approve", callback_data=f'approve_{user.id}')],
             [InlineKeyboardButton("❌ Reject", callback_data=f'reject_{user.id}')]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await context.bot.send_message(chat_id=settings.ADMIN_CHAT_ID, text=admin_message, reply_markup=reply_markup, parse_mode='Markdown')
+        await notifier.enqueue(settings.ADMIN_CHAT_ID, admin_message, reply_markup=reply_markup, parse_mode='Markdown')
     except Exception as e:
         logger.error(f"Failed to save user data for {user.id} to MongoDB: {e}")
-        await update.message.reply_text(get_messages(lang)['error'])
+        await update.message.reply_text(catalog.render('error', lang))
         return ConversationHandler.END
     return ConversationHandler.END
 
+def approval_messages(user, renewal_date, godfather_user, pay_note=True, reward=True):
+    """Messages that follow an approval, as (chat_id, text[, parse_mode]) for notifier.enqueue_many.
+
+    The user's own approval message comes first. Without `reward` (a
+    renewal whose referral was paid before) there is nothing more to say.
+    """
+    user_id = user["user_id"]
+    lang = user.get('language', 'en')
+    approved_message = catalog.render('approved_message', lang, renewal_date=renewal_date.strftime('%d %B %Y'))
+    messages = [(user_id, approved_message, 'Markdown')]
+    godfather_id = user.get("godfather")
+    if not godfather_id or not reward:
+        return messages
+    messages.append((
+        godfather_id,
+        "🎉 Congratulations! You have earned 2000 FCFA for referring a new user "
+        f"({user.get('name')}). The admin will pay you 2000 FCFA shortly."
+    ))
+    if pay_note:
+        godfather_name = godfather_user.get("name", "Unknown") if godfather_user else str(godfather_id)
+        godfather_phone = godfather_user.get("phone", "Unknown") if godfather_user else "Unknown"
+        godfather_payment_method = godfather_user.get("payment_method", "Unknown").upper() if godfather_user else "Unknown"
+        messages.append((
+            settings.ADMIN_CHAT_ID,
+            f"💸 PAY REFERRAL: Please pay 2000 FCFA to godfather:\n"
+            f"Name: {godfather_name}\n"
+            f"Phone: {godfather_phone}\n"
+            f"User ID: {godfather_id}\n"
+            f"Preferred Payment Method: {godfather_payment_method}\n"
+            f"Reason: Referral of {user.get('name')} (User ID: {user_id})"
+        ))
+    messages.append((user_id, "Your godfather will receive 2000 FCFA from the admin for referring you. Thank you!"))
+    return messages
+
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     action, user_id_str = query.data.split('_', 1)
     user_id = int(user_id_str)
-    user_record = users_collection.find_one({"user_id": user_id})
+    user_record = await users_repo.get_user(user_id)
     if not user_record:
         await query.edit_message_text(text=f"⚠️ Error: User with ID {user_id} not found in the database.")
         return
@@ -268,67 +373,60 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     original_message = query.message.text
     if action == 'approve':
         renewal_date = calculate_renewal_date()
+        referral_path = await users_repo.referral_path(user_id, user_record.get("godfather"))
         update_data = {
-            "status": "Approved",
             "subscription_start_date": datetime.utcnow(),
-            "subscription_renewal_date": datetime.combine(renewal_date, datetime.min.time())
+            "subscription_renewal_date": datetime.combine(renewal_date, datetime.min.time()),
+            "referral_path": referral_path,
+            "referral_depth": path_depth(referral_path),
         }
-        users_collection.update_one({"user_id": user_id}, {"$set": update_data})
-        renewal_date_str = renewal_date.strftime('%d %B %Y')
-        messages = get_messages(lang, renewal_date_str)
+        previous = await users_repo.set_status(user_id, "Approved", update_data)
+        # Anyone who named this user as godfather before now hangs below the new path
+        await users_repo.move_referral_subtree(
+            descendants_prefix((previous or {}).get("referral_path"), user_id),
+            descendants_prefix(referral_path, user_id),
+            settings.REPORT_BATCH_SIZE,
+        )
+        # Approving an expired user again changes nothing; they are still counted
+        reward = False
+        if previous and previous.get("status") not in COUNTED_STATUSES and previous.get("godfather"):
+            await users_repo.adjust_referral_counts(
+                previous["godfather"], previous.get("registration_date") or datetime.utcnow(), 1
+            )
+            # One reward per referred user: a renewal doesn't earn another
+            reward = user_id not in await ledger.rewarded([user_id])
+            if reward:
+                await ledger.record_reward(previous["godfather"], user_id, settings.REFERRAL_REWARD)
         try:
-            # Notify the user
-            await context.bot.send_message(chat_id=user_id, text=messages['approved_message'], parse_mode='Markdown')
-            # Notify godfather instantly if exists
             godfather_id = user_record.get("godfather")
-            if godfather_id:
-                # Notify godfather
-                try:
-                    await context.bot.send_message(
-                        chat_id=godfather_id,
-                        text=(
-                            "🎉 Congratulations! You have earned 2000 FCFA for referring a new user "
-                            f"({user_record.get('name')}). The admin will pay you 2000 FCFA shortly."
-                        )
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify godfather {godfather_id}: {e}")
-                # Notify admin to pay godfather
-                try:
-                    godfather_user = users_collection.find_one({"user_id": godfather_id})
-                    godfather_name = godfather_user.get("name", "Unknown") if godfather_user else str(godfather_id)
-                    godfather_phone = godfather_user.get("phone", "Unknown") if godfather_user else "Unknown"
-                    godfather_payment_method = godfather_user.get("payment_method", "Unknown").upper() if godfather_user else "Unknown"
-                    await context.bot.send_message(
-                        chat_id=settings.ADMIN_CHAT_ID,
-                        text=(
-                            f"💸 PAY REFERRAL: Please pay 2000 FCFA to godfather:\n"
-                            f"Name: {godfather_name}\n"
-                            f"Phone: {godfather_phone}\n"
-                            f"User ID: {godfather_id}\n"
-                            f"Preferred Payment Method: {godfather_payment_method}\n"
-                            f"Reason: Referral of {user_record.get('name')} (User ID: {user_id})"
-                        )
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify admin for godfather payment: {e}")
-                # Notify referred user that their godfather will be paid
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text="Your godfather will receive 2000 FCFA from the admin for referring you. Thank you!"
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify user about godfather payment: {e}")
+            godfather_user = await users_repo.get_user(godfather_id) if godfather_id else None
+            # One outbox insert; the dispatcher sends them side by side
+            approval_sent, *_ = await notifier.enqueue_many(
+                approval_messages(user_record, renewal_date, godfather_user, reward=reward)
+            )
+            if not await approval_sent:
+                raise RuntimeError("approval message was not delivered")
             await query.edit_message_text(text=f"{original_message}\n\n--- [ ✅ APPROVED by {query.from_user.first_name} ] ---")
         except Exception as e:
             logger.error(f"Failed to send approval message to {user_id}: {e}")
             await query.edit_message_text(text=f"{original_message}\n\n--- [ ✅ APPROVED but user could not be notified. ] ---")
     elif action == 'reject':
-        users_collection.update_one({"user_id": user_id}, {"$set": {"status": "Rejected"}})
-        messages = get_messages(lang)
+        previous = await users_repo.set_status(user_id, "Rejected", unset=("referral_path", "referral_depth"))
+        if previous and previous.get("referral_path"):
+            # Their referrals become a root of their own, as for any unapproved godfather
+            await users_repo.move_referral_subtree(
+                descendants_prefix(previous["referral_path"], user_id),
+                descendants_prefix(None, user_id),
+                settings.REPORT_BATCH_SIZE,
+            )
+        if previous and previous.get("status") in COUNTED_STATUSES and previous.get("godfather"):
+            await users_repo.adjust_referral_counts(
+                previous["godfather"], previous.get("registration_date") or datetime.utcnow(), -1
+            )
+            await ledger.record_reversal(previous["godfather"], user_id)
         try:
-            await context.bot.send_message(chat_id=user_id, text=messages['rejected_message'], parse_mode='Markdown')
+            if not await notifier.send(user_id, catalog.render('rejected_message', lang), parse_mode='Markdown'):
+                raise RuntimeError("rejection message was not delivered")
             await query.edit_message_text(text=f"{original_message}\n\n--- [ ❌ REJECTED by {query.from_user.first_name} ] ---")
         except Exception as e:
             logger.error(f"Failed to send rejection message to {user_id}: {e}")
@@ -336,13 +434,13 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     lang = context.user_data.get('language', 'en')
-    await update.message.reply_text(get_messages(lang)['cancel'], reply_markup=ReplyKeyboardRemove())
+    await update.message.reply_text(catalog.render('cancel', lang), reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 # --- Command Handlers ---
 async def renewal_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = users_collection.find_one({"user_id": user_id})
+    user = await users_repo.get_user(user_id)
     if user and user.get("subscription_renewal_date"):
         renewal_date = user["subscription_renewal_date"].strftime('%d %B %Y')
         await update.message.reply_text(f"Your next renewal date is: {renewal_date}")
@@ -356,12 +454,12 @@ async def referral_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    count = users_collection.count_documents({"godfather": user_id})
+    count = (await users_repo.get_referral_counts(user_id))["approved"]
     await update.message.reply_text(f"You have referred {count} people.")
 
 async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = users_collection.find_one({"user_id": user_id})
+    user = await users_repo.get_user(user_id)
     if user:
         info = (
             f"👤 Name: {user.get('name')}\n"
@@ -378,7 +476,7 @@ async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def referral_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    count = users_collection.count_documents({"godfather": user_id})
+    count = (await users_repo.get_referral_counts(user_id))["approved"]
     await update.message.reply_text(f"You have referred {count} people.", reply_markup=MAIN_MENU_KEYBOARD)
 
 async def about_us(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -397,101 +495,657 @@ async def contact_us(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def referral_earnings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    now = datetime.now()
-    last_25th = now.replace(day=settings.RENEWAL_DAY)
-    if now.day < settings.RENEWAL_DAY:
-        last_25th = last_25th - relativedelta(months=1)
-    period_start = last_25th.replace(hour=0, minute=0, second=0, microsecond=0)
-    period_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-    all_time_count = users_collection.count_documents({
-        "godfather": user_id,
-        "status": "Approved"
-    })
-    this_month_count = users_collection.count_documents({
-        "godfather": user_id,
-        "status": "Approved",
-        "registration_date": {"$gte": period_start, "$lte": period_end}
-    })
-    all_time_earnings = all_time_count * settings.REFERRAL_REWARD
-    this_month_earnings = this_month_count * settings.REFERRAL_REWARD
+    summary = await ledger.godfather_summary(user_id, ledger.period_key(datetime.utcnow()))
+    all_time, this_month = summary["all_time"], summary["period"]
     await update.message.reply_text(
         f"💸 *Referral Earnings*\n\n"
-        f"All-time: {all_time_count} referrals = {all_time_earnings} FCFA\n"
-        f"This month: {this_month_count} referrals = {this_month_earnings} FCFA",
+        f"All-time: {all_time['count']} referrals = {all_time['amount']} FCFA\n"
+        f"This month: {this_month['count']} referrals = {this_month['amount']} FCFA",
         parse_mode="Markdown"
     )
 
+async def referral_tree(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    user = await users_repo.get_user(user_id) or {}
+    lang = user.get('language', 'en')
+    tree = await users_repo.referral_tree(user_id, user.get('referral_path'))
+    if not tree["size"]:
+        await update.message.reply_text(catalog.render('referral_tree_empty', lang))
+        return
+    lines = [catalog.render('referral_tree', lang, size=tree["size"], depth=tree["depth"])]
+    lines += [
+        catalog.render('referral_tree_level', lang, level=level, count=count)
+        for level, count in tree["levels"].items()
+    ]
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+# --- Admin Commands ---
+def format_tree_line(user, tree):
+    levels = " · ".join(f"L{level} {count}" for level, count in tree["levels"].items())
+    username = f" @{user['telegram_username']}" if user.get("telegram_username") else ""
+    return (
+        f"{user.get('name', user['user_id'])}{username} [{user['user_id']}]: "
+        f"{tree['size']} in downline, {tree['depth']} level(s)" + (f" — {levels}" if levels else "")
+    )
+
+def format_duplicate_user(user):
+    return f"• {user.get('name', 'Unknown')} [{user['user_id']}] — {user.get('status', 'Unknown')}"
+
+async def duplicate_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    clusters = await users_repo.duplicate_transactions(limit=50)
+    if not clusters:
+        await update.message.reply_text("✅ No transaction ID has been submitted twice.")
+        return
+    lines = [f"⚠️ {len(clusters)} reused transaction ID(s)" + (" (largest 50)" if len(clusters) == 50 else "")]
+    for cluster in clusters:
+        payment_method = (cluster["_id"].get("payment_method") or "unknown").upper()
+        lines.append(f"\n{payment_method} {cluster['_id']['transaction_id']} × {cluster['count']}")
+        lines += [format_duplicate_user(user) for user in cluster["users"]]
+    await update.message.reply_text("\n".join(lines))
+
+async def tree_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args:
+        try:
+            user_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("Usage: /treereport [user_id]")
+            return
+        user = await users_repo.get_user(user_id)
+        if not user:
+            await update.message.reply_text(f"⚠️ User {user_id} not found.")
+            return
+        tree = await users_repo.referral_tree(user_id, user.get("referral_path"))
+        await update.message.reply_text("🌳 " + format_tree_line(user, tree))
+        return
+    referrers = await users_repo.top_referrers(limit=10)
+    if not referrers:
+        await update.message.reply_text("🌳 No approved referrals yet.")
+        return
+    # One index range scan per referrer, run side by side
+    trees = await asyncio.gather(*(
+        users_repo.referral_tree(user["user_id"], user.get("referral_path")) for user in referrers
+    ))
+    lines = ["🌳 Referral trees of the top referrers"]
+    lines += [format_tree_line(user, tree) for user, tree in zip(referrers, trees)]
+    await update.message.reply_text("\n".join(lines))
+
+async def verify_counters(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fix = bool(context.args) and context.args[0].lower() == "fix"
+    result = await users_repo.rebuild_referral_counts(fix=fix, batch_size=settings.REPORT_BATCH_SIZE)
+    mismatched = result["mismatched"]
+    lines = [
+        f"🔢 Referral counters: {result['checked']} godfather(s) checked, {len(mismatched)} mismatched."
+    ]
+    if mismatched:
+        lines.append("Mismatched IDs: " + ", ".join(str(i) for i in mismatched[:50]))
+        lines.append("✅ Counters rebuilt." if fix else "Send /verifycounters fix to rebuild them.")
+    await update.message.reply_text("\n".join(lines))
+
+async def verify_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    fix = bool(context.args) and context.args[0].lower() == "fix"
+    result = await ledger.rebuild_totals(fix=fix, batch_size=settings.REPORT_BATCH_SIZE)
+    mismatched = result["mismatched"]
+    lines = [f"📒 Ledger totals: {result['checked']} checked, {len(mismatched)} mismatched."]
+    if mismatched:
+        lines.append("Mismatched: " + ", ".join(mismatched[:50]))
+        lines.append("✅ Totals rebuilt." if fix else "Send /verifyledger fix to rebuild them.")
+    await update.message.reply_text("\n".join(lines))
+
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = users_repo.cache.stats()
+    await update.message.reply_text(
+        f"🗃️ User cache: {stats['size']}/{stats['maxsize']} entries\n"
+        f"Hits: {stats['hits']} | Misses: {stats['misses']} | Hit rate: {stats['hit_rate']:.1%}\n"
+        f"Evictions: {stats['evictions']} | Expirations: {stats['expirations']}"
+    )
+
+def format_age(delta):
+    hours = int(delta.total_seconds() // 3600)
+    if hours >= 24:
+        return f"{hours // 24}d {hours % 24}h"
+    return f"{hours}h {int(delta.total_seconds() // 60) % 60}m"
+
+async def dashboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    now = datetime.utcnow()
+    numbers = await dashboard.get(now)
+    statuses = numbers["statuses"]
+    lines = [
+        f"📊 Dashboard — period since {numbers['period_start'].strftime('%d %B %Y')}",
+        f"👥 Users: {sum(statuses.values())} — " + " · ".join(
+            f"{status} {count}" for status, count in sorted(statuses.items()) if count
+        ),
+        f"✅ Approved this period: {numbers['approved_this_period']}",
+        f"💰 Revenue: {numbers['approved_this_period'] * settings.SUBSCRIPTION_FEE} FCFA this period, "
+        f"{numbers['approved'] * settings.SUBSCRIPTION_FEE} FCFA all time",
+        f"💸 Referral payouts: {numbers['referred_this_period'] * settings.REFERRAL_REWARD} FCFA owed this period, "
+        f"{numbers['referred'] * settings.REFERRAL_REWARD} FCFA all time",
+        f"\n⏳ Pending approvals: {statuses.get('Pending', 0)}",
+    ]
+    lines += [
+        f"  {user.get('name', 'Unknown')} [{user['user_id']}] — waiting {format_age(now - user['registration_date'])}"
+        for user in numbers["pending"] if user.get("registration_date")
+    ]
+    lines.append("\n🏆 Top godfathers:")
+    lines += [
+        f"  {rank}. {user.get('name', 'Unknown')} [{user['user_id']}] — {user['count']} referral(s)"
+        for rank, user in enumerate(numbers["top_godfathers"], start=1)
+    ] or ["  (none yet)"]
+    lines.append(f"\nComputed {numbers['computed_at'].strftime('%d %b %H:%M')} UTC, kept current since.")
+    await update.message.reply_text("\n".join(lines))
+
+def format_latencies(title, summary, limit=10):
+    lines = [title]
+    if not summary:
+        lines.append("  (no data yet)")
+    busiest = sorted(summary.items(), key=lambda item: item[1]["count"], reverse=True)[:limit]
+    for name, stats in busiest:
+        line = (
+            f"  {name}: {stats['count']}x p50 {stats['p50'] * 1000:.0f}ms "
+            f"p95 {stats['p95'] * 1000:.0f}ms p99 {stats['p99'] * 1000:.0f}ms"
+        )
+        if stats["errors"]:
+            line += f" ({stats['errors']} errors)"
+        lines.append(line)
+    return lines
+
+async def perf(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if context.args and context.args[0].lower() == "reset":
+        metrics.reset()
+        await update.message.reply_text("📈 Performance counters reset.")
+        return
+    since = datetime.fromtimestamp(metrics.started_at).strftime("%d %b %Y %H:%M")
+    lines = [f"📈 Performance since {since}"]
+    lines += format_latencies("Handlers:", metrics.summary("handler"))
+    lines += format_latencies("MongoDB commands:", metrics.summary("mongo"))
+    lines += format_latencies("MongoDB pool waits:", metrics.summary("mongo_pool"))
+    lines += format_latencies("Telegram API:", metrics.summary("telegram"))
+    await update.message.reply_text("\n".join(lines))
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    status = await job_scheduler.status()
+    leader = status["leader"]
+    lines = ["⏰ Scheduled jobs"]
+    if leader:
+        lines.append(f"Leader: {leader['owner']}" + (" (this process)" if leader["owner"] == job_scheduler.owner else ""))
+    for job in status["jobs"]:
+        line = f"• {job['_id']}: next {job['next_run_at']:%d %b %H:%M} UTC"
+        if job.get("last_run_at"):
+            line += f", last {job['last_run_at']:%d %b %H:%M} {job['last_status']}"
+            if job.get("last_duration") is not None:
+                line += f" in {job['last_duration']:.1f}s"
+        lines.append(line)
+    await update.message.reply_text("\n".join(lines))
+
+# --- Pending Approvals ---
+# The /pending keyboard carries its own selection: each user's button shows
+# ☑ or ☐, and the bulk actions read the ticked ones back from the message.
+SELECTED, UNSELECTED = "☑", "☐"
+
+def pending_line(user, now):
+    username = f" @{user['telegram_username']}" if user.get("telegram_username") else ""
+    waiting = f", waiting {format_age(now - user['registration_date'])}" if user.get("registration_date") else ""
+    godfather = f", godfather {user['godfather']}" if user.get("godfather") else ""
+    return (
+        f"• {user.get('name', 'Unknown')}{username} [{user['user_id']}] — "
+        f"{(user.get('payment_method') or '?').upper()} {user.get('transaction_id')}{godfather}{waiting}"
+    )
+
+async def render_pending(page, note=None):
+    users, has_next = await users_repo.pending_page(page, settings.PENDING_PAGE_SIZE)
+    if not users and page > 0:
+        return await render_pending(page - 1, note)
+    lines = [note] if note else []
+    if not users:
+        lines.append("✅ No pending approvals.")
+        return "\n".join(lines), None
+    now = datetime.utcnow()
+    lines.append(f"⏳ Pending approvals — page {page + 1}, oldest first")
+    lines += [pending_line(user, now) for user in users]
+    rows = [
+        [InlineKeyboardButton(f"{UNSELECTED} {user.get('name', 'Unknown')} [{user['user_id']}]",
+                              callback_data=f"pq:{page}:t:{user['user_id']}")]
+        for user in users
+    ]
+    navigation = [InlineKeyboardButton(f"{SELECTED} All", callback_data=f"pq:{page}:s")]
+    if page > 0:
+        navigation.insert(0, InlineKeyboardButton("◀️", callback_data=f"pq:{page - 1}:p"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"pq:{page + 1}:p"))
+    rows.append(navigation)
+    rows.append([
+        InlineKeyboardButton("✅ Approve selected", callback_data=f"pq:{page}:a"),
+        InlineKeyboardButton("❌ Reject selected", callback_data=f"pq:{page}:r"),
+    ])
+    return "\n".join(lines), InlineKeyboardMarkup(rows)
+
+def selected_user_ids(markup):
+    if markup is None:
+        return []
+    return [
+        int(button.callback_data.rsplit(":", 1)[1])
+        for row in markup.inline_keyboard for button in row
+        if button.callback_data.split(":")[2] == "t" and button.text.startswith(SELECTED)
+    ]
+
+def toggle_selection(markup, callback_data):
+    """The same keyboard with one user flipped, or every user ticked for a ":s" button."""
+    select_all = callback_data.endswith(":s")
+    rows = []
+    for row in markup.inline_keyboard:
+        buttons = []
+        for button in row:
+            text = button.text
+            if button.callback_data.split(":")[2] == "t" and (select_all or button.callback_data == callback_data):
+                mark = SELECTED if select_all or text.startswith(UNSELECTED) else UNSELECTED
+                text = mark + text[1:]
+            buttons.append(InlineKeyboardButton(text, callback_data=button.callback_data))
+        rows.append(buttons)
+    return InlineKeyboardMarkup(rows)
+
+async def bulk_approve(user_ids):
+    """Approve the still-pending `user_ids` together. Returns the users approved."""
+    users = await users_repo.find({"user_id": {"$in": user_ids}, "status": "Pending"})
+    if not users:
+        return []
+    renewal_date = calculate_renewal_date()
+    now = datetime.utcnow()
+    paths = await users_repo.referral_paths(users)
+    fields = {
+        user["user_id"]: {
+            "subscription_start_date": now,
+            "subscription_renewal_date": datetime.combine(renewal_date, datetime.min.time()),
+            "referral_path": paths[user["user_id"]],
+            "referral_depth": path_depth(paths[user["user_id"]]),
+        }
+        for user in users
+    }
+    approved = await users_repo.bulk_set_status(users, "Approved", fields)
+    await users_repo.move_referral_subtrees(
+        {descendants_prefix(user.get("referral_path"), user["user_id"]):
+         descendants_prefix(paths[user["user_id"]], user["user_id"]) for user in approved},
+        settings.REPORT_BATCH_SIZE,
+    )
+    referred = [user for user in approved if user.get("godfather")]
+    await users_repo.adjust_referral_counts_many(
+        [(user["godfather"], user.get("registration_date") or now, 1) for user in referred]
+    )
+    # One reward per referred user: renewals whose reward stands don't earn another
+    already = await ledger.rewarded([user["user_id"] for user in referred]) if referred else set()
+    rewarded = [user for user in referred if user["user_id"] not in already]
+    await ledger.record_rewards([(user["godfather"], user["user_id"]) for user in rewarded], settings.REFERRAL_REWARD)
+
+    godfathers = {}
+    if rewarded:
+        godfather_ids = sorted({user["godfather"] for user in rewarded})
+        godfathers = {doc["user_id"]: doc for doc in await users_repo.find({"user_id": {"$in": godfather_ids}})}
+    messages = []
+    for user in approved:
+        messages += approval_messages(user, renewal_date, godfathers.get(user.get("godfather")), pay_note=False,
+                                      reward=user["user_id"] not in already)
+    if rewarded:
+        # One payout note for the admin instead of one per referral
+        lines = [f"💸 PAY REFERRALS: {len(rewarded)} × {settings.REFERRAL_REWARD} FCFA"]
+        for user in rewarded:
+            godfather = godfathers.get(user["godfather"], {})
+            lines.append(
+                f"• {godfather.get('name', user['godfather'])} [{user['godfather']}] "
+                f"{godfather.get('phone', 'Unknown')} {(godfather.get('payment_method') or 'Unknown').upper()}"
+                f" — referral of {user.get('name')} [{user['user_id']}]"
+            )
+        messages.append((settings.ADMIN_CHAT_ID, "\n".join(lines)))
+    await notifier.enqueue_many(messages)
+    return approved
+
+async def bulk_reject(user_ids):
+    """Reject the still-pending `user_ids` together. Returns the users rejected."""
+    users = await users_repo.find({"user_id": {"$in": user_ids}, "status": "Pending"})
+    rejected = await users_repo.bulk_set_status(users, "Rejected", unset=("referral_path", "referral_depth"))
+    await users_repo.move_referral_subtrees(
+        {descendants_prefix(user["referral_path"], user["user_id"]): descendants_prefix(None, user["user_id"])
+         for user in rejected if user.get("referral_path")},
+        settings.REPORT_BATCH_SIZE,
+    )
+    await notifier.enqueue_many([
+        (user["user_id"], catalog.render('rejected_message', user.get('language', 'en')), 'Markdown')
+        for user in rejected
+    ])
+    return rejected
+
+async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        page = max(int(context.args[0]) - 1, 0) if context.args else 0
+    except ValueError:
+        await update.message.reply_text("Usage: /pending [page]")
+        return
+    text, reply_markup = await render_pending(page)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def pending_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_chat.id != settings.ADMIN_CHAT_ID:
+        await query.answer()
+        return
+    _, page, action, *_ = query.data.split(":")
+    page = int(page)
+    if action in ("t", "s"):
+        await query.answer()
+        await query.edit_message_reply_markup(reply_markup=toggle_selection(query.message.reply_markup, query.data))
+        return
+    note = None
+    if action in ("a", "r"):
+        user_ids = selected_user_ids(query.message.reply_markup)
+        if not user_ids:
+            await query.answer("Select at least one user first.")
+            return
+        await query.answer()
+        if action == "a":
+            done = await bulk_approve(user_ids)
+            note = f"✅ {len(done)} user(s) APPROVED by {query.from_user.first_name}"
+        else:
+            done = await bulk_reject(user_ids)
+            note = f"❌ {len(done)} user(s) REJECTED by {query.from_user.first_name}"
+        if len(done) < len(user_ids):
+            note += f" ({len(user_ids) - len(done)} no longer pending)"
+    else:
+        await query.answer()
+    text, reply_markup = await render_pending(page, note)
+    await query.edit_message_text(text=text, reply_markup=reply_markup)
+
+async def send_pending_digest(application, now=None):
+    """Sum up the submissions since the last digest in one admin message. Returns how many there were."""
+    now = now or datetime.utcnow()
+    since = application.bot_data.get("pending_digest_since") or now - timedelta(minutes=settings.ADMIN_DIGEST_MINUTES)
+    users = await users_repo.pending_between(since, now)
+    application.bot_data["pending_digest_since"] = now
+    if not users:
+        return 0
+    reused = await users_repo.reused_transactions(
+        [(user.get("payment_method"), user.get("transaction_id")) for user in users]
+    )
+    lines = [f"🔔 {len(users)} new payment submission(s) since {since.strftime('%d %b %H:%M')} UTC"]
+    for user in users[:30]:
+        flag = " ⚠️ reused transaction ID" if (user.get("payment_method"), user.get("transaction_id")) in reused else ""
+        lines.append(pending_line(user, now) + flag)
+    if len(users) > 30:
+        lines.append(f"…and {len(users) - 30} more")
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("📋 Review pending", callback_data="pq:0:p")]])
+    await notifier.enqueue(settings.ADMIN_CHAT_ID, "\n".join(lines), reply_markup=reply_markup)
+    return len(users)
+
 # --- Monthly Admin Report ---
-async def send_monthly_referral_report(application):
-    now = datetime.now()
-    last_25th = now.replace(day=settings.RENEWAL_DAY)
-    if now.day < settings.RENEWAL_DAY:
-        last_25th = last_25th - relativedelta(months=1)
-    period_start = last_25th.replace(hour=0, minute=0, second=0, microsecond=0)
-    period_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-    users = list(users_collection.find({}))
-    godfather_map = {}
-    for user in users:
-        godfather = user.get("godfather")
-        if godfather:
-            reg_date = user.get("registration_date")
-            status = user.get("status")
-            if reg_date and status == "Approved" and period_start <= reg_date <= period_end:
-                godfather_map.setdefault(godfather, {"count": 0, "user": None})
-                godfather_map[godfather]["count"] += 1
-    # Attach user info for reporting
-    for godfather_id in godfather_map:
-        godfather_map[godfather_id]["user"] = users_collection.find_one({"user_id": godfather_id})
-    total_payout = 0
-    report_lines = ["Referral Earnings Report ({} - {})".format(
-        period_start.strftime("%d %b %Y"), period_end.strftime("%d %b %Y"))]
-    report_lines.append("User | Referrals | Amount (FCFA)")
-    report_lines.append("-" * 35)
-    for godfather_id, data in godfather_map.items():
-        user = data["user"]
-        count = data["count"]
-        amount = count * settings.REFERRAL_REWARD
-        total_payout += amount
-        username = user.get("telegram_username", "") if user else ""
-        name = user.get("name", "") if user else str(godfather_id)
-        report_lines.append(f"{name} (@{username}) | {count} | {amount}")
-        # Notify user if they have earnings
-        if user and amount > 0:
-            try:
-                await application.bot.send_message(
-                    chat_id=godfather_id,
-                    text=f"🎉 You earned {amount} FCFA from {count} referral(s) this month! Thank you for referring new users.",
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify user {godfather_id} of referral earnings: {e}")
-    report_lines.append("-" * 35)
-    report_lines.append(f"Total payout: {total_payout} FCFA")
+def last_completed_period(now=None):
+    """Ledger key of the referral period that ended most recently."""
+    period_start, _ = current_referral_period(now)
+    return ledger.period_key(period_start - relativedelta(days=1))
+
+PAYOUT_COLUMNS = ["godfather_id", "name", "username", "referrals", "amount_fcfa"]
+
+def payout_row(godfather_id, user, count, amount):
+    user = user or {}
+    return [godfather_id, user.get("name", ""), user.get("telegram_username", ""), count, amount]
+
+def period_bounds(period):
+    period_start = datetime.strptime(period, "%Y-%m-%d")
+    return period_start, period_start + relativedelta(months=1, days=-1)
+
+async def write_period_payouts(export, period, settlement=None):
+    """Write each godfather's ledger totals for `period`.
+
+    Given the period's `settlement`, also tell each godfather not yet told
+    what they earned, noting on the settlement how far it got.
+    """
+    notified_through = (settlement or {}).get("notified_through")
+    async for batch in ledger.stream_period_totals(period, settings.REPORT_BATCH_SIZE):
+        export.write(payout_row(row["_id"], row.get("godfather_user"), row["count"], row["amount"]) for row in batch)
+        if settlement is None:
+            continue
+        batch = [row for row in batch if notified_through is None or row["_id"] > notified_through]
+        if not batch:
+            continue
+        # Only godfathers with a profile and earnings
+        earnings = [
+            (row["_id"], f"🎉 You earned {row['amount']} FCFA from {row['count']} referral(s) this month! "
+                         "Thank you for referring new users.")
+            for row in batch if row.get("godfather_user") and row["amount"] > 0
+        ]
+        await notifier.enqueue_many(earnings)
+        notified_through = batch[-1]["_id"]
+        await ledger.record_notified(period, notified_through)
+
+async def send_export(telegram_bot, export, stem, summary):
+    """Upload a finished export to the admin chat, captioned with `summary`. Returns whether it went out."""
     try:
-        await application.bot.send_message(
+        await telegram_bot.send_document(
             chat_id=settings.ADMIN_CHAT_ID,
-            text="\n".join(report_lines)
+            document=export.finish(),
+            filename=export.filename(stem),
+            caption=summary,
         )
+        return True
     except Exception as e:
-        logger.error(f"Failed to send monthly referral report to admin: {e}")
+        logger.error(f"Failed to send {export.filename(stem)} to admin: {e}")
+        error = e
+    try:
+        await notifier.enqueue(settings.ADMIN_CHAT_ID, f"{summary}\n⚠️ The CSV file could not be sent: {error}")
+    except Exception as e:
+        logger.error(f"Failed to tell the admin about {export.filename(stem)}: {e}")
+    return False
+
+async def report_settlement(application, settlement):
+    """Notify the godfathers and send the admin the CSV of a settled period, then mark it reported."""
+    period = settlement["period"]
+    period_start, period_end = period_bounds(period)
+    with CsvExport(PAYOUT_COLUMNS, compress=settings.REPORT_COMPRESS) as export:
+        await write_period_payouts(export, period, settlement)
+        summary = (
+            f"💸 Referral Earnings Report ({period_start.strftime('%d %b %Y')} - {period_end.strftime('%d %b %Y')})\n"
+            f"{export.rows} godfather(s), {settlement['count']} referral(s)\n"
+            f"Total payout: {settlement['amount']} FCFA"
+        )
+        await send_export(application.bot, export, f"referral-payouts-{period}", summary)
+    await ledger.mark_reported(period)
+
+async def send_monthly_referral_report(application, period=None):
+    period = period or last_completed_period()
+    # A report cut short before (a timeout, a restart) is finished first
+    for settlement in await ledger.unreported_settlements(before=period):
+        logger.info(f"Resuming the unfinished report for referral period {settlement['period']}.")
+        await report_settlement(application, settlement)
+    # Once the report is out the settlement says so, which makes a rerun a no-op;
+    # until then a rerun picks up after the last godfather notified
+    settlement = await ledger.settle(period)
+    if settlement is None:
+        logger.info(f"Referral period {period} is already reported; not reporting it again.")
+        return
+    await report_settlement(application, settlement)
+
+EXPORT_USAGE = (
+    "Usage:\n"
+    "/export <from> <to> [status ...] [gz] — referrals per godfather registered between two dates "
+    "(YYYY-MM-DD, inclusive), Approved by default\n"
+    "/export payouts <period start> [gz] — a settled period's payout report again"
+)
+EXPORT_STATUSES = {status.lower(): status for status in ("Pending", "Approved", "Rejected", "Expired")}
+
+def parse_day(text):
+    try:
+        return datetime.strptime(text, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"⚠️ {text} is not a date; use YYYY-MM-DD.") from None
+
+def parse_export_args(args):
+    """(kind, from, to, statuses, compress) from /export arguments. Raises ValueError on bad input."""
+    args = list(args)
+    compress = bool(args) and args[-1].lower() in ("gz", "gzip")
+    if compress:
+        args.pop()
+    if args and args[0].lower() == "payouts":
+        if len(args) != 2:
+            raise ValueError(EXPORT_USAGE)
+        period_start, period_end = period_bounds(ledger.period_key(parse_day(args[1])))
+        return "payouts", period_start, period_end, None, compress
+    if len(args) < 2:
+        raise ValueError(EXPORT_USAGE)
+    since = parse_day(args[0])
+    until = parse_day(args[1]) + timedelta(days=1, microseconds=-1)
+    if until < since:
+        raise ValueError("⚠️ The end date is before the start date.")
+    statuses = []
+    for arg in args[2:]:
+        if arg.lower() not in EXPORT_STATUSES:
+            raise ValueError(f"⚠️ Unknown status {arg}. Use any of: {', '.join(EXPORT_STATUSES.values())}.")
+        statuses.append(EXPORT_STATUSES[arg.lower()])
+    return "referrals", since, until, statuses or ["Approved"], compress
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        kind, since, until, statuses, compress = parse_export_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    span = f"{since.strftime('%d %b %Y')} - {until.strftime('%d %b %Y')}"
+    with CsvExport(PAYOUT_COLUMNS, compress=compress) as export:
+        if kind == "payouts":
+            period = since.strftime("%Y-%m-%d")
+            await write_period_payouts(export, period)
+            settlement = await ledger.get_settlement(period)
+            total = f"Total payout: {settlement['amount']} FCFA" if settlement else "Not settled yet"
+            summary = f"💸 Referral Earnings Report ({span})\n{export.rows} godfather(s)\n{total}"
+            stem = f"referral-payouts-{period}"
+        else:
+            referrals = 0
+            async for batch in users_repo.stream_referral_totals(
+                since, until, settings.REPORT_BATCH_SIZE, statuses=statuses
+            ):
+                export.write(
+                    payout_row(row["_id"], row.get("godfather_user"), row["count"],
+                               row["count"] * settings.REFERRAL_REWARD)
+                    for row in batch
+                )
+                referrals += sum(row["count"] for row in batch)
+            summary = (
+                f"📤 Referrals registered {span} ({', '.join(statuses)})\n"
+                f"{export.rows} godfather(s), {referrals} referral(s), "
+                f"{referrals * settings.REFERRAL_REWARD} FCFA at {settings.REFERRAL_REWARD} FCFA each"
+            )
+            stem = f"referrals-{since:%Y-%m-%d}-{until:%Y-%m-%d}"
+        await send_export(context.bot, export, stem, summary)
+
+# --- Subscription Renewal & Expiry ---
+async def run_renewal_job():
+    try:
+        result = await run_renewal_cycle(
+            users_repo,
+            notifier,
+            catalog,
+            days_ahead=settings.RENEWAL_REMINDER_DAYS,
+            batch_size=settings.EXPIRY_BATCH_SIZE,
+        )
+        dashboard.on_expired(result["expired"])
+    except Exception as e:
+        logger.error(f"Renewal/expiry run failed: {e}")
 
 def setup_scheduler(application):
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(
+    # Stored in Mongo and run by whichever replica holds the scheduler lease.
+    # UTC, the clock of the ledger periods, whatever the host's timezone.
+    job_scheduler.add_job(
+        "monthly_referral_report",
         send_monthly_referral_report,
-        "cron",
-        day=settings.RENEWAL_DAY,
-        hour=0,
-        minute=5,
-        args=[application]
+        CronTrigger(day=settings.RENEWAL_DAY, hour=0, minute=5, timezone="UTC"),
+        args=[application],
+        # Settling is idempotent, so the report is still worth sending days late
+        misfire_grace=settings.REPORT_MISFIRE_SECONDS,
+    )
+    job_scheduler.add_job(
+        "renewal_cycle",
+        run_renewal_job,
+        CronTrigger(hour=0, minute=15, timezone="UTC"),
     )
-    scheduler.start()
+    if settings.ADMIN_DIGEST_MINUTES:
+        job_scheduler.add_job(
+            "pending_digest",
+            send_pending_digest,
+            IntervalTrigger(minutes=settings.ADMIN_DIGEST_MINUTES),
+            args=[application]
+        )
+    job_scheduler.start()
+
+metrics_server = MetricsServer(metrics, settings.METRICS_HOST, settings.METRICS_PORT)
+
+async def verify_indexes():
+    try:
+        created = await users_repo.run(ensure_indexes, mongo.db)
+    except Exception as e:
+        logger.error(f"MongoDB index check failed: {e}")
+        return
+    if created:
+        logger.info(f"Created missing MongoDB indexes: {', '.join(created)}")
+    else:
+        logger.info("MongoDB indexes verified.")
 
 async def on_startup(application):
+    # Index builds can be slow on a large collection; don't hold up startup for them
+    application.create_task(verify_indexes())
+    await notifier.start(application.bot)
+    if settings.METRICS_ENABLED:
+        await metrics_server.start()
     setup_scheduler(application)
 
-def main() -> None:
-    application = Application.builder().token(settings.BOT_TOKEN).build()
+async def on_shutdown(application):
+    await job_scheduler.stop()
+    await notifier.stop()
+    await metrics_server.stop()
+    mongo.close()
+    reports_mongo.close()
+
+def allowed_update_types(application):
+    """Update types that the registered handlers can consume, for allowed_updates."""
+    types = set()
+
+    def visit(handler):
+        if isinstance(handler, ConversationHandler):
+            nested = handler.entry_points + handler.fallbacks
+            nested += [h for state_handlers in handler.states.values() for h in state_handlers]
+            return all([visit(h) for h in nested])
+        if isinstance(handler, CallbackQueryHandler):
+            types.add(Update.CALLBACK_QUERY)
+        elif isinstance(handler, (CommandHandler, MessageHandler)):
+            types.add(Update.MESSAGE)
+        else:
+            return False
+        return True
+
+    for group in application.handlers.values():
+        for handler in group:
+            if not visit(handler):
+                # Unknown handler type, don't risk dropping its updates
+                return Update.ALL_TYPES
+    return sorted(types)
+
+def webhook_options(application):
+    return {
+        "listen": settings.WEBHOOK_LISTEN,
+        "port": settings.WEBHOOK_PORT,
+        "url_path": settings.WEBHOOK_PATH,
+        "webhook_url": f"{settings.WEBHOOK_URL.rstrip('/')}/{settings.WEBHOOK_PATH}",
+        "secret_token": settings.WEBHOOK_SECRET_TOKEN,
+        "allowed_updates": allowed_update_types(application),
+    }
+
+def build_application(builder=None):
+    builder = builder or (
+        Application.builder()
+        .token(settings.BOT_TOKEN)
+        .request(InstrumentedRequest(HTTPXRequest(connection_pool_size=256), metrics))
+        .persistence(persistence)
+        # Different users in parallel, each user's own updates in order
+        .concurrent_updates(PerChatUpdateProcessor(
+            settings.UPDATE_CONCURRENCY, mongo_timeout=settings.MONGO_INTERACTIVE_TIMEOUT or None
+        ))
+    )
+    application = builder.build()
     application.post_init = on_startup
+    application.post_shutdown = on_shutdown
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
@@ -503,10 +1157,13 @@ def main() -> None:
             PAYMENT_METHOD: [CallbackQueryHandler(payment_callback, pattern='^payment_')],
             TRANSACTION_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_transaction_id)],
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="registration",
+        persistent=application.persistence is not None,
     )
     application.add_handler(conv_handler)
     application.add_handler(CallbackQueryHandler(admin_callback, pattern="^(approve_|reject_)"))
+    application.add_handler(CallbackQueryHandler(pending_callback, pattern="^pq:"))
     application.add_handler(CommandHandler("renew", renewal_info))
     application.add_handler(CommandHandler("referral", referral_info))
     application.add_handler(CommandHandler("stats", stats_info))
@@ -515,9 +1172,29 @@ def main() -> None:
     application.add_handler(CommandHandler("aboutus", about_us))
     application.add_handler(CommandHandler("contactus", contact_us))
     application.add_handler(CommandHandler("referral_earnings", referral_earnings))
-    logger.info("Bot is starting...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.add_handler(CommandHandler("referraltree", referral_tree))
+    application.add_handler(CommandHandler("verifycounters", verify_counters, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("verifyledger", verify_ledger, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("cachestats", cache_stats, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("perf", perf, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("treereport", tree_report, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("duplicates", duplicate_transactions, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("dashboard", dashboard_command, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("pending", pending_command, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("jobs", jobs_command, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("export", export_command, filters=ADMIN_FILTER))
+    instrument_handlers(application, metrics)
+    return application
+
+def main() -> None:
+    application = build_application()
+    if settings.UPDATE_MODE == "webhook":
+        options = webhook_options(application)
+        logger.info(f"Bot is starting in webhook mode on {options['listen']}:{options['port']}/{options['url_path']}...")
+        application.run_webhook(**options)
+    else:
+        logger.info("Bot is starting...")
+        application.run_polling(allowed_updates=allowed_update_types(application))
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import string
+
+logger = logging.getLogger("godly_bot")
+
+
+def _escape(value):
+    return str(value).replace("{", "{{").replace("}", "}}")
+
+
+def field_names(template):
+    return {name for _, name, _, _ in string.Formatter().parse(template) if name}
+
+
+def compile_template(template, constants):
+    """Fill in the fields found in `constants`, keeping the others as format fields."""
+    parts = []
+    for literal, name, spec, conversion in string.Formatter().parse(template):
+        parts.append(_escape(literal))
+        if name is None:
+            continue
+        if name in constants:
+            parts.append(_escape(format(constants[name], spec)))
+        else:
+            parts.append("{" + name + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}")
+    return "".join(parts)
+
+
+class MessageCatalog:
+    """User-facing texts keyed by (message, language), compiled once at startup.
+
+    Templates use str.format fields. Fields known at load time (the
+    subscription fee, ...) are substituted when compiling, so messages that
+    only use those are stored as finished strings; the rest keep just their
+    per-call fields, such as `{renewal_date}`, for `render()`. A message
+    missing from a language falls back to the default language.
+    """
+
+    def __init__(self, messages, constants=None, default_language="en"):
+        if default_language not in messages:
+            raise ValueError(f"No messages for the default language '{default_language}'")
+        self.default_language = default_language
+        self.languages = sorted(messages)
+        constants = constants or {}
+        self._static = {}
+        self._templates = {}
+        default = messages[default_language]
+        for lang, texts in messages.items():
+            for key in default.keys() - texts.keys():
+                logger.warning(f"Message '{key}' has no '{lang}' translation, using '{default_language}'.")
+            for key, template in {**default, **texts}.items():
+                compiled = compile_template(template, constants)
+                if field_names(compiled):
+                    self._templates[(key, lang)] = compiled
+                else:
+                    # Undo the escaping; nothing is left to fill in
+                    self._static[(key, lang)] = compiled.format()
+
+    @classmethod
+    def from_directory(cls, directory, constants=None, default_language="en"):
+        """Load one `<language>.json` file of {key: template} per language."""
+        messages = {}
+        for filename in sorted(os.listdir(directory)):
+            lang, ext = os.path.splitext(filename)
+            if ext == ".json":
+                with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                    messages[lang] = json.load(f)
+        return cls(messages, constants, default_language)
+
+    def render(self, key, lang, **fields):
+        text = self._static.get((key, lang))
+        if text is not None:
+            return text
+        template = self._templates.get((key, lang))
+        if template is None:
+            if lang not in self.languages:
+                return self.render(key, self.default_language, **fields)
+            raise KeyError(f"Unknown message '{key}'")
+        return template.format_map(fields)
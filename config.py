@@ -1,4 +1,5 @@
-from pydantic import BaseSettings, Field
+from typing import Optional
+from pydantic import BaseSettings, Field, root_validator
 
 class Settings(BaseSettings):
     BOT_TOKEN: str = Field(..., env="BOT_TOKEN")
@@ -8,6 +9,66 @@ class Settings(BaseSettings):
     SUBSCRIPTION_FEE: int = 5000
     RENEWAL_DAY: int = 25
     REFERRAL_REWARD: int = 2000
+    MONGO_MAX_WORKERS: int = 8
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+    MONGO_CONNECT_TIMEOUT_MS: int = 20000
+    MONGO_SOCKET_TIMEOUT_MS: Optional[int] = None  # None waits as long as the operation takes
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = None
+    MONGO_READ_PREFERENCE: str = "primary"
+    MONGO_INTERACTIVE_TIMEOUT: float = 5.0  # per call while handling an update; 0 disables
+    MONGO_REPORT_READ_PREFERENCE: str = "secondaryPreferred"
+    MONGO_REPORT_POOL_SIZE: int = 10
+    MONGO_REPORT_WORKERS: int = 2
+    REPORT_BATCH_SIZE: int = 500
+    REPORT_COMPRESS: bool = False  # gzip the monthly report's CSV
+    NOTIFY_CONCURRENCY: int = 8
+    NOTIFY_GLOBAL_RATE: float = 25.0
+    NOTIFY_CHAT_INTERVAL: float = 1.0
+    NOTIFY_MAX_ATTEMPTS: int = 5
+    NOTIFY_LEASE_SECONDS: float = 60.0
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: float = 60.0
+    USERNAME_CACHE_SIZE: int = 10000
+    USERNAME_CACHE_TTL: float = 600.0
+    DASHBOARD_MAX_AGE: float = 3600.0
+    PENDING_PAGE_SIZE: int = 8
+    ADMIN_DIGEST_MINUTES: int = 0
+    UPDATE_CONCURRENCY: int = 64
+    SCHEDULER_LEASE_SECONDS: float = 60.0
+    SCHEDULER_TICK_SECONDS: float = 15.0
+    SCHEDULER_MISFIRE_SECONDS: float = 6 * 3600.0
+    REPORT_MISFIRE_SECONDS: float = 27 * 24 * 3600.0
+    PERSISTENCE_INTERVAL: float = 5.0
+    RENEWAL_REMINDER_DAYS: int = 3
+    EXPIRY_BATCH_SIZE: int = 500
+    UPDATE_MODE: str = "polling"  # "polling" or "webhook"
+    WEBHOOK_URL: Optional[str] = None  # public base URL, e.g. https://mybot.up.railway.app
+    WEBHOOK_PATH: str = "telegram"
+    WEBHOOK_LISTEN: str = "0.0.0.0"
+    WEBHOOK_PORT: int = Field(8443, env=["WEBHOOK_PORT", "PORT"])
+    WEBHOOK_SECRET_TOKEN: Optional[str] = None
+    METRICS_ENABLED: bool = True  # serve /metrics for Prometheus on METRICS_HOST:METRICS_PORT
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9100
+
+    @root_validator
+    def check_update_mode(cls, values):
+        mode = values.get("UPDATE_MODE")
+        if mode not in ("polling", "webhook"):
+            raise ValueError("UPDATE_MODE must be 'polling' or 'webhook'")
+        if mode == "webhook" and not (values.get("WEBHOOK_URL") and values.get("WEBHOOK_SECRET_TOKEN")):
+            raise ValueError("webhook mode requires WEBHOOK_URL and WEBHOOK_SECRET_TOKEN")
+        return values
+
+    @root_validator
+    def check_read_preferences(cls, values):
+        modes = ("primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest")
+        for name in ("MONGO_READ_PREFERENCE", "MONGO_REPORT_READ_PREFERENCE"):
+            if values.get(name) is not None and values[name] not in modes:
+                raise ValueError(f"{name} must be one of {', '.join(modes)}")
+        return values
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,193 @@
+"""Admin dashboard numbers, kept in memory between /dashboard calls.
+
+The first call computes everything with one `$facet` aggregation over
+users. After that, status changes reported by the repository are applied
+to the cached snapshot in place: registrations, approvals, rejections
+and expiries. Repeated calls then cost no round-trip. Two sections, the
+oldest pending users and the top godfathers, cannot always be patched
+from one event. When that happens, only that section is reloaded with a
+small indexed query. The whole snapshot is recomputed when the period
+rolls over, and after `max_age` seconds. The second case picks up
+writes made by other processes.
+"""
+import time
+from datetime import datetime
+
+from repository import COUNTED_STATUSES, referral_period_key
+
+class Dashboard:
+    def __init__(self, collection, run, renewal_day=25, pending_limit=10, top_limit=5,
+                 max_age=3600.0, clock=time.monotonic):
+        self.collection = collection
+        self._run = run
+        self.renewal_day = renewal_day
+        self.pending_limit = pending_limit
+        self.top_limit = top_limit
+        self.max_age = max_age
+        self._clock = clock
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._stale = set()
+        self._events = 0
+        self.refreshes = 0
+
+    def period_start(self, now):
+        return datetime.strptime(referral_period_key(now, self.renewal_day), "%Y-%m-%d")
+
+    # --- Queries ---
+    def _pending_pipeline(self):
+        return [
+            {"$match": {"status": "Pending"}},
+            {"$sort": {"registration_date": 1}},
+            {"$limit": self.pending_limit},
+            {"$project": {"_id": 0, "user_id": 1, "name": 1, "registration_date": 1}},
+        ]
+
+    def _top_pipeline(self):
+        return [
+            {"$match": {"referral_counts.approved": {"$gt": 0}}},
+            {"$sort": {"referral_counts.approved": -1}},
+            {"$limit": self.top_limit},
+            {"$project": {"_id": 0, "user_id": 1, "name": 1, "count": "$referral_counts.approved"}},
+        ]
+
+    def pipeline(self, period_start):
+        counted = {"status": {"$in": COUNTED_STATUSES}}
+        referred = {"$cond": [{"$ifNull": ["$godfather", False]}, 1, 0]}
+        return [{"$facet": {
+            "statuses": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+            "pending": self._pending_pipeline(),
+            "totals": [
+                {"$match": counted},
+                {"$group": {
+                    "_id": None,
+                    "referred": {"$sum": referred},
+                    "approved_this_period": {"$sum": {
+                        "$cond": [{"$gte": ["$subscription_start_date", period_start]}, 1, 0]
+                    }},
+                    "referred_this_period": {"$sum": {
+                        "$cond": [{"$gte": ["$subscription_start_date", period_start]}, referred, 0]
+                    }},
+                }},
+            ],
+            "top_godfathers": self._top_pipeline(),
+        }}]
+
+    def _compute(self, period_start):
+        result = next(self.collection.aggregate(self.pipeline(period_start), allowDiskUse=True))
+        totals = (result["totals"] or [{}])[0]
+        statuses = {doc["_id"]: doc["count"] for doc in result["statuses"] if doc["_id"] is not None}
+        return {
+            "period_start": period_start,
+            "computed_at": datetime.utcnow(),
+            "statuses": statuses,
+            "pending": result["pending"],
+            "approved": sum(statuses.get(status, 0) for status in COUNTED_STATUSES),
+            "referred": totals.get("referred", 0),
+            "approved_this_period": totals.get("approved_this_period", 0),
+            "referred_this_period": totals.get("referred_this_period", 0),
+            "top_godfathers": result["top_godfathers"],
+        }
+
+    def _reload_section(self, section):
+        pipeline = self._pending_pipeline() if section == "pending" else self._top_pipeline()
+        return list(self.collection.aggregate(pipeline))
+
+    async def get(self, now=None):
+        """The current numbers; a copy of the cached snapshot whenever it is still good."""
+        now = now or datetime.utcnow()
+        period_start = self.period_start(now)
+        snapshot = self._snapshot
+        if (snapshot is None or snapshot["period_start"] != period_start
+                or self._clock() - self._loaded_at >= self.max_age):
+            events = self._events
+            snapshot = await self._run(self._compute, period_start)
+            self.refreshes += 1
+            # An event that landed during the aggregation may be missing from it
+            if events == self._events:
+                self._snapshot, self._loaded_at, self._stale = snapshot, self._clock(), set()
+            return self._copy(snapshot)
+        for section in sorted(self._stale):
+            events = self._events
+            rows = await self._run(self._reload_section, section)
+            if events == self._events and self._snapshot is snapshot:
+                snapshot["pending" if section == "pending" else "top_godfathers"] = rows
+                self._stale.discard(section)
+        return self._copy(snapshot)
+
+    @staticmethod
+    def _copy(snapshot):
+        return {
+            **snapshot,
+            "statuses": dict(snapshot["statuses"]),
+            "pending": list(snapshot["pending"]),
+            "top_godfathers": [dict(row) for row in snapshot["top_godfathers"]],
+        }
+
+    def invalidate(self):
+        self._events += 1
+        self._snapshot = None
+
+    # --- Write events ---
+    def on_status_change(self, user_id, before, status, fields):
+        """Apply one user's move from `before["status"]` to `status` to the snapshot.
+
+        `fields` are the values written with the new status.
+        """
+        self._events += 1
+        snapshot = self._snapshot
+        old = (before or {}).get("status")
+        if snapshot is None or old == status:
+            return
+        statuses = snapshot["statuses"]
+        if old is not None:
+            statuses[old] = statuses.get(old, 0) - 1
+        statuses[status] = statuses.get(status, 0) + 1
+
+        if old == "Pending":
+            pending = snapshot["pending"]
+            snapshot["pending"] = [user for user in pending if user["user_id"] != user_id]
+            if len(snapshot["pending"]) < len(pending) and statuses["Pending"] > len(snapshot["pending"]):
+                self._stale.add("pending")
+        if status == "Pending" and "pending" not in self._stale:
+            # Newest registration, so it only belongs in the list if the list holds every pending user
+            if statuses["Pending"] - 1 == len(snapshot["pending"]) < self.pending_limit:
+                snapshot["pending"].append({
+                    "user_id": user_id, "name": fields.get("name"),
+                    "registration_date": fields.get("registration_date"),
+                })
+
+        delta = (status in COUNTED_STATUSES) - (old in COUNTED_STATUSES)
+        if not delta:
+            return
+        doc = fields if delta > 0 else before
+        godfather = (before or {}).get("godfather") or fields.get("godfather")
+        snapshot["approved"] += delta
+        start = doc.get("subscription_start_date")
+        in_period = start is not None and start >= snapshot["period_start"]
+        if in_period:
+            snapshot["approved_this_period"] += delta
+        if godfather:
+            snapshot["referred"] += delta
+            if in_period:
+                snapshot["referred_this_period"] += delta
+            self._godfather_changed(godfather, delta)
+
+    def _godfather_changed(self, godfather, delta):
+        top = self._snapshot["top_godfathers"]
+        entry = next((row for row in top if row["user_id"] == godfather), None)
+        if entry is not None and delta > 0:
+            # Moving up within the list cannot let anyone outside it in
+            entry["count"] += delta
+            top.sort(key=lambda row: row["count"], reverse=True)
+        else:
+            self._stale.add("top")
+
+    def on_expired(self, count):
+        """`count` Approved users were moved to Expired; both still count as approved."""
+        self._events += 1
+        if self._snapshot is None or not count:
+            return
+        statuses = self._snapshot["statuses"]
+        statuses["Approved"] = statuses.get("Approved", 0) - count
+        statuses["Expired"] = statuses.get("Expired", 0) + count
@@ -0,0 +1,148 @@
+import logging
+import threading
+from contextvars import ContextVar
+
+import pymongo
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+
+logger = logging.getLogger("godly_bot")
+
+# Seconds each blocking call may take while an update is being handled;
+# set by the update processor, None outside of updates (jobs, startup)
+interactive_timeout = ContextVar("interactive_timeout", default=None)
+
+
+def call_with_timeout(seconds, fn):
+    """Call `fn` with every MongoDB operation inside it bounded by `seconds` in total.
+
+    The limit covers server selection, waiting for a pooled connection and
+    the operation itself, so a busy pool fails fast instead of queueing.
+    """
+    with pymongo.timeout(seconds):
+        return fn()
+
+INDEXES = {
+    "users": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+        IndexModel([("telegram_username", ASCENDING)]),
+        IndexModel([("username_key", ASCENDING)]),
+        IndexModel([("godfather", ASCENDING), ("status", ASCENDING), ("registration_date", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("registration_date", ASCENDING)]),
+        IndexModel([("payment_method", ASCENDING), ("transaction_id", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("user_id", ASCENDING), ("subscription_renewal_date", ASCENDING)]),
+        IndexModel([("referral_path", ASCENDING), ("referral_depth", ASCENDING)]),
+        IndexModel([("referral_counts.approved", DESCENDING)]),
+    ],
+    "outbox": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("owner", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)]),
+    ],
+    "ledger": [
+        IndexModel([("user_id", ASCENDING), ("type", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("type", ASCENDING), ("period", ASCENDING)]),
+    ],
+    "ledger_totals": [IndexModel([("kind", ASCENDING), ("period", ASCENDING), ("godfather", ASCENDING)])],
+    "conversations": [IndexModel([("name", ASCENDING)])],
+    "shard_plans": [IndexModel([("created_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600)],
+    "scheduler_runs": [
+        IndexModel([("job", ASCENDING), ("started_at", DESCENDING)]),
+        IndexModel([("started_at", ASCENDING)], expireAfterSeconds=90 * 24 * 3600),
+    ],
+}
+
+
+def missing_indexes(collection, models):
+    """The index models whose key pattern does not exist on the collection yet."""
+    existing = {tuple(map(tuple, info["key"])) for info in collection.index_information().values()}
+    return [model for model in models if tuple(model.document["key"].items()) not in existing]
+
+
+def ensure_indexes(db, indexes=INDEXES):
+    """Create only the indexes that are missing. Returns the names created.
+
+    Costs one index listing per collection when everything is in place,
+    so it is cheap to run on every boot.
+    """
+    created = []
+    for collection_name, models in indexes.items():
+        collection = db[collection_name]
+        missing = missing_indexes(collection, models)
+        if missing:
+            created += collection.create_indexes(missing)
+    return created
+
+
+class MongoConnection:
+    """Creates the MongoClient on first use rather than at import.
+
+    Collections handed out by `collection()` are placeholders that connect
+    when first touched, so the objects built at import time (repository,
+    outbox, persistence) cost no network round-trip until the bot is
+    actually running. Safe to touch first from executor threads.
+    """
+
+    def __init__(self, uri, db_name, client_factory=MongoClient, **client_options):
+        self.uri = uri
+        self.db_name = db_name
+        self.client_factory = client_factory
+        self.client_options = client_options
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._client is not None
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.client_factory(self.uri, **self.client_options)
+                    logger.info("Connected to MongoDB.")
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class LazyDatabase:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getitem__(self, name):
+        return LazyCollection(self._connection, name)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return LazyCollection(self._connection, name)
+
+
+class LazyCollection:
+    """Stands in for a pymongo Collection until the first attribute access that needs the server."""
+
+    def __init__(self, connection, name):
+        self._connection = connection
+        self.name = name
+
+    @property
+    def database(self):
+        return LazyDatabase(self._connection)
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self._connection.db[self.name], attr)
@@ -0,0 +1,80 @@
+import asyncio
+from contextlib import AsyncExitStack
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from database import interactive_timeout
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but one at a time per user and per chat.
+
+    Each update holds a lock for its user and one for its chat while its
+    handlers run. So one user's conversation steps run in arrival order,
+    while other users' updates go ahead side by side, up to
+    `max_concurrent_updates` at once. Locks are taken in a fixed order, so
+    an update that needs both never deadlocks with another. Only keys with
+    an update in flight are tracked.
+
+    An update waiting behind its own user's earlier one already holds a
+    concurrency slot. Keep the limit well above the number of updates a
+    single user can have in flight.
+
+    With `mongo_timeout`, each MongoDB call made through the repository
+    while an update is handled must finish within that many seconds.
+    """
+
+    def __init__(self, max_concurrent_updates, mongo_timeout=None):
+        super().__init__(max_concurrent_updates)
+        self.mongo_timeout = mongo_timeout
+        self._locks = {}
+
+    @staticmethod
+    def keys(update):
+        if not isinstance(update, Update):
+            return []
+        keys = set()
+        if update.effective_user is not None:
+            keys.add(("user", update.effective_user.id))
+        if update.effective_chat is not None:
+            keys.add(("chat", update.effective_chat.id))
+        return sorted(keys)
+
+    @property
+    def active_keys(self):
+        return len(self._locks)
+
+    def _checkout(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _checkin(self, key):
+        entry = self._locks[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        keys = self.keys(update)
+        # Checked out before the first await, so arrival order decides who goes first
+        locks = [self._checkout(key) for key in keys]
+        token = interactive_timeout.set(self.mongo_timeout)
+        try:
+            async with AsyncExitStack() as stack:
+                for lock in locks:
+                    await stack.enter_async_context(lock)
+                await coroutine
+        finally:
+            interactive_timeout.reset(token)
+            for key in keys:
+                self._checkin(key)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
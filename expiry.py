@@ -0,0 +1,140 @@
+"""Subscription renewal reminders and expiry.
+
+Runs daily from the bot's scheduler. For a large month-end run it can also
+be split across processes by user_id range:
+
+    python expiry.py --shards 4 --shard 0   # and 1, 2, 3 in other processes
+
+The first process of a run stores the ranges in `shard_plans`, and the
+others read them back, so the shards neither overlap nor leave gaps.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("godly_bot")
+
+REMINDER_PROJECTION = {"_id": 0, "user_id": 1, "language": 1, "subscription_renewal_date": 1, "renewal_reminder_for": 1}
+REMINDED_PROJECTION = {"_id": 0, "user_id": 1}
+EXPIRY_PROJECTION = {"_id": 0, "user_id": 1, "language": 1, "subscription_renewal_date": 1}
+
+
+def start_of_day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def send_renewal_reminders(repo, notifier, catalog, now, days_ahead, batch_size,
+                                 min_user_id=None, max_user_id=None):
+    """Remind Approved users whose renewal date falls within `days_ahead` days, once per renewal date."""
+    today = start_of_day(now)
+    query = {
+        "status": "Approved",
+        "subscription_renewal_date": {"$gte": today, "$lt": today + timedelta(days=days_ahead + 1)},
+    }
+    reminded = 0
+    async for batch in repo.stream_users(query, REMINDER_PROJECTION, batch_size, min_user_id, max_user_id):
+        due = [user for user in batch if user.get("renewal_reminder_for") != user["subscription_renewal_date"]]
+        if not due:
+            continue
+        # Marked first, guarded per user, so a process running over the same users reminds nobody twice
+        modified = await repo.bulk_update_users([
+            (user["user_id"], {"renewal_reminder_for": {"$ne": user["subscription_renewal_date"]}},
+             {"$set": {"renewal_reminder_for": user["subscription_renewal_date"], "renewal_reminded_at": now}})
+            for user in due
+        ])
+        if modified < len(due):
+            # Someone else reminded a few of them; only notify the ones this run marked
+            reminded_ids = {user["user_id"] async for chunk in repo.stream_users(
+                {"user_id": {"$in": [user["user_id"] for user in due]}, "renewal_reminded_at": now},
+                REMINDED_PROJECTION, batch_size,
+            ) for user in chunk}
+            due = [user for user in due if user["user_id"] in reminded_ids]
+        await notifier.enqueue_many([
+            (user["user_id"], catalog.render(
+                'renewal_reminder', user.get("language", "en"),
+                renewal_date=user["subscription_renewal_date"].strftime('%d %B %Y'),
+            ))
+            for user in due
+        ], parse_mode='Markdown')
+        reminded += modified
+    return reminded
+
+
+async def expire_subscriptions(repo, notifier, catalog, now, batch_size, min_user_id=None, max_user_id=None):
+    """Move Approved users whose renewal date has passed to Expired."""
+    cutoff = start_of_day(now)
+    match = {"status": "Approved", "subscription_renewal_date": {"$lt": cutoff}}
+    expired = 0
+    async for batch in repo.stream_users(match, EXPIRY_PROJECTION, batch_size, min_user_id, max_user_id):
+        # The filter is repeated per update so a renewal approved meanwhile is left alone
+        modified = await repo.bulk_update_users([
+            (user["user_id"], match, {"$set": {"status": "Expired", "expired_at": now}})
+            for user in batch
+        ])
+        if modified < len(batch):
+            # Some users renewed meanwhile; only notify the ones actually expired
+            expired_ids = {user["user_id"] async for chunk in repo.stream_users(
+                {"user_id": {"$in": [user["user_id"] for user in batch]}, "status": "Expired", "expired_at": now},
+                {"_id": 0, "user_id": 1}, batch_size,
+            ) for user in chunk}
+            batch = [user for user in batch if user["user_id"] in expired_ids]
+        await notifier.enqueue_many([
+            (user["user_id"], catalog.render('subscription_expired', user.get("language", "en")))
+            for user in batch
+        ], parse_mode='Markdown')
+        expired += modified
+    return expired
+
+
+async def run_renewal_cycle(repo, notifier, catalog, days_ahead=3, batch_size=500,
+                            min_user_id=None, max_user_id=None, now=None):
+    now = now or datetime.now()
+    expired = await expire_subscriptions(repo, notifier, catalog, now, batch_size, min_user_id, max_user_id)
+    reminded = await send_renewal_reminders(
+        repo, notifier, catalog, now, days_ahead, batch_size, min_user_id, max_user_id
+    )
+    logger.info(
+        f"Renewal cycle for user_id range [{min_user_id}, {max_user_id}): "
+        f"{expired} expired, {reminded} reminded."
+    )
+    return {"expired": expired, "reminded": reminded}
+
+
+async def run_shard(shard, shards, run_id):
+    import bot
+    from telegram import Bot
+
+    ranges = await bot.users_repo.planned_user_id_ranges(f"expiry:{run_id}:{shards}", shards)
+    if shard >= len(ranges):
+        logger.info(f"Shard {shard} has no users to process.")
+        return
+    min_user_id, max_user_id = ranges[shard]
+    async with Bot(bot.settings.BOT_TOKEN) as telegram_bot:
+        await bot.notifier.start(telegram_bot, restore=False)
+        try:
+            await run_renewal_cycle(
+                bot.users_repo, bot.notifier, bot.catalog,
+                days_ahead=bot.settings.RENEWAL_REMINDER_DAYS,
+                batch_size=bot.settings.EXPIRY_BATCH_SIZE,
+                min_user_id=min_user_id, max_user_id=max_user_id,
+            )
+            await bot.notifier.join()
+        finally:
+            await bot.notifier.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the subscription renewal/expiry cycle for one user_id range.")
+    parser.add_argument("--shards", type=int, default=1, help="number of worker processes splitting the run")
+    parser.add_argument("--shard", type=int, default=0, help="which range this process handles (0-based)")
+    parser.add_argument("--run", default=datetime.utcnow().strftime("%Y-%m-%d"),
+                        help="label shared by the processes of one run, which split alike (default: today, UTC)")
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.shards:
+        parser.error("--shard must be between 0 and --shards - 1")
+    asyncio.run(run_shard(args.shard, args.shards, args.run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""CSV files written row batch by row batch, for sending as Telegram documents.
+
+Rows go straight to an anonymous temporary file on disk, gzipped if
+asked, as they come off the Mongo cursor. Only the batch being written
+is ever in memory, however many rows the export has. The file is
+deleted when the export is closed.
+"""
+import csv
+import gzip
+import io
+import os
+import tempfile
+
+
+class CsvExport:
+    def __init__(self, header, compress=False):
+        self.compress = compress
+        self.file = tempfile.TemporaryFile()
+        self._gzip = gzip.GzipFile(fileobj=self.file, mode="wb") if compress else None
+        self._text = io.TextIOWrapper(self._gzip or self.file, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(header)
+        self.rows = 0
+        self.finished = False
+
+    def filename(self, stem):
+        return f"{stem}.csv.gz" if self.compress else f"{stem}.csv"
+
+    def write(self, rows):
+        for row in rows:
+            self._writer.writerow(row)
+            self.rows += 1
+
+    def finish(self):
+        """Flush everything and rewind. Returns the file, ready to upload."""
+        if not self.finished:
+            self._text.flush()
+            # Let go of the wrapper without closing the file under it
+            self._text.detach()
+            if self._gzip is not None:
+                self._gzip.close()
+            self.finished = True
+        self.file.seek(0)
+        return self.file
+
+    @property
+    def size(self):
+        """Bytes written so far, compressed if compressing."""
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,222 @@
+"""Scheduled jobs that run once across all replicas and survive restarts.
+
+Each job's next run time is kept in the `scheduler_jobs` collection.
+Every replica ticks, but only the holder of the lease in
+`scheduler_locks` runs anything. The leader renews the lease on every
+tick. If the leader dies, another replica takes over once the lease has
+expired. Each run is also claimed by moving the job's `next_run_at`
+forward with a compare-and-set, so a stale leader can never repeat a run.
+
+Runs missed while no replica was up are caught up on the next tick.
+Several missed runs of one job count as one. A run more than its job's
+misfire grace late (the scheduler's `misfire_grace` unless the job sets
+its own) is recorded as missed instead of being run.
+Every run, with its duration, is recorded in `scheduler_runs`.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("godly_bot")
+
+LEADER_LOCK = "scheduler"
+
+
+def _aware(moment):
+    return moment.replace(tzinfo=timezone.utc)
+
+
+def _naive(moment):
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class JobScheduler:
+    def __init__(self, database, run, owner=None, lease_seconds=60.0, tick_seconds=15.0,
+                 misfire_grace=6 * 3600.0, clock=datetime.utcnow):
+        self.jobs_collection = database.scheduler_jobs
+        self.runs = database.scheduler_runs
+        self.locks = database.scheduler_locks
+        self._run = run
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease = timedelta(seconds=lease_seconds)
+        self.tick_seconds = tick_seconds
+        self.misfire_grace = timedelta(seconds=misfire_grace)
+        self._clock = clock
+        self._jobs = {}
+        self._running = {}
+        self._registered = False
+        self._task = None
+        self.is_leader = False
+
+    def add_job(self, name, func, trigger, args=(), misfire_grace=None):
+        """Run `await func(*args)` whenever the APScheduler `trigger` fires.
+
+        `misfire_grace` (seconds) overrides the scheduler's for this job.
+        """
+        grace = self.misfire_grace if misfire_grace is None else timedelta(seconds=misfire_grace)
+        self._jobs[name] = (func, trigger, tuple(args), grace)
+
+    def next_fire_time(self, trigger, now):
+        """The trigger's first fire time at or after `now`, as naive UTC."""
+        fire_time = trigger.get_next_fire_time(None, _aware(now))
+        return _naive(fire_time) if fire_time else None
+
+    # --- Bookkeeping in Mongo ---
+    def _register(self, now):
+        for name, (_, trigger, _, _) in self._jobs.items():
+            schedule = str(trigger)
+            # A changed schedule (say, a new RENEWAL_DAY) starts over from now
+            self.jobs_collection.update_one(
+                {"_id": name, "schedule": {"$ne": schedule}},
+                {"$set": {"schedule": schedule, "next_run_at": self.next_fire_time(trigger, now)}},
+                upsert=False,
+            )
+            try:
+                self.jobs_collection.update_one(
+                    {"_id": name},
+                    {"$setOnInsert": {"schedule": schedule, "next_run_at": self.next_fire_time(trigger, now)}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                pass
+
+    def _acquire_lease(self, now):
+        try:
+            self.locks.find_one_and_update(
+                {"_id": LEADER_LOCK, "$or": [{"owner": self.owner}, {"lease_until": {"$lte": now}}]},
+                {"$set": {"owner": self.owner, "lease_until": now + self.lease, "renewed_at": now}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Someone else holds an unexpired lease
+            return False
+        return True
+
+    def _release_lease(self):
+        self.locks.delete_one({"_id": LEADER_LOCK, "owner": self.owner})
+
+    def _claim_due(self, now):
+        """Advance every due job past `now`. Returns (name, scheduled_for) for the runs this replica won."""
+        claimed = []
+        due = self.jobs_collection.find(
+            {"_id": {"$in": list(self._jobs)}, "next_run_at": {"$lte": now}}, {"next_run_at": 1}
+        )
+        for doc in due:
+            _, trigger, _, _ = self._jobs[doc["_id"]]
+            won = self.jobs_collection.find_one_and_update(
+                {"_id": doc["_id"], "next_run_at": doc["next_run_at"]},
+                {"$set": {"next_run_at": self.next_fire_time(trigger, now + timedelta(microseconds=1))}},
+                return_document=ReturnDocument.BEFORE,
+            )
+            if won:
+                claimed.append((doc["_id"], doc["next_run_at"]))
+        return claimed
+
+    def _record(self, name, scheduled_for, started_at, status, duration=None, error=None):
+        run = {
+            "job": name,
+            "scheduled_for": scheduled_for,
+            "started_at": started_at,
+            "duration": duration,
+            "status": status,
+            "error": error,
+            "owner": self.owner,
+        }
+        self.runs.insert_one(run)
+        self.jobs_collection.update_one(
+            {"_id": name},
+            {"$set": {"last_status": status, "last_run_at": started_at, "last_duration": duration}},
+        )
+        return run
+
+    # --- Running ---
+    async def tick(self, now=None):
+        """Renew or take the lease, then start every due job. Returns the tasks started."""
+        now = now or self._clock()
+        if not self._registered:
+            await self._run(self._register, now)
+            self._registered = True
+        self.is_leader = await self._run(self._acquire_lease, now)
+        if not self.is_leader:
+            return []
+        started = []
+        for name, scheduled_for in await self._run(self._claim_due, now):
+            if now - scheduled_for > self._jobs[name][3]:
+                logger.warning(f"Skipping job {name} scheduled for {scheduled_for:%d %b %H:%M}: past the misfire window.")
+                await self._run(self._record, name, scheduled_for, now, "missed")
+                continue
+            if name in self._running:
+                logger.warning(f"Job {name} is still running; skipping its {scheduled_for:%d %b %H:%M} run.")
+                await self._run(self._record, name, scheduled_for, now, "skipped")
+                continue
+            # Runs in its own task so that a long job doesn't hold up lease renewal
+            task = self._running[name] = asyncio.create_task(self._execute(name, scheduled_for))
+            started.append(task)
+        return started
+
+    async def _execute(self, name, scheduled_for):
+        func, _, args, _ = self._jobs[name]
+        started_at = self._clock()
+        started = time.perf_counter()
+        status, error = "ok", None
+        try:
+            await func(*args)
+        except Exception as e:
+            logger.error(f"Scheduled job {name} failed: {e}")
+            status, error = "error", str(e)
+        finally:
+            self._running.pop(name, None)
+        duration = time.perf_counter() - started
+        try:
+            return await self._run(self._record, name, scheduled_for, started_at, status, duration, error)
+        except Exception as e:
+            logger.error(f"Could not record the run of job {name}: {e}")
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {e}")
+            await asyncio.sleep(self.tick_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._running:
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+        if self.is_leader:
+            # Let another replica take over now rather than when the lease runs out
+            try:
+                await self._run(self._release_lease)
+            except Exception as e:
+                logger.error(f"Could not release the scheduler lease: {e}")
+            self.is_leader = False
+
+    # --- Reporting ---
+    def _status(self):
+        jobs = list(self.jobs_collection.find({"_id": {"$in": list(self._jobs)}}).sort("_id", 1))
+        return {"jobs": jobs, "leader": self.locks.find_one({"_id": LEADER_LOCK})}
+
+    async def status(self):
+        """Every job's schedule, next run and last run, and the current lease holder."""
+        return await self._run(self._status)
+
+    async def history(self, name, limit=10):
+        return await self._run(
+            lambda: list(self.runs.find({"job": name}, {"_id": 0}).sort("started_at", -1).limit(limit))
+        )
@@ -0,0 +1,329 @@
+"""Append-only payout ledger for referral rewards.
+
+Every reward is recorded when a referral is approved, every take-back
+when an approved referral is rejected, and each period is closed with
+one settlement record, which also tracks how far the period's report
+got. Period totals are kept alongside, so earnings and payout reports
+read a handful of summary documents instead of scanning users. Rewards
+are bucketed by the renewal period in which they were approved, so a
+period's totals are final once it has ended. The totals can always be
+recomputed from the entries with `rebuild_totals`.
+
+For users approved before the ledger existed, import their rewards once:
+
+    python ledger.py --import-history
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from itertools import islice
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from repository import COUNTED_STATUSES, referral_period_key
+
+logger = logging.getLogger("godly_bot")
+
+ALL_TIME = "all"
+
+
+def _empty_totals():
+    return {"count": 0, "amount": 0}
+
+
+def _totals_touched(godfather_id, period):
+    """(_id, fields) of the totals an entry for `godfather_id` in `period` adds to."""
+    return (
+        (f"godfather:{godfather_id}:{period}", {"kind": "godfather", "godfather": godfather_id, "period": period}),
+        (f"godfather:{godfather_id}:{ALL_TIME}", {"kind": "godfather", "godfather": godfather_id, "period": ALL_TIME}),
+        (f"period:{period}", {"kind": "period", "period": period}),
+    )
+
+
+class PayoutLedger:
+    """Reward, reversal and settlement entries, plus per-godfather and per-period totals."""
+
+    def __init__(self, database, run, renewal_day=25, users_collection_name="users",
+                 reports_database=None, run_report=None):
+        self.entries = database.ledger
+        self.totals = database.ledger_totals
+        # Past periods' totals are final, so reports can read them from a secondary
+        self.report_totals = (reports_database if reports_database is not None else database).ledger_totals
+        self.users_collection_name = users_collection_name
+        self._run = run
+        self._run_report = run_report or run
+        self.renewal_day = renewal_day
+
+    def period_key(self, moment):
+        return referral_period_key(moment, self.renewal_day)
+
+    # --- Writes ---
+    def _total_updates(self, entries):
+        increments = {}
+        for entry in entries:
+            count = 1 if entry["amount"] > 0 else -1
+            for doc_id, fields in _totals_touched(entry["godfather"], entry["period"]):
+                current = increments.setdefault(doc_id, [fields, 0, 0])
+                current[1] += count
+                current[2] += entry["amount"]
+        return [
+            UpdateOne({"_id": doc_id}, {"$setOnInsert": fields, "$inc": {"count": count, "amount": amount}}, upsert=True)
+            for doc_id, (fields, count, amount) in increments.items()
+        ]
+
+    def _append(self, entries):
+        # Two writes, not one transaction: if the second fails, rebuild_totals catches the totals up
+        self.entries.insert_many(entries, ordered=True)
+        self.totals.bulk_write(self._total_updates(entries), ordered=False)
+
+    def _entry(self, kind, godfather_id, user_id, amount, now):
+        return {
+            "type": kind,
+            "godfather": godfather_id,
+            "user_id": user_id,
+            "amount": amount,
+            "period": self.period_key(now),
+            "created_at": now,
+        }
+
+    async def record_reward(self, godfather_id, user_id, amount, now=None):
+        """Credit `godfather_id` for the approval of `user_id`."""
+        entry = self._entry("reward", godfather_id, user_id, amount, now or datetime.utcnow())
+        await self._run(self._append, [entry])
+        return entry
+
+    async def record_rewards(self, referrals, amount, now=None):
+        """Credit each (godfather_id, user_id) pair approved together, in one append."""
+        now = now or datetime.utcnow()
+        entries = [self._entry("reward", godfather_id, user_id, amount, now) for godfather_id, user_id in referrals]
+        if entries:
+            await self._run(self._append, entries)
+        return entries
+
+    async def record_reversal(self, godfather_id, user_id, now=None):
+        """Take back the latest reward for `user_id`, in the current period. Returns the entry, if any."""
+        reward = await self._run(
+            self.entries.find_one, {"type": "reward", "user_id": user_id, "godfather": godfather_id},
+            sort=[("created_at", -1)],
+        )
+        if not reward:
+            return None
+        entry = self._entry("reversal", godfather_id, user_id, -reward["amount"], now or datetime.utcnow())
+        await self._run(self._append, [entry])
+        return entry
+
+    async def rewarded(self, user_ids):
+        """The users among `user_ids` whose reward still stands: credited and not taken back since."""
+        pipeline = [
+            {"$match": {"user_id": {"$in": list(user_ids)}, "type": {"$in": ["reward", "reversal"]}}},
+            {"$group": {"_id": "$user_id", "amount": {"$sum": "$amount"}}},
+            {"$match": {"amount": {"$gt": 0}}},
+        ]
+        return {doc["_id"] for doc in await self._run(lambda: list(self.entries.aggregate(pipeline)))}
+
+    # --- Summaries ---
+    async def godfather_summary(self, godfather_id, period):
+        """All-time and `period` totals for one godfather, from two summary documents."""
+        ids = [f"godfather:{godfather_id}:{ALL_TIME}", f"godfather:{godfather_id}:{period}"]
+        docs = await self._run(lambda: list(self.totals.find({"_id": {"$in": ids}})))
+        found = {doc["period"]: {"count": doc["count"], "amount": doc["amount"]} for doc in docs}
+        return {"all_time": found.get(ALL_TIME, _empty_totals()), "period": found.get(period, _empty_totals())}
+
+    async def period_summary(self, period):
+        doc = await self._run(self.totals.find_one, {"_id": f"period:{period}"})
+        return {"count": doc["count"], "amount": doc["amount"]} if doc else _empty_totals()
+
+    async def stream_period_totals(self, period, batch_size=500):
+        """Each godfather's totals for `period`, joined with their profile."""
+        pipeline = [
+            {"$match": {"kind": "godfather", "period": period, "count": {"$ne": 0}}},
+            # In godfather order, so a report cut short can resume after the last one notified
+            {"$sort": {"godfather": 1}},
+            {"$lookup": {
+                "from": self.users_collection_name,
+                "localField": "godfather",
+                "foreignField": "user_id",
+                "as": "godfather_user",
+            }},
+            {"$unwind": {"path": "$godfather_user", "preserveNullAndEmptyArrays": True}},
+            {"$project": {
+                "_id": "$godfather",
+                "count": 1,
+                "amount": 1,
+                "godfather_user.name": 1,
+                "godfather_user.telegram_username": 1,
+            }},
+        ]
+        cursor = await self._run_report(self.report_totals.aggregate, pipeline, batchSize=batch_size)
+        try:
+            while True:
+                batch = await self._run_report(lambda: list(islice(cursor, batch_size)))
+                if not batch:
+                    return
+                yield batch
+        finally:
+            cursor.close()
+
+    def _expected_totals(self):
+        pipeline = [
+            {"$match": {"type": {"$in": ["reward", "reversal"]}}},
+            {"$group": {
+                "_id": {"godfather": "$godfather", "period": "$period"},
+                "count": {"$sum": {"$cond": [{"$gt": ["$amount", 0]}, 1, -1]}},
+                "amount": {"$sum": "$amount"},
+            }},
+        ]
+        expected = {}
+        for row in self.entries.aggregate(pipeline, allowDiskUse=True):
+            godfather_id, period = row["_id"]["godfather"], row["_id"]["period"]
+            for doc_id, fields in _totals_touched(godfather_id, period):
+                totals = expected.setdefault(doc_id, {**fields, **_empty_totals()})
+                totals["count"] += row["count"]
+                totals["amount"] += row["amount"]
+        return expected
+
+    def _rebuild_totals(self, fix, batch_size):
+        expected = self._expected_totals()
+        checked, mismatched, ops = 0, [], []
+
+        def flush():
+            if fix and ops:
+                self.totals.bulk_write(ops, ordered=False)
+            ops.clear()
+
+        def compare(doc_id, stored, totals):
+            if (stored.get("count", 0), stored.get("amount", 0)) != (totals["count"], totals["amount"]):
+                mismatched.append(doc_id)
+                ops.append(UpdateOne({"_id": doc_id}, {"$set": totals}, upsert=True))
+                if len(ops) >= batch_size:
+                    flush()
+
+        for stored in self.totals.find({}):
+            checked += 1
+            # Totals with no entries behind them go back to zero
+            compare(stored["_id"], stored, expected.pop(stored["_id"], _empty_totals()))
+        # Totals whose write never landed
+        for doc_id, totals in expected.items():
+            checked += 1
+            compare(doc_id, {}, totals)
+        flush()
+        return {"checked": checked, "mismatched": mismatched, "fixed": fix}
+
+    async def rebuild_totals(self, fix=False, batch_size=500):
+        """Recompute `ledger_totals` from the ledger entries.
+
+        Returns the totals that disagree; with `fix=True` they are
+        overwritten with the recomputed values.
+        """
+        return await self._run_report(self._rebuild_totals, fix, batch_size)
+
+    # --- Settlement ---
+    async def settle(self, period, now=None):
+        """Close `period` with its settlement record, or find the one already there.
+
+        Returns the settlement while its report has yet to go out, or None
+        once it has, so whoever pays out and notifies does so exactly once.
+        """
+        settlement = await self._run(self._settlement, period, now or datetime.utcnow())
+        try:
+            await self._run(self.entries.insert_one, settlement)
+        except DuplicateKeyError:
+            settlement = await self.get_settlement(period)
+            return None if settlement.get("reported_at") else settlement
+        return settlement
+
+    async def unreported_settlements(self, before):
+        """Settlements of periods before `before` whose report was cut short, oldest first."""
+        return await self._run(lambda: list(self.entries.find(
+            {"type": "settlement", "period": {"$lt": before}, "reported_at": None}
+        ).sort("period", 1)))
+
+    async def record_notified(self, period, godfather_id):
+        """Note that every godfather up to `godfather_id` has been told what they earned in `period`."""
+        await self._run(
+            self.entries.update_one, {"_id": f"settlement:{period}"}, {"$set": {"notified_through": godfather_id}}
+        )
+
+    async def mark_reported(self, period, now=None):
+        await self._run(
+            self.entries.update_one, {"_id": f"settlement:{period}"},
+            {"$set": {"reported_at": now or datetime.utcnow()}},
+        )
+
+    def _settlement(self, period, now):
+        totals = self.totals.find_one({"_id": f"period:{period}"}) or _empty_totals()
+        return {
+            "_id": f"settlement:{period}",
+            "type": "settlement",
+            "period": period,
+            "count": totals["count"],
+            "amount": totals["amount"],
+            "created_at": now,
+        }
+
+    async def get_settlement(self, period):
+        return await self._run(self.entries.find_one, {"_id": f"settlement:{period}"})
+
+    # --- History import ---
+    def _import_history(self, users, amount, batch_size, now):
+        if self.entries.find_one({"type": {"$in": ["reward", "reversal"]}}):
+            raise RuntimeError("The ledger already has entries; history can only be imported into an empty ledger.")
+        current_period = self.period_key(now)
+        periods = set()
+        cursor = users.find(
+            {"godfather": {"$ne": None}, "status": {"$in": COUNTED_STATUSES}},
+            {"_id": 0, "user_id": 1, "godfather": 1, "subscription_start_date": 1, "registration_date": 1},
+        ).sort("user_id", 1)
+        imported = 0
+        while True:
+            batch = [
+                self._entry("reward", doc["godfather"], doc["user_id"], amount,
+                            doc.get("subscription_start_date") or doc.get("registration_date") or now)
+                for doc in islice(cursor, batch_size)
+            ]
+            if not batch:
+                break
+            self._append(batch)
+            periods.update(entry["period"] for entry in batch)
+            imported += len(batch)
+        # Earlier periods were already paid out by the old report; only the running one is still open
+        for period in sorted(periods):
+            if period < current_period:
+                try:
+                    self.entries.insert_one({**self._settlement(period, now), "reported_at": now})
+                except DuplicateKeyError:
+                    pass
+        return imported
+
+    async def import_history(self, users, amount, batch_size=500, now=None):
+        """Record one reward per referral approved before the ledger existed.
+
+        Periods before the current one are marked settled, since they were
+        paid out before the ledger existed.
+        """
+        return await self._run(self._import_history, users, amount, batch_size, now or datetime.utcnow())
+
+
+async def import_history():
+    import bot
+
+    imported = await bot.ledger.import_history(
+        bot.users_collection, bot.settings.REFERRAL_REWARD, bot.settings.REPORT_BATCH_SIZE
+    )
+    logger.info(f"Imported {imported} past referral reward(s) into the ledger.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the referral payout ledger.")
+    parser.add_argument("--import-history", action="store_true",
+                        help="record rewards for referrals approved before the ledger existed")
+    args = parser.parse_args()
+    if not args.import_history:
+        parser.error("nothing to do; pass --import-history")
+    asyncio.run(import_history())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+from telegram.ext import ConversationHandler
+from telegram.request import BaseRequest
+
+logger = logging.getLogger("godly_bot")
+
+# Upper bounds in seconds; anything slower lands in the overflow bucket
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram. Recording is a bisect and a few additions."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """Estimate the q-quantile by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """Latency histograms grouped by family ("handler", "mongo", "telegram") and name.
+
+    Mongo events arrive on executor threads, so recording takes a lock.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.families = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, family, name, seconds, error=False):
+        with self._lock:
+            histograms = self.families.setdefault(family, {})
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds, error)
+
+    def summary(self, family):
+        with self._lock:
+            histograms = dict(self.families.get(family, {}))
+        return {name: histogram.summary() for name, histogram in histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self.families = {}
+            self.started_at = time.time()
+
+    def render_prometheus(self, prefix="godly"):
+        """The metrics in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for family, histograms in sorted(self.families.items()):
+                metric = f"{prefix}_{family}_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for name, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{metric}_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{name="{name}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{name="{name}"}} {histogram.total}')
+                    lines.append(f'{metric}_count{{name="{name}"}} {histogram.count}')
+                errors = f"{prefix}_{family}_errors_total"
+                lines.append(f"# TYPE {errors} counter")
+                for name, histogram in sorted(histograms.items()):
+                    lines.append(f'{errors}{{name="{name}"}} {histogram.errors}')
+        return "\n".join(lines) + "\n"
+
+
+# --- Handlers ---
+def instrument_handlers(application, metrics):
+    """Wrap the callback of every registered handler, including conversation states, with a timer."""
+
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks:
+                wrap(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    wrap(nested)
+        elif not getattr(handler.callback, "__instrumented__", False):
+            handler.callback = timed_handler(handler.callback, metrics)
+
+    for group in application.handlers.values():
+        for handler in group:
+            wrap(handler)
+
+
+def timed_handler(callback, metrics):
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        error = True
+        try:
+            result = await callback(update, context)
+            error = False
+            return result
+        finally:
+            metrics.observe("handler", name, time.perf_counter() - started, error)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+# --- MongoDB ---
+class MongoCommandListener(monitoring.CommandListener):
+    """Records the duration of every command the driver sends, by command name."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.observe("mongo", event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.metrics.observe("mongo", event.command_name, event.duration_micros / 1e6, error=True)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Records how long each operation waited for a pooled connection, by client.
+
+    Long waits mean the pool is exhausted: something is holding its
+    connections, and every other caller on that client queues behind it.
+    """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def connection_checked_out(self, event):
+        self.metrics.observe("mongo_pool", self.name, event.duration or 0.0)
+
+    def connection_check_out_failed(self, event):
+        self.metrics.observe("mongo_pool", self.name, event.duration or 0.0, error=True)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+# --- Telegram Bot API ---
+class InstrumentedRequest(BaseRequest):
+    """Times Bot API calls made through another request object, by API method."""
+
+    def __init__(self, request, metrics):
+        self.request = request
+        self.metrics = metrics
+
+    @property
+    def read_timeout(self):
+        return self.request.read_timeout
+
+    async def initialize(self):
+        await self.request.initialize()
+
+    async def shutdown(self):
+        await self.request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        error = True
+        try:
+            code, payload = await self.request.do_request(url, method, request_data=request_data, **kwargs)
+            error = code >= 400
+            return code, payload
+        finally:
+            self.metrics.observe("telegram", api_method, time.perf_counter() - started, error)
+
+
+# --- Endpoint ---
+class MetricsServer:
+    """Serves GET /metrics in Prometheus format on a local port."""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the request has no body we care about
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.metrics.render_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger("godly_bot")
+
+
+class RateLimiter:
+    """Hands out send slots no closer together than `1 / rate` seconds."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+class NotificationDispatcher:
+    """Outbound Telegram messages with bounded concurrency and a Mongo outbox.
+
+    Every message is written to the outbox before it is queued and removed
+    once Telegram accepts it, so anything unsent when the process dies is
+    picked up again by `start()`. Sends are paced to the global and
+    per-chat flood limits, and messages to the same chat keep their order.
+
+    Several processes can share the outbox. Each entry belongs to the
+    process that queued it (`owner`) until `lease_until`. Each process renews
+    the leases on its own unsent entries while it runs, and gives them up when
+    it stops. Only entries whose lease has run out are taken over, with an
+    atomic claim, so a message that another live process has queued is never
+    sent twice.
+    """
+
+    def __init__(self, outbox, run, concurrency=8, global_rate=25.0, chat_interval=1.0,
+                 max_attempts=5, backoff_base=1.0, owner=None, lease_seconds=60.0):
+        self.outbox = outbox
+        self._run = run
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.concurrency = concurrency
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.bot = None
+        self._global_limiter = RateLimiter(global_rate)
+        self._queue = None
+        self._workers = []
+        self._lease_task = None
+        self._waiters = {}
+        self._chat_locks = {}
+        self._chat_refs = {}
+        self._chat_last_sent = {}
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def start(self, bot, restore=True):
+        """Start the workers. With `restore`, unowned pending outbox entries are claimed and queued first.
+
+        Only the bot process restores, then keeps taking over entries left by
+        processes that died. One-off jobs that share the outbox pass
+        restore=False and `join()` before exiting.
+        """
+        self.bot = bot
+        # Anything queued before now is also pending in the outbox, and ours, and is reloaded below
+        self._queue = asyncio.Queue()
+        if restore:
+            self._queue_restored(await self._run(self._claim, datetime.utcnow(), True))
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._lease_task = asyncio.create_task(self._keep_leases(restore))
+
+    async def stop(self):
+        tasks = self._workers + ([self._lease_task] if self._lease_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers, self._lease_task = [], None
+        # Whatever is still unsent can be taken over right away rather than when the lease runs out
+        try:
+            await self._run(
+                self.outbox.update_many,
+                {"owner": self.owner, "status": "pending"},
+                {"$set": {"lease_until": datetime.utcnow()}},
+            )
+        except Exception as e:
+            logger.error(f"Could not release the outbox leases: {e}")
+
+    # --- Ownership ---
+    def _claim(self, now, include_own=False):
+        """Take over pending entries whose lease has run out. Returns them, oldest first."""
+        claimable = [{"lease_until": {"$lte": now}}, {"lease_until": {"$exists": False}}]
+        if include_own:
+            claimable.append({"owner": self.owner})
+        claim = ObjectId()
+        # Each entry is claimed atomically; the tag finds the ones this call won
+        self.outbox.update_many(
+            {"status": "pending", "$or": claimable},
+            {"$set": {"owner": self.owner, "lease_until": now + timedelta(seconds=self.lease_seconds), "claim": claim}},
+        )
+        return list(self.outbox.find({"claim": claim, "owner": self.owner, "status": "pending"}).sort("created_at", 1))
+
+    def _renew(self, now):
+        self.outbox.update_many(
+            {"owner": self.owner, "status": "pending"},
+            {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds)}},
+        )
+
+    def _queue_restored(self, docs):
+        for doc in docs:
+            self.queue.put_nowait(doc)
+        if docs:
+            logger.info(f"Restored {len(docs)} unsent notification(s) from the outbox.")
+
+    async def _keep_leases(self, restore):
+        while True:
+            await asyncio.sleep(max(self.lease_seconds / 3, 1.0))
+            try:
+                now = datetime.utcnow()
+                await self._run(self._renew, now)
+                if restore:
+                    self._queue_restored(await self._run(self._claim, now))
+            except Exception as e:
+                logger.error(f"Outbox lease renewal failed: {e}")
+
+    async def enqueue(self, chat_id, text, parse_mode=None, reply_markup=None):
+        """Persist a message to the outbox and queue it.
+
+        Returns a future that resolves to True once Telegram accepts the
+        message, or False if it was given up on. Callers may ignore it.
+        """
+        doc = self._outbox_doc(chat_id, text, parse_mode, reply_markup)
+        result = await self._run(self.outbox.insert_one, doc)
+        doc["_id"] = result.inserted_id
+        return self._queue_doc(doc)
+
+    async def enqueue_many(self, messages, parse_mode=None):
+        """Queue (chat_id, text) pairs with a single outbox insert. Returns their futures.
+
+        A message given as (chat_id, text, parse_mode) overrides `parse_mode`.
+        """
+        docs = [
+            self._outbox_doc(chat_id, text, own[0] if own else parse_mode, None)
+            for chat_id, text, *own in messages
+        ]
+        if not docs:
+            return []
+        # insert_many fills in each doc's _id
+        await self._run(self.outbox.insert_many, docs, ordered=True)
+        return [self._queue_doc(doc) for doc in docs]
+
+    def _outbox_doc(self, chat_id, text, parse_mode, reply_markup):
+        now = datetime.utcnow()
+        return {
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": parse_mode,
+            "reply_markup": reply_markup.to_dict() if reply_markup else None,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "owner": self.owner,
+            "lease_until": now + timedelta(seconds=self.lease_seconds),
+        }
+
+    def _queue_doc(self, doc):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[doc["_id"]] = waiter
+        self.queue.put_nowait(doc)
+        return waiter
+
+    async def send(self, chat_id, text, parse_mode=None, reply_markup=None):
+        """Queue a message and wait for the outcome."""
+        return await (await self.enqueue(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup))
+
+    async def join(self):
+        await self.queue.join()
+
+    async def _worker(self):
+        while True:
+            doc = await self.queue.get()
+            try:
+                delivered = await self._deliver(doc)
+            except Exception as e:
+                logger.error(f"Notification {doc['_id']} to {doc['chat_id']} crashed: {e}")
+                delivered = False
+            finally:
+                self.queue.task_done()
+            waiter = self._waiters.pop(doc["_id"], None)
+            if waiter and not waiter.done():
+                waiter.set_result(delivered)
+
+    async def _deliver(self, doc):
+        chat_id = doc["chat_id"]
+        # Taken before any await so messages to one chat go out in queue order
+        lock = self._chat_lock(chat_id)
+        try:
+            async with lock:
+                return await self._send_with_retry(doc)
+        finally:
+            self._release_chat(chat_id)
+
+    async def _send_with_retry(self, doc):
+        chat_id = doc["chat_id"]
+        reply_markup = InlineKeyboardMarkup.de_json(doc["reply_markup"], self.bot) if doc.get("reply_markup") else None
+        attempts = doc.get("attempts", 0)
+        while True:
+            wait = self._chat_last_sent.get(chat_id, 0.0) + self.chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._global_limiter.wait()
+            attempts += 1
+            try:
+                await self.bot.send_message(
+                    chat_id=chat_id, text=doc["text"], parse_mode=doc.get("parse_mode"), reply_markup=reply_markup
+                )
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so every worker backs off
+                logger.warning(f"Telegram flood limit hit, retrying {chat_id} in {e.retry_after}s.")
+                self._global_limiter.pause(e.retry_after)
+                error = e
+            except (BadRequest, Forbidden) as e:
+                return await self._mark_failed(doc, attempts, e)
+            except NetworkError as e:
+                delay = self.backoff_base * 2 ** (attempts - 1)
+                logger.warning(f"Send to {chat_id} failed ({e}), retrying in {delay}s.")
+                await asyncio.sleep(delay)
+                error = e
+            else:
+                self._mark_sent(chat_id)
+                await self._run(self.outbox.delete_one, {"_id": doc["_id"]})
+                return True
+            if attempts >= self.max_attempts:
+                return await self._mark_failed(doc, attempts, error)
+            await self._run(self.outbox.update_one, {"_id": doc["_id"]}, {"$set": {"attempts": attempts}})
+
+    async def _mark_failed(self, doc, attempts, error):
+        logger.error(f"Giving up on notification to {doc['chat_id']} after {attempts} attempt(s): {error}")
+        await self._run(
+            self.outbox.update_one,
+            {"_id": doc["_id"]},
+            {"$set": {"status": "failed", "attempts": attempts, "last_error": str(error)}},
+        )
+        return False
+
+    def _mark_sent(self, chat_id):
+        now = time.monotonic()
+        self._chat_last_sent[chat_id] = now
+        if len(self._chat_last_sent) > 10000:
+            cutoff = now - self.chat_interval
+            self._chat_last_sent = {c: t for c, t in self._chat_last_sent.items() if t > cutoff}
+
+    def _chat_lock(self, chat_id):
+        self._chat_refs[chat_id] = self._chat_refs.get(chat_id, 0) + 1
+        return self._chat_locks.setdefault(chat_id, asyncio.Lock())
+
+    def _release_chat(self, chat_id):
+        self._chat_refs[chat_id] -= 1
+        if not self._chat_refs[chat_id]:
+            del self._chat_refs[chat_id]
+            del self._chat_locks[chat_id]
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+
+from pymongo import DeleteOne, ReplaceOne
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger("godly_bot")
+
+BOT_DATA_ID = "bot_data"
+
+
+class MongoPersistence(BasePersistence):
+    """Stores conversation states, user_data and bot_data in MongoDB.
+
+    The application hands over changed data every `update_interval` seconds.
+    Those calls only fill an in-memory buffer; the buffer is written a
+    moment later with one bulk_write per collection, so handling a message
+    never waits on Mongo. chat_data and callback_data are not used by the
+    bot and are not stored.
+    """
+
+    def __init__(self, database, run, update_interval=5, write_delay=0.05):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.conversations = database.conversations
+        self.user_data = database.user_data
+        self.bot_data = database.bot_data
+        self._run = run
+        self.write_delay = write_delay
+        self._pending_conversations = {}
+        self._pending_user_data = {}
+        self._pending_bot_data = None
+        self._last_bot_data = None
+        self._write_task = None
+        self._write_lock = asyncio.Lock()
+
+    # --- Loading ---
+    async def get_conversations(self, name):
+        docs = await self._run(lambda: list(self.conversations.find({"name": name})))
+        return {tuple(doc["key"]): doc["state"] for doc in docs}
+
+    async def get_user_data(self):
+        docs = await self._run(lambda: list(self.user_data.find({})))
+        return {doc["_id"]: doc["data"] for doc in docs}
+
+    async def get_bot_data(self):
+        doc = await self._run(self.bot_data.find_one, {"_id": BOT_DATA_ID})
+        self._last_bot_data = doc["data"] if doc else {}
+        return dict(self._last_bot_data)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- Buffered writes ---
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, tuple(key))] = new_state
+        self._schedule_write()
+
+    async def update_user_data(self, user_id, data):
+        self._pending_user_data[user_id] = data
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._pending_user_data[user_id] = None
+        self._schedule_write()
+
+    async def update_bot_data(self, data):
+        if data != self._last_bot_data:
+            self._pending_bot_data = data
+            self._schedule_write()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._write_task and not self._write_task.done():
+            await self._write_task
+        await self._write_pending()
+
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._delayed_write())
+
+    async def _delayed_write(self):
+        # Let the rest of this update_persistence run land in the same batch
+        await asyncio.sleep(self.write_delay)
+        try:
+            await self._write_pending()
+        except Exception as e:
+            logger.error(f"Failed to write conversation persistence: {e}")
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            user_data, self._pending_user_data = self._pending_user_data, {}
+            bot_data, self._pending_bot_data = self._pending_bot_data, None
+            try:
+                await self._run(self._write, conversations, user_data, bot_data)
+            except Exception:
+                # Put the batch back so the next write retries it, without clobbering newer data
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                self._pending_user_data = {**user_data, **self._pending_user_data}
+                if self._pending_bot_data is None:
+                    self._pending_bot_data = bot_data
+                raise
+            if bot_data is not None:
+                self._last_bot_data = bot_data
+
+    def _write(self, conversations, user_data, bot_data):
+        conversation_ops = []
+        for (name, key), state in conversations.items():
+            doc_id = f"{name}:{json.dumps(key)}"
+            if state is None:
+                conversation_ops.append(DeleteOne({"_id": doc_id}))
+            else:
+                conversation_ops.append(ReplaceOne(
+                    {"_id": doc_id}, {"name": name, "key": list(key), "state": state}, upsert=True
+                ))
+        if conversation_ops:
+            self.conversations.bulk_write(conversation_ops, ordered=False)
+        user_ops = [
+            DeleteOne({"_id": user_id}) if data is None
+            else ReplaceOne({"_id": user_id}, {"data": data}, upsert=True)
+            for user_id, data in user_data.items()
+        ]
+        if user_ops:
+            self.user_data.bulk_write(user_ops, ordered=False)
+        if bot_data is not None:
+            self.bot_data.replace_one({"_id": BOT_DATA_ID}, {"data": bot_data}, upsert=True)
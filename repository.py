@@ -0,0 +1,752 @@
+import asyncio
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from itertools import islice
+
+from bson.objectid import ObjectId
+from dateutil.relativedelta import relativedelta
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import call_with_timeout, interactive_timeout
+
+logger = logging.getLogger("godly_bot")
+
+_MISSING = object()
+
+# Referrals that were approved keep counting after their subscription lapses
+COUNTED_STATUSES = ["Approved", "Expired"]
+
+
+def descendants_prefix(referral_path, user_id):
+    """Path prefix shared by everyone referred, directly or not, by `user_id`."""
+    return f"{referral_path or '/'}{user_id}/"
+
+
+def path_depth(referral_path):
+    return referral_path.count("/") - 1
+
+
+def username_key(username):
+    """Case-folded form of a Telegram username, as stored in `username_key`."""
+    return username.lstrip("@").lower() if username else None
+
+
+def referral_period_key(moment, renewal_day):
+    """Bucket key ("YYYY-MM-DD" of the period start) for the renewal period containing `moment`."""
+    start = moment.replace(day=renewal_day)
+    if moment.day < renewal_day:
+        start = start - relativedelta(months=1)
+    return start.strftime("%Y-%m-%d")
+
+
+class UserRepository:
+    """Async access layer in front of the users collection.
+
+    pymongo is blocking, so every call runs on a bounded thread pool instead
+    of the event loop. One slow round-trip only ties up a worker thread.
+
+    User documents are served through a read-through cache keyed by
+    user_id. Every write method here invalidates the keys it touches, so
+    writes must go through the repository rather than the raw collection.
+    Usernames resolve through a second cache, username_key -> user_id,
+    which the username writes below keep current.
+
+    Callables in `status_listeners` are told about every status write as
+    (user_id, document before, new status, fields written).
+
+    Reports and analytics read through `reports`, normally the same
+    collection on a client that prefers secondaries. They run on their own
+    `report_workers` threads, so a long report never holds up the
+    workers that serve users. Calls made while an update is being
+    handled get the short `interactive_timeout`; report reads do not.
+    """
+
+    def __init__(self, collection, max_workers=8, renewal_day=25, cache=None, usernames=None,
+                 reports=None, report_workers=2):
+        self.collection = collection
+        self.reports = reports if reports is not None else collection
+        self.renewal_day = renewal_day
+        self.cache = cache
+        self.usernames = usernames
+        self.status_listeners = []
+        self._writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+        self._report_executor = ThreadPoolExecutor(max_workers=report_workers, thread_name_prefix="mongo-report")
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = partial(fn, *args, **kwargs)
+        timeout = interactive_timeout.get()
+        if timeout:
+            call = partial(call_with_timeout, timeout, call)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def run_report(self, fn, *args, **kwargs):
+        """`run` for long reads and scans: on the report workers, without the interactive timeout."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._report_executor, partial(fn, *args, **kwargs))
+
+    async def get_user(self, user_id):
+        if self.cache is None:
+            return await self.run(self.collection.find_one, {"user_id": user_id})
+        cached = self.cache.get(user_id, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        writes = self._writes
+        user = await self.run(self.collection.find_one, {"user_id": user_id})
+        # A write that landed while we were reading may have made `user` stale
+        if writes == self._writes:
+            self.cache.set(user_id, user)
+        return user
+
+    def _status_changed(self, user_id, before, status, fields):
+        for listener in self.status_listeners:
+            try:
+                listener(user_id, before, status, fields)
+            except Exception as e:
+                logger.error(f"Status listener failed for {user_id}: {e}")
+
+    def invalidate(self, *user_ids):
+        self._writes += 1
+        if self.cache is not None:
+            for user_id in user_ids:
+                self.cache.invalidate(user_id)
+
+    # --- Usernames ---
+    # `username_key` is the lower-cased username, so the lookup is
+    # case-insensitive and still a plain equality match on its index.
+    # Telegram usernames are unique at any moment: whoever writes a key
+    # takes it away from the user that held it before, whose key becomes
+    # null rather than missing, so the legacy fallback below skips them.
+    def _find_by_username(self, username):
+        key = username_key(username)
+        doc = self.collection.find_one({"username_key": key}, {"_id": 0, "user_id": 1})
+        if doc is None:
+            # Not backfilled yet (see backfill_username_keys.py): exact match, then store the key
+            doc = self.collection.find_one(
+                {"telegram_username": username.lstrip("@"), "username_key": {"$exists": False}},
+                {"_id": 0, "user_id": 1},
+            )
+            if doc is not None:
+                self.collection.update_one({"user_id": doc["user_id"]}, {"$set": {"username_key": key}})
+        return doc["user_id"] if doc else None
+
+    def _backfill_username_keys(self, fix, batch_size):
+        query = {"telegram_username": {"$nin": [None, ""]}, "username_key": {"$exists": False}}
+        missing, last = 0, None
+        while True:
+            page = {**query, "user_id": {"$gt": last}} if last is not None else query
+            batch = list(
+                self.collection.find(page, {"_id": 0, "user_id": 1, "telegram_username": 1})
+                .sort("user_id", 1).limit(batch_size)
+            )
+            if not batch:
+                return missing
+            missing += len(batch)
+            last = batch[-1]["user_id"]
+            if fix:
+                operations = []
+                for doc in batch:
+                    key = username_key(doc["telegram_username"])
+                    # Same rule as _write_user: the key moves to whoever writes it last
+                    operations.append(UpdateMany(
+                        {"username_key": key, "user_id": {"$ne": doc["user_id"]}}, {"$set": {"username_key": None}}
+                    ))
+                    operations.append(UpdateOne({"user_id": doc["user_id"]}, {"$set": {"username_key": key}}))
+                self.collection.bulk_write(operations, ordered=True)
+
+    async def backfill_username_keys(self, fix=False, batch_size=500):
+        """Count the users registered before `username_key` was stored; with `fix=True`, store it.
+
+        Returns the number of users without a key.
+        """
+        missing = await self.run_report(self._backfill_username_keys, fix, batch_size)
+        if fix and missing and self.usernames is not None:
+            self.usernames.clear()
+        return missing
+
+    async def resolve_username(self, username):
+        """The user_id registered under `username` (any case, with or without "@"), or None."""
+        key = username_key(username)
+        if not key:
+            return None
+        if self.usernames is not None:
+            cached = self.usernames.get(key, _MISSING)
+            if cached is not _MISSING:
+                return cached
+        writes = self._writes
+        user_id = await self.run(self._find_by_username, username)
+        if self.usernames is not None and writes == self._writes:
+            self.usernames.set(key, user_id)
+        return user_id
+
+    def _write_user(self, user_id, fields, upsert=False):
+        key = username_key(fields.get("telegram_username"))
+        if key:
+            self.collection.update_many(
+                {"username_key": key, "user_id": {"$ne": user_id}}, {"$set": {"username_key": None}}
+            )
+        if "telegram_username" in fields:
+            fields = {**fields, "username_key": key}
+        return self.collection.find_one_and_update(
+            {"user_id": user_id}, {"$set": fields},
+            projection={"_id": 0, "username_key": 1, "status": 1, "godfather": 1, "subscription_start_date": 1,
+                        "registration_date": 1},
+            upsert=upsert, return_document=ReturnDocument.BEFORE,
+        )
+
+    def _remember_username(self, user_id, before, username):
+        if self.usernames is None:
+            return
+        previous = (before or {}).get("username_key")
+        if previous:
+            self.usernames.invalidate(previous)
+        if username_key(username):
+            self.usernames.set(username_key(username), user_id)
+
+    async def save_registration(self, user_id, user_data):
+        self.invalidate(user_id)
+        try:
+            before = await self.run(self._write_user, user_id, user_data, upsert=True)
+        finally:
+            self.invalidate(user_id)
+        if "telegram_username" in user_data:
+            self._remember_username(user_id, before, user_data["telegram_username"])
+        if "status" in user_data:
+            self._status_changed(user_id, before, user_data["status"], user_data)
+        return before
+
+    async def update_username(self, user_id, username):
+        """Record that `user_id` now goes by `username` (None once they drop it)."""
+        self.invalidate(user_id)
+        try:
+            before = await self.run(self._write_user, user_id, {"telegram_username": username})
+        finally:
+            self.invalidate(user_id)
+        self._remember_username(user_id, before, username)
+        return before
+
+    async def set_status(self, user_id, status, fields=None, unset=()):
+        """Atomically set a user's status and return the document as it was before."""
+        update = {"$set": {"status": status, **(fields or {})}}
+        if unset:
+            update["$unset"] = {field: "" for field in unset}
+        self.invalidate(user_id)
+        try:
+            before = await self.run(
+                self.collection.find_one_and_update,
+                {"user_id": user_id},
+                update,
+                return_document=ReturnDocument.BEFORE,
+            )
+        finally:
+            self.invalidate(user_id)
+        if before is not None:
+            self._status_changed(user_id, before, status, update["$set"])
+        return before
+
+    def _bulk_set_status(self, users, status, fields, unset, expected_status):
+        batch = ObjectId()
+        operations = []
+        for user in users:
+            update = {"$set": {"status": status, "status_batch": batch, **fields.get(user["user_id"], {})}}
+            if unset:
+                update["$unset"] = {field: "" for field in unset}
+            operations.append(UpdateOne({"user_id": user["user_id"], "status": expected_status}, update))
+        result = self.collection.bulk_write(operations, ordered=False)
+        if result.modified_count == len(users):
+            return users
+        # Someone else moved a few of them first; keep only the ones this batch changed
+        applied = {doc["user_id"] for doc in self.collection.find({"status_batch": batch}, {"_id": 0, "user_id": 1})}
+        return [user for user in users if user["user_id"] in applied]
+
+    async def bulk_set_status(self, users, status, fields=None, unset=(), expected_status="Pending"):
+        """Move many users to `status` with one unordered bulk_write.
+
+        `users` are the documents as read before the change, and `fields`
+        maps a user_id to the extra fields written for that user. A user
+        only changes if its status is still `expected_status`. Returns the
+        documents of the users that changed.
+        """
+        if not users:
+            return []
+        fields = fields or {}
+        user_ids = [user["user_id"] for user in users]
+        self.invalidate(*user_ids)
+        try:
+            changed = await self.run(self._bulk_set_status, users, status, fields, unset, expected_status)
+        finally:
+            self.invalidate(*user_ids)
+        for user in changed:
+            self._status_changed(user["user_id"], user, status, {"status": status, **fields.get(user["user_id"], {})})
+        return changed
+
+    async def pending_page(self, page, page_size):
+        """One page of pending users, oldest first, and whether another page follows.
+
+        A single query on the (status, registration_date) index.
+        """
+        docs = await self.find(
+            {"status": "Pending"},
+            projection={"_id": 0, "user_id": 1, "name": 1, "telegram_username": 1, "godfather": 1,
+                        "payment_method": 1, "transaction_id": 1, "registration_date": 1},
+            sort=[("registration_date", 1)],
+            skip=page * page_size,
+            limit=page_size + 1,
+        )
+        return docs[:page_size], len(docs) > page_size
+
+    async def pending_between(self, since, until):
+        """Users whose pending submission arrived in (since, until], oldest first."""
+        return await self.find(
+            {"status": "Pending", "registration_date": {"$gt": since, "$lte": until}},
+            projection={"_id": 0, "user_id": 1, "name": 1, "telegram_username": 1, "godfather": 1,
+                        "payment_method": 1, "transaction_id": 1, "registration_date": 1},
+            sort=[("registration_date", 1)],
+        )
+
+    async def adjust_referral_counts(self, godfather_id, registration_date, delta):
+        """Move a godfather's approved-referral counters by `delta` in one atomic $inc."""
+        period = referral_period_key(registration_date, self.renewal_day)
+        self.invalidate(godfather_id)
+        try:
+            return await self.run(
+                self.collection.update_one,
+                {"user_id": godfather_id},
+                {"$inc": {"referral_counts.approved": delta, f"referral_counts.periods.{period}": delta}},
+            )
+        finally:
+            self.invalidate(godfather_id)
+
+    async def adjust_referral_counts_many(self, changes):
+        """Apply (godfather_id, registration_date, delta) changes in one unordered bulk_write."""
+        if not changes:
+            return None
+        operations = [
+            UpdateOne({"user_id": godfather_id}, {"$inc": {
+                "referral_counts.approved": delta,
+                f"referral_counts.periods.{referral_period_key(registration_date, self.renewal_day)}": delta,
+            }})
+            for godfather_id, registration_date, delta in changes
+        ]
+        godfather_ids = [godfather_id for godfather_id, _, _ in changes]
+        self.invalidate(*godfather_ids)
+        try:
+            return await self.run(self.collection.bulk_write, operations, ordered=False)
+        finally:
+            self.invalidate(*godfather_ids)
+
+    async def get_referral_counts(self, godfather_id):
+        doc = await self.get_user(godfather_id)
+        counts = (doc or {}).get("referral_counts") or {}
+        return {"approved": counts.get("approved", 0), "periods": counts.get("periods", {})}
+
+    def _compute_referral_counts(self):
+        # Walks the (godfather, status, registration_date) index in godfather order,
+        # so only one godfather's counters are in memory at a time.
+        cursor = self.collection.find(
+            {"godfather": {"$ne": None}, "status": {"$in": COUNTED_STATUSES}},
+            {"_id": 0, "godfather": 1, "registration_date": 1},
+        ).sort("godfather", 1)
+        current, counts = None, None
+        for doc in cursor:
+            if doc["godfather"] != current:
+                if current is not None:
+                    yield current, counts
+                current, counts = doc["godfather"], {"approved": 0, "periods": {}}
+            counts["approved"] += 1
+            if doc.get("registration_date"):
+                period = referral_period_key(doc["registration_date"], self.renewal_day)
+                counts["periods"][period] = counts["periods"].get(period, 0) + 1
+        if current is not None:
+            yield current, counts
+
+    def _rebuild_referral_counts(self, fix, batch_size):
+        stored_cursor = self.collection.find(
+            {"referral_counts.approved": {"$gt": 0}}, {"_id": 0, "user_id": 1, "referral_counts": 1}
+        )
+        stored = {doc["user_id"]: doc["referral_counts"] for doc in stored_cursor}
+        checked, mismatched, ops = 0, [], []
+
+        def flush():
+            if fix and ops:
+                self.collection.bulk_write(ops, ordered=False)
+            ops.clear()
+
+        def compare(godfather_id, expected):
+            actual = stored.pop(godfather_id, None) or {"approved": 0, "periods": {}}
+            if {"approved": actual.get("approved", 0), "periods": actual.get("periods", {})} != expected:
+                mismatched.append(godfather_id)
+                ops.append(UpdateOne({"user_id": godfather_id}, {"$set": {"referral_counts": expected}}))
+                if len(ops) >= batch_size:
+                    flush()
+
+        for godfather_id, expected in self._compute_referral_counts():
+            checked += 1
+            compare(godfather_id, expected)
+        # Counters left over belong to godfathers with no approved referrals at all
+        for godfather_id in list(stored):
+            compare(godfather_id, {"approved": 0, "periods": {}})
+        flush()
+        return {"checked": checked, "mismatched": mismatched, "fixed": fix}
+
+    async def rebuild_referral_counts(self, fix=False, batch_size=500):
+        """Recompute every godfather's counters from the users collection.
+
+        Returns the ids whose stored counters disagree; with `fix=True` they
+        are overwritten with the recomputed values.
+        """
+        # A full scan: keep it off the workers that serve users
+        result = await self.run_report(self._rebuild_referral_counts, fix, batch_size)
+        if fix and result["mismatched"]:
+            self.invalidate(*result["mismatched"])
+        return result
+
+    # --- Transaction IDs ---
+    # A MoMo or Orange transaction can only pay for one subscription. Both
+    # checks below ride the (payment_method, transaction_id) index.
+    async def transaction_duplicates(self, user_id, payment_method, transaction_id, limit=5):
+        """Other users who submitted the same transaction ID for the same payment method."""
+        return await self.find(
+            {"payment_method": payment_method, "transaction_id": transaction_id, "user_id": {"$ne": user_id}},
+            projection={"_id": 0, "user_id": 1, "name": 1, "status": 1},
+            limit=limit,
+        )
+
+    async def reused_transactions(self, pairs):
+        """The (payment_method, transaction_id) pairs among `pairs` that more than one user submitted."""
+        pairs = {pair for pair in pairs if pair[1]}
+        if not pairs:
+            return set()
+        docs = await self.find(
+            {"$or": [{"payment_method": method, "transaction_id": transaction_id} for method, transaction_id in pairs]},
+            projection={"_id": 0, "payment_method": 1, "transaction_id": 1},
+        )
+        seen, reused = set(), set()
+        for doc in docs:
+            pair = (doc.get("payment_method"), doc.get("transaction_id"))
+            (reused if pair in seen else seen).add(pair)
+        return reused
+
+    def duplicate_transactions_pipeline(self, limit):
+        return [
+            {"$match": {"transaction_id": {"$type": "string"}}},
+            {"$group": {
+                "_id": {"payment_method": "$payment_method", "transaction_id": "$transaction_id"},
+                "count": {"$sum": 1},
+                "users": {"$push": {"user_id": "$user_id", "name": "$name", "status": "$status"}},
+            }},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$sort": {"count": -1, "_id.payment_method": 1, "_id.transaction_id": 1}},
+            {"$limit": limit},
+        ]
+
+    async def duplicate_transactions(self, limit=50):
+        """Every transaction ID submitted more than once, largest clusters first, in one aggregation."""
+        pipeline = self.duplicate_transactions_pipeline(limit)
+        return await self.run_report(lambda: list(self.reports.aggregate(pipeline, allowDiskUse=True)))
+
+    # --- Referral tree ---
+    # Every approved user stores `referral_path`, the user_ids of its
+    # ancestors from the top down ("/" for a root, "/7/12/" under 12 under 7),
+    # and `referral_depth`. A user's whole downline then shares one path
+    # prefix, which the (referral_path, referral_depth) index answers with a
+    # single range scan.
+    async def referral_path(self, user_id, godfather_id):
+        """The path a user approved now gets under `godfather_id`."""
+        if godfather_id is None:
+            return "/"
+        godfather = await self.get_user(godfather_id)
+        # A godfather who was never approved has no path and is treated as a root
+        path = descendants_prefix((godfather or {}).get("referral_path"), godfather_id)
+        if f"/{user_id}/" in path:
+            logger.warning(f"Referral cycle between {user_id} and {godfather_id}; storing {user_id} as a root.")
+            return "/"
+        return path
+
+    async def referral_paths(self, users):
+        """Paths for `users` approved together, as {user_id: path}.
+
+        A godfather approved in the same batch gets its path first, so its
+        referrals hang below it rather than below an unapproved root.
+        """
+        by_id = {user["user_id"]: user for user in users}
+        paths = {}
+
+        async def resolve(user_id, seen):
+            if user_id not in paths:
+                godfather_id = by_id[user_id].get("godfather")
+                if godfather_id in by_id and godfather_id not in seen:
+                    path = descendants_prefix(await resolve(godfather_id, seen | {user_id}), godfather_id)
+                    if f"/{user_id}/" in path:
+                        path = "/"
+                else:
+                    path = await self.referral_path(user_id, godfather_id)
+                paths[user_id] = path
+            return paths[user_id]
+
+        for user_id in by_id:
+            await resolve(user_id, frozenset())
+        return paths
+
+    def _move_subtree(self, moves, batch_size):
+        # Prefixes nest when a moved user sits below another one moved with it;
+        # the longest match is the user's nearest moved ancestor
+        patterns = [re.compile("^" + re.escape(old_prefix)) for old_prefix in moves]
+        cursor = self.collection.find(
+            {"referral_path": {"$in": patterns}}, {"_id": 0, "user_id": 1, "referral_path": 1}
+        )
+        moved, ops = [], []
+        for doc in cursor:
+            old_prefix = max((prefix for prefix in moves if doc["referral_path"].startswith(prefix)), key=len)
+            path = moves[old_prefix] + doc["referral_path"][len(old_prefix):]
+            ops.append(UpdateOne(
+                {"user_id": doc["user_id"]}, {"$set": {"referral_path": path, "referral_depth": path_depth(path)}}
+            ))
+            moved.append(doc["user_id"])
+            if len(ops) >= batch_size:
+                self.collection.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.collection.bulk_write(ops, ordered=False)
+        return moved
+
+    async def move_referral_subtree(self, old_prefix, new_prefix, batch_size=500):
+        """Rewrite the paths of a downline whose top user got a new path. Returns the user_ids moved."""
+        return await self.move_referral_subtrees({old_prefix: new_prefix}, batch_size)
+
+    async def move_referral_subtrees(self, moves, batch_size=500):
+        """`move_referral_subtree` for several {old_prefix: new_prefix} moves, with one find."""
+        moves = {old: new for old, new in moves.items() if old != new}
+        if not moves:
+            return []
+        moved = await self.run(self._move_subtree, moves, batch_size)
+        self.invalidate(*moved)
+        return moved
+
+    def referral_levels_pipeline(self, prefix):
+        return [
+            {"$match": {"referral_path": {"$regex": "^" + re.escape(prefix)}}},
+            {"$group": {"_id": "$referral_depth", "count": {"$sum": 1}}},
+        ]
+
+    async def referral_tree(self, user_id, referral_path=_MISSING):
+        """Downline size, depth and per-level counts (level 1 = direct referrals)."""
+        if referral_path is _MISSING:
+            referral_path = ((await self.get_user(user_id)) or {}).get("referral_path")
+        prefix = descendants_prefix(referral_path, user_id)
+        rows = await self.run_report(lambda: list(self.reports.aggregate(self.referral_levels_pipeline(prefix))))
+        base = path_depth(prefix) - 1
+        levels = {row["_id"] - base: row["count"] for row in rows}
+        return {
+            "size": sum(levels.values()),
+            "depth": max(levels, default=0),
+            "levels": dict(sorted(levels.items())),
+        }
+
+    async def top_referrers(self, limit=10):
+        """Godfathers with the most approved direct referrals."""
+        return await self.run_report(lambda: list(self.reports.find(
+            {"referral_counts.approved": {"$gt": 0}},
+            projection={"_id": 0, "user_id": 1, "name": 1, "telegram_username": 1,
+                        "referral_path": 1, "referral_counts.approved": 1},
+            sort=[("referral_counts.approved", -1)],
+            limit=limit,
+        )))
+
+    def _rebuild_referral_paths(self, fix, batch_size):
+        counted = {"status": {"$in": COUNTED_STATUSES}}
+        projection = {"_id": 0, "user_id": 1, "referral_path": 1}
+        checked, mismatched, ops = 0, [], []
+
+        def compare(doc, path):
+            nonlocal ops
+            if doc.get("referral_path") != path:
+                mismatched.append(doc["user_id"])
+                ops.append(UpdateOne(
+                    {"user_id": doc["user_id"]}, {"$set": {"referral_path": path, "referral_depth": path_depth(path)}}
+                ))
+                if len(ops) >= batch_size:
+                    if fix:
+                        self.collection.bulk_write(ops, ordered=False)
+                    ops = []
+
+        # Roots: no godfather, or a godfather who was never approved
+        frontier = {}
+        for doc in self.collection.find({**counted, "godfather": None}, projection):
+            checked += 1
+            compare(doc, "/")
+            frontier[doc["user_id"]] = "/"
+        orphans = self.collection.aggregate([
+            {"$match": {**counted, "godfather": {"$ne": None}}},
+            {"$lookup": {"from": self.collection.name, "localField": "godfather",
+                         "foreignField": "user_id", "as": "parent"}},
+            {"$match": {"parent.status": {"$nin": COUNTED_STATUSES}}},
+            {"$project": {"_id": 0, "user_id": 1, "godfather": 1, "referral_path": 1}},
+        ])
+        for doc in orphans:
+            path = f"/{doc['godfather']}/"
+            checked += 1
+            compare(doc, path)
+            frontier[doc["user_id"]] = path
+        # Then one level at a time, so only the current level is held in memory
+        while frontier:
+            next_frontier = {}
+            parents = list(frontier)
+            for start in range(0, len(parents), batch_size):
+                chunk = parents[start:start + batch_size]
+                query = {**counted, "godfather": {"$in": chunk}}
+                for doc in self.collection.find(query, {**projection, "godfather": 1}):
+                    path = descendants_prefix(frontier[doc["godfather"]], doc["godfather"])
+                    checked += 1
+                    compare(doc, path)
+                    next_frontier[doc["user_id"]] = path
+            frontier = next_frontier
+        if fix and ops:
+            self.collection.bulk_write(ops, ordered=False)
+        # Users caught in a referral cycle are never reached from a root
+        unreached = self.collection.count_documents(counted) - checked
+        return {"checked": checked, "mismatched": mismatched, "unreached": unreached, "fixed": fix}
+
+    async def rebuild_referral_paths(self, fix=False, batch_size=500):
+        """Recompute every approved user's referral path by walking the tree from its roots.
+
+        Returns the ids whose stored path is wrong; with `fix=True` they are rewritten.
+        """
+        result = await self.run_report(self._rebuild_referral_paths, fix, batch_size)
+        if fix and result["mismatched"]:
+            self.invalidate(*result["mismatched"])
+        return result
+
+    async def find(self, query, **kwargs):
+        # Cursor iteration blocks too, so materialize it on the worker thread.
+        return await self.run(lambda: list(self.collection.find(query, **kwargs)))
+
+    async def iter_batches(self, cursor, batch_size, run=None):
+        """Yield lists of at most `batch_size` documents from a pymongo cursor.
+
+        Only one batch is held in memory at a time, and the blocking
+        getMore round-trips happen on the worker pool (`run`, by default
+        the users' one).
+        """
+        run = run or self.run
+        while True:
+            batch = await run(lambda: list(islice(cursor, batch_size)))
+            if not batch:
+                return
+            yield batch
+
+    async def stream_users(self, query, projection, batch_size=500, min_user_id=None, max_user_id=None):
+        """Stream users matching `query` in user_id order, optionally limited to [min_user_id, max_user_id)."""
+        id_range = {}
+        if min_user_id is not None:
+            id_range["$gte"] = min_user_id
+        if max_user_id is not None:
+            id_range["$lt"] = max_user_id
+        if id_range:
+            query = {**query, "user_id": id_range}
+        cursor = self.collection.find(query, projection).sort("user_id", 1).batch_size(batch_size)
+        try:
+            async for batch in self.iter_batches(cursor, batch_size):
+                yield batch
+        finally:
+            cursor.close()
+
+    async def bulk_update_users(self, updates):
+        """Apply (user_id, extra_filter, update) triples in one unordered bulk_write.
+
+        Returns the number of documents modified.
+        """
+        if not updates:
+            return 0
+        user_ids = [user_id for user_id, _, _ in updates]
+        operations = [UpdateOne({"user_id": user_id, **extra}, update) for user_id, extra, update in updates]
+        self.invalidate(*user_ids)
+        try:
+            result = await self.run(self.collection.bulk_write, operations, ordered=False)
+        finally:
+            self.invalidate(*user_ids)
+        return result.modified_count
+
+    def _user_id_boundaries(self, shards):
+        total = self.collection.count_documents({})
+        starts = []
+        for shard in range(1, shards):
+            doc = next(iter(
+                self.collection.find({}, {"_id": 0, "user_id": 1}).sort("user_id", 1).skip(shard * total // shards).limit(1)
+            ), None)
+            if doc is not None:
+                starts.append(doc["user_id"])
+        bounds = [None] + starts + [None]
+        return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+    async def user_id_ranges(self, shards):
+        """Split the user_id space into `shards` contiguous [min, max) ranges of similar size.
+
+        The first and last ranges are open-ended, so every user falls in exactly one.
+        """
+        return await self.run(self._user_id_boundaries, shards)
+
+    def _planned_user_id_boundaries(self, plan_id, shards, now):
+        plans = self.collection.database.shard_plans
+        plan = plans.find_one({"_id": plan_id})
+        if plan is None:
+            try:
+                plans.insert_one({"_id": plan_id, "ranges": self._user_id_boundaries(shards), "created_at": now})
+            except DuplicateKeyError:
+                # Another process of the same run stored its ranges first
+                pass
+            plan = plans.find_one({"_id": plan_id})
+        return [tuple(bounds) for bounds in plan["ranges"]]
+
+    async def planned_user_id_ranges(self, plan_id, shards, now=None):
+        """`user_id_ranges` computed once per `plan_id` and stored, so every process of a run splits alike.
+
+        Ranges computed by each process on its own overlap or leave gaps when
+        users register in between.
+        """
+        return await self.run(self._planned_user_id_boundaries, plan_id, shards, now or datetime.utcnow())
+
+    def referral_totals_pipeline(self, period_start, period_end, statuses=("Approved",)):
+        return [
+            {"$match": {
+                "godfather": {"$ne": None},
+                "status": {"$in": list(statuses)},
+                "registration_date": {"$gte": period_start, "$lte": period_end},
+            }},
+            {"$group": {"_id": "$godfather", "count": {"$sum": 1}}},
+            {"$sort": {"_id": 1}},
+            {"$lookup": {
+                "from": self.collection.name,
+                "localField": "_id",
+                "foreignField": "user_id",
+                "as": "godfather_user",
+            }},
+            {"$unwind": {"path": "$godfather_user", "preserveNullAndEmptyArrays": True}},
+            {"$project": {
+                "count": 1,
+                "godfather_user.name": 1,
+                "godfather_user.telegram_username": 1,
+            }},
+        ]
+
+    async def stream_referral_totals(self, period_start, period_end, batch_size=500, statuses=("Approved",)):
+        """Referrals per godfather registered between two dates, joined with the godfather profile.
+
+        Only referrals with one of `statuses` count. Rows come in godfather order.
+        """
+        pipeline = self.referral_totals_pipeline(period_start, period_end, statuses)
+        cursor = await self.run_report(self.reports.aggregate, pipeline, batchSize=batch_size, allowDiskUse=True)
+        try:
+            async for batch in self.iter_batches(cursor, batch_size, run=self.run_report):
+                yield batch
+        finally:
+            cursor.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._report_executor.shutdown(wait=False)
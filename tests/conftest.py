@@ -0,0 +1,168 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from telegram.request import BaseRequest
+
+# Required settings must exist before `config` is imported.
+TEST_TOKEN = "123456:TEST"
+os.environ.setdefault("BOT_TOKEN", TEST_TOKEN)
+os.environ.setdefault("ADMIN_CHAT_ID", "1")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DB_NAME", "godly_test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeMessage:
+    def __init__(self, text=""):
+        self.text = text
+        self.replies = []
+        self.markups = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        self.markups.append(kwargs.get("reply_markup"))
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.documents = []
+        self.username = "godly_test_bot"
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def send_document(self, chat_id, document, filename=None, caption=None, **kwargs):
+        self.documents.append((chat_id, filename, document.read(), caption))
+
+
+@pytest.fixture
+def make_update():
+    def _make(user_id, text="", username=None):
+        return SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id, username=username, first_name="Test"),
+            effective_chat=SimpleNamespace(id=user_id),
+            message=FakeMessage(text),
+        )
+    return _make
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, text="Submission", reply_markup=None):
+        self.data = data
+        self.message = SimpleNamespace(text=text, reply_markup=reply_markup)
+        self.from_user = SimpleNamespace(id=1, first_name="Admin")
+        self.edits = []
+        self.answers = []
+
+    async def answer(self, *args, **kwargs):
+        self.answers.append(args[0] if args else None)
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+        self.message = SimpleNamespace(text=text, reply_markup=kwargs.get("reply_markup"))
+
+    async def edit_message_reply_markup(self, reply_markup=None, **kwargs):
+        self.message = SimpleNamespace(text=self.message.text, reply_markup=reply_markup)
+
+
+@pytest.fixture
+def make_callback():
+    def _make(data, user_id=1, reply_markup=None):
+        return SimpleNamespace(
+            callback_query=FakeCallbackQuery(data, reply_markup=reply_markup),
+            effective_user=SimpleNamespace(id=user_id, username=None, first_name="Admin"),
+            effective_chat=SimpleNamespace(id=user_id),
+        )
+    return _make
+
+
+class StubTelegramRequest(BaseRequest):
+    """Answers Bot API calls in-process and records them."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params))
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Godly", "username": "godly_test_bot"}
+        elif api_method == "sendMessage":
+            result = {"message_id": 2, "date": 0, "chat": {"id": params["chat_id"], "type": "private"},
+                      "text": params["text"]}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def sent_texts(self):
+        return [params["text"] for name, params in self.calls if name in ("sendMessage", "editMessageText")]
+
+
+@pytest.fixture
+def build_app():
+    """Build the real application against an in-process stub Bot API."""
+    from telegram.ext import Application
+    import bot
+
+    def _build(persistence=None, update_processor=None):
+        request = StubTelegramRequest()
+        builder = Application.builder().token(TEST_TOKEN).request(request).get_updates_request(StubTelegramRequest())
+        if persistence is not None:
+            builder = builder.persistence(persistence)
+        if update_processor is not None:
+            builder = builder.concurrent_updates(update_processor)
+        return bot.build_application(builder), request
+    return _build
+
+
+@pytest.fixture
+def fake_bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def mongo_users():
+    import mongomock
+    return mongomock.MongoClient().db.users
+
+
+@pytest.fixture
+def repo(monkeypatch, mongo_users):
+    import bot
+    from ledger import PayoutLedger
+    from repository import UserRepository
+    repository = UserRepository(mongo_users, max_workers=2)
+    monkeypatch.setattr(bot, "users_repo", repository)
+    # The ledger shares the repository's database and worker pool, as in bot.py
+    monkeypatch.setattr(bot, "ledger", PayoutLedger(
+        mongo_users.database, repository.run, renewal_day=bot.settings.RENEWAL_DAY
+    ))
+    return repository
+
+
+@pytest.fixture
+def ledger(repo):
+    import bot
+    return bot.ledger
+
+
+@pytest.fixture
+def notifier(monkeypatch, repo, mongo_users):
+    import bot
+    from notifications import NotificationDispatcher
+    dispatcher = NotificationDispatcher(
+        mongo_users.database.outbox, repo.run, concurrency=4, global_rate=0, chat_interval=0, backoff_base=0
+    )
+    monkeypatch.setattr(bot, "notifier", dispatcher)
+    return dispatcher
@@ -0,0 +1,84 @@
+import asyncio
+
+from cache import TTLCache
+from repository import UserRepository
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction_and_counters():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"  # 1 becomes most recently used
+    cache.set(3, "c")
+    assert 2 not in cache
+    assert cache.get(2) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set(1, "a")
+    clock.now = 4.9
+    assert cache.get(1) == "a"
+    clock.now = 5.0
+    assert cache.get(1) is None
+    assert cache.stats()["expirations"] == 1
+
+
+class CountingCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.reads = 0
+
+    def find_one(self, *args, **kwargs):
+        self.reads += 1
+        return self.collection.find_one(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_repository_reads_through_and_invalidates_on_write(mongo_users):
+    mongo_users.insert_one({"user_id": 1, "status": "Pending"})
+    counting = CountingCollection(mongo_users)
+    repo = UserRepository(counting, max_workers=1, cache=TTLCache(maxsize=10, ttl=60))
+
+    async def run():
+        first = await repo.get_user(1)
+        second = await repo.get_user(1)
+        await repo.set_status(1, "Approved")
+        third = await repo.get_user(1)
+        missing = [await repo.get_user(2), await repo.get_user(2)]
+        return first, second, third, missing
+
+    first, second, third, missing = asyncio.run(run())
+    assert first["status"] == second["status"] == "Pending"
+    assert third["status"] == "Approved"
+    assert missing == [None, None]
+    # 1 initial read, 1 after invalidation, 1 for the unknown user
+    assert counting.reads == 3
+
+
+def test_read_racing_a_write_is_not_cached(mongo_users):
+    mongo_users.insert_one({"user_id": 1, "status": "Pending"})
+    repo = UserRepository(mongo_users, max_workers=2, cache=TTLCache(maxsize=10, ttl=60))
+
+    async def run():
+        read = asyncio.ensure_future(repo.get_user(1))
+        await asyncio.sleep(0)
+        repo.invalidate(1)
+        await read
+
+    asyncio.run(run())
+    assert 1 not in repo.cache
@@ -0,0 +1,41 @@
+import json
+import os
+
+import pytest
+
+from catalog import MessageCatalog, field_names
+
+LOCALES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "locales")
+
+
+def test_constants_are_compiled_in_and_only_dynamic_fields_remain():
+    catalog = MessageCatalog(
+        {"en": {"fee": "Pay **{fee} FCFA**", "due": "Pay {fee} by {renewal_date}", "braces": "{{literal}}"}},
+        constants={"fee": 5000},
+    )
+    assert catalog._static[("fee", "en")] == "Pay **5000 FCFA**"
+    assert catalog._templates[("due", "en")] == "Pay 5000 by {renewal_date}"
+    assert catalog.render("due", "en", renewal_date="25 July 2025") == "Pay 5000 by 25 July 2025"
+    assert catalog.render("braces", "en") == "{literal}"
+
+
+def test_missing_translations_and_unknown_languages_fall_back_to_default():
+    catalog = MessageCatalog({"en": {"hi": "Hello", "bye": "Bye"}, "fr": {"hi": "Bonjour"}})
+    assert catalog.render("hi", "fr") == "Bonjour"
+    assert catalog.render("bye", "fr") == "Bye"
+    assert catalog.render("hi", "de") == "Hello"
+    with pytest.raises(KeyError):
+        catalog.render("nope", "en")
+
+
+def test_shipped_locales_are_complete_and_use_the_same_fields():
+    messages = {}
+    for filename in os.listdir(LOCALES):
+        with open(os.path.join(LOCALES, filename), encoding="utf-8") as f:
+            messages[filename[:-len(".json")]] = json.load(f)
+    for lang, texts in messages.items():
+        assert texts.keys() == messages["en"].keys(), lang
+        for key, template in texts.items():
+            assert field_names(template) == field_names(messages["en"][key]), (key, lang)
+    catalog = MessageCatalog.from_directory(LOCALES, constants={"fee": 5000})
+    assert "**5000 FCFA**" in catalog.render("payment_mtn", "fr")
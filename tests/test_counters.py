@@ -0,0 +1,99 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import bot
+from repository import referral_period_key
+
+
+def test_referral_period_key_buckets_by_renewal_day():
+    assert referral_period_key(datetime(2025, 6, 24), 25) == "2025-05-25"
+    assert referral_period_key(datetime(2025, 6, 25), 25) == "2025-06-25"
+    assert referral_period_key(datetime(2025, 1, 3), 25) == "2024-12-25"
+
+
+def seed(mongo_users):
+    now = datetime.now()
+    mongo_users.insert_many([
+        {"user_id": 10, "name": "Godfather", "status": "Approved"},
+        {"user_id": 20, "name": "Referral", "godfather": 10, "status": "Pending", "registration_date": now},
+    ])
+    return referral_period_key(now, bot.settings.RENEWAL_DAY)
+
+
+def test_approve_and_reject_move_counters_atomically(repo, notifier, mongo_users, fake_bot, make_callback):
+    period = seed(mongo_users)
+
+    counts = []
+
+    async def run():
+        await notifier.start(fake_bot)
+        for data in ("approve_20", "approve_20", "reject_20"):
+            await bot.admin_callback(make_callback(data), SimpleNamespace(bot=fake_bot))
+            counts.append(mongo_users.find_one({"user_id": 10})["referral_counts"])
+        await notifier.stop()
+
+    asyncio.run(run())
+    assert counts[0] == counts[1] == {"approved": 1, "periods": {period: 1}}
+    assert counts[2] == {"approved": 0, "periods": {period: 0}}
+
+
+def test_rebuild_detects_and_fixes_drift(repo, mongo_users):
+    period = seed(mongo_users)
+    mongo_users.update_one({"user_id": 20}, {"$set": {"status": "Approved"}})
+    mongo_users.insert_one({"user_id": 30, "referral_counts": {"approved": 4, "periods": {}}})
+
+    report = asyncio.run(repo.rebuild_referral_counts())
+    assert report["checked"] == 1
+    assert sorted(report["mismatched"]) == [10, 30]
+    assert "referral_counts" not in mongo_users.find_one({"user_id": 10})
+
+    asyncio.run(repo.rebuild_referral_counts(fix=True))
+    assert mongo_users.find_one({"user_id": 10})["referral_counts"] == {"approved": 1, "periods": {period: 1}}
+    assert mongo_users.find_one({"user_id": 30})["referral_counts"] == {"approved": 0, "periods": {}}
+    assert asyncio.run(repo.rebuild_referral_counts())["mismatched"] == []
+
+
+def test_renewal_after_expiry_is_counted_once_and_not_rewarded_again(repo, ledger, notifier, mongo_users,
+                                                                     fake_bot, make_callback, make_update):
+    seed(mongo_users)
+    context = SimpleNamespace(user_data={
+        "language": "en", "name": "Referral", "phone": "670000000", "email": "r@example.com",
+        "godfather": 10, "payment_method": "mtn",
+    })
+
+    async def run():
+        await notifier.start(fake_bot)
+        await bot.admin_callback(make_callback("approve_20"), SimpleNamespace(bot=fake_bot))
+        # The renewal job expires them, and they register again as the expiry message asks
+        mongo_users.update_one({"user_id": 20}, {"$set": {"status": "Expired"}})
+        await bot.handle_transaction_id(make_update(20, "TX-RENEWAL"), context)
+        pending = mongo_users.find_one({"user_id": 10})["referral_counts"]["approved"]
+        await bot.admin_callback(make_callback("approve_20"), SimpleNamespace(bot=fake_bot))
+        await notifier.join()
+        await notifier.stop()
+        return pending
+
+    assert asyncio.run(run()) == 0
+    assert mongo_users.find_one({"user_id": 10})["referral_counts"]["approved"] == 1
+    assert asyncio.run(repo.rebuild_referral_counts())["mismatched"] == []
+    assert [entry["type"] for entry in mongo_users.database.ledger.find({"user_id": 20})] == ["reward"]
+    # Only the first approval tells the godfather they earned something
+    assert sum("You have earned" in text for chat_id, text in fake_bot.sent if chat_id == 10) == 1
+
+
+def test_rejecting_an_expired_referral_takes_it_back(repo, ledger, notifier, mongo_users, fake_bot, make_callback):
+    seed(mongo_users)
+
+    async def run():
+        await notifier.start(fake_bot)
+        await bot.admin_callback(make_callback("approve_20"), SimpleNamespace(bot=fake_bot))
+        mongo_users.update_one({"user_id": 20}, {"$set": {"status": "Expired"}})
+        # From the old submission message
+        await bot.admin_callback(make_callback("reject_20"), SimpleNamespace(bot=fake_bot))
+        await notifier.stop()
+
+    asyncio.run(run())
+    assert mongo_users.find_one({"user_id": 10})["referral_counts"]["approved"] == 0
+    assert asyncio.run(repo.rebuild_referral_counts())["mismatched"] == []
+    assert [entry["type"] for entry in mongo_users.database.ledger.find({"user_id": 20})] == ["reward", "reversal"]
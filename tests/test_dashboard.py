@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import bot
+from dashboard import Dashboard
+
+
+class CountingCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.aggregates = 0
+
+    def aggregate(self, *args, **kwargs):
+        self.aggregates += 1
+        return self.collection.aggregate(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def seed(mongo_users, now):
+    mongo_users.insert_many([
+        {"user_id": 1, "name": "One", "status": "Approved", "godfather": None, "subscription_start_date": now,
+         "referral_counts": {"approved": 1}},
+        {"user_id": 2, "name": "Two", "status": "Approved", "godfather": 1, "subscription_start_date": now,
+         "registration_date": now},
+        {"user_id": 3, "name": "Three", "status": "Expired", "godfather": None,
+         "subscription_start_date": now - timedelta(days=90)},
+        {"user_id": 4, "name": "Four", "status": "Pending", "godfather": 1, "registration_date": now - timedelta(days=2)},
+        {"user_id": 5, "name": "Five", "status": "Pending", "godfather": 3, "registration_date": now - timedelta(days=1)},
+        {"user_id": 6, "name": "Six", "status": "Rejected", "godfather": None},
+    ])
+
+
+def without_timestamp(numbers):
+    return {key: value for key, value in numbers.items() if key != "computed_at"}
+
+
+def test_dashboard_is_kept_current_from_status_changes(repo, notifier, mongo_users, fake_bot, make_callback):
+    now = datetime.utcnow().replace(microsecond=0)
+    seed(mongo_users, now)
+    counting = CountingCollection(mongo_users)
+    dashboard = Dashboard(counting, repo.run, renewal_day=bot.settings.RENEWAL_DAY, pending_limit=2)
+    repo.status_listeners.append(dashboard.on_status_change)
+    context = SimpleNamespace(bot=fake_bot)
+
+    async def run():
+        await notifier.start(fake_bot)
+        first = await dashboard.get()
+        await bot.admin_callback(make_callback("approve_4"), context)
+        await bot.admin_callback(make_callback("reject_2"), context)
+        await repo.save_registration(7, {"name": "Seven", "status": "Pending", "godfather": 4, "registration_date": now})
+        await bot.admin_callback(make_callback("approve_5"), context)
+        kept = await dashboard.get()
+        again = await dashboard.get()
+        fresh = await Dashboard(mongo_users, repo.run, renewal_day=bot.settings.RENEWAL_DAY, pending_limit=2).get()
+        await notifier.stop()
+        return first, kept, again, fresh
+
+    first, kept, again, fresh = asyncio.run(run())
+    assert first["statuses"] == {"Approved": 2, "Expired": 1, "Pending": 2, "Rejected": 1}
+    assert (first["approved_this_period"], first["referred_this_period"], first["referred"]) == (2, 1, 1)
+    assert [user["user_id"] for user in first["pending"]] == [4, 5]
+    assert without_timestamp(kept) == without_timestamp(fresh)
+    assert kept["statuses"] == {"Approved": 3, "Expired": 1, "Pending": 1, "Rejected": 2}
+    assert [user["user_id"] for user in kept["pending"]] == [7]
+    assert kept["top_godfathers"] == [{"user_id": 1, "name": "One", "count": 1},
+                                      {"user_id": 3, "name": "Three", "count": 1}]
+    assert again == kept
+    # The facet once, then only the top godfathers after a rejection took one away
+    assert counting.aggregates == 2
+
+
+def test_dashboard_command_renders_money_at_configured_rates(monkeypatch, repo, mongo_users, make_update):
+    now = datetime.utcnow()
+    seed(mongo_users, now)
+    monkeypatch.setattr(bot, "dashboard", Dashboard(mongo_users, repo.run, renewal_day=bot.settings.RENEWAL_DAY))
+    update = make_update(1)
+    asyncio.run(bot.dashboard_command(update, None))
+    lines = update.message.replies[0].splitlines()
+    fee, reward = bot.settings.SUBSCRIPTION_FEE, bot.settings.REFERRAL_REWARD
+    assert lines[1] == "👥 Users: 6 — Approved 2 · Expired 1 · Pending 2 · Rejected 1"
+    assert lines[3] == f"💰 Revenue: {2 * fee} FCFA this period, {3 * fee} FCFA all time"
+    assert lines[4] == f"💸 Referral payouts: {reward} FCFA owed this period, {reward} FCFA all time"
+    assert lines[7].startswith("  Four [4] — waiting 2d")
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import asyncio
+
+import mongomock
+from pymongo import _csot
+
+from database import INDEXES, MongoConnection, ensure_indexes
+from dispatch import PerChatUpdateProcessor
+from repository import UserRepository
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CountingFactory:
+    def __init__(self):
+        self.created = 0
+
+    def __call__(self, uri, **options):
+        self.created += 1
+        return mongomock.MongoClient()
+
+
+def test_client_is_created_on_first_use_only():
+    factory = CountingFactory()
+    connection = MongoConnection("mongodb://db.invalid", "godly_test", client_factory=factory)
+    users = connection.collection("users")
+    outbox = users.database.outbox
+    assert users.name == "users" and outbox.name == "outbox"
+    assert factory.created == 0 and not connection.connected
+
+    users.insert_one({"user_id": 1})
+    outbox.insert_one({"chat_id": 1})
+    assert factory.created == 1
+    assert users.find_one({"user_id": 1}, {"_id": 0}) == {"user_id": 1}
+
+
+def test_existing_indexes_are_not_reissued():
+    db = mongomock.MongoClient().godly_test
+    created = ensure_indexes(db)
+    assert len(created) == sum(len(models) for models in INDEXES.values())
+    assert ensure_indexes(db) == []
+    db.users.drop_index("status_1")
+    assert ensure_indexes(db) == ["status_1"]
+
+
+def test_importing_bot_does_not_touch_mongo():
+    # An unresolvable host would fail or hang on any network access
+    env = dict(os.environ, MONGO_URI="mongodb://db.invalid:27017/?serverSelectionTimeoutMS=100")
+    result = subprocess.run(
+        [sys.executable, "-c", "import bot; print(bot.mongo.connected)"],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith("False")
+
+
+def test_updates_get_the_short_timeout_and_reports_do_not():
+    repo = UserRepository(mongomock.MongoClient().db.users, max_workers=1)
+    processor = PerChatUpdateProcessor(4, mongo_timeout=2.0)
+
+    async def handler():
+        return await repo.run(_csot.get_timeout), await repo.run_report(_csot.get_timeout)
+
+    async def run():
+        seen = []
+
+        async def update():
+            seen.append(await handler())
+        await processor.do_process_update(None, update())
+        # Outside of an update, as in a scheduled job
+        seen.append(await handler())
+        return seen
+
+    (interactive, report), outside = asyncio.run(run())
+    assert 0 < interactive <= 2.0 and report is None
+    assert outside == (None, None)
@@ -0,0 +1,118 @@
+import asyncio
+import random
+import time
+
+from telegram import Update
+
+import bot
+from dispatch import PerChatUpdateProcessor
+from repository import UserRepository
+
+USERS = 40
+DELAY = 0.02
+
+
+def message(user_id, text):
+    data = {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"message": data}
+
+
+def callback(user_id, data):
+    return {"callback_query": {
+        "id": str(user_id),
+        "chat_instance": "1",
+        "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+        "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "..."},
+    }}
+
+
+def registration(user_id):
+    return [
+        message(user_id, "/start"), callback(user_id, "lang_en"), message(user_id, f"Name {user_id}"),
+        message(user_id, "670000000"), message(user_id, f"user{user_id}@example.com"), message(user_id, "skip"),
+        callback(user_id, "payment_mtn"), message(user_id, f"TX{user_id}"),
+    ]
+
+
+def interleaved(seed=0):
+    """Every user's registration, randomly interleaved but in order per user."""
+    rng = random.Random(seed)
+    pending = {user_id: registration(user_id) for user_id in range(100, 100 + USERS)}
+    updates = []
+    while pending:
+        user_id = rng.choice(sorted(pending))
+        updates.append(pending[user_id].pop(0))
+        if not pending[user_id]:
+            del pending[user_id]
+    return [{"update_id": update_id, **data} for update_id, data in enumerate(updates, start=1)]
+
+
+class SlowCollection:
+    """Adds a fixed round-trip delay to every collection call."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if not callable(attr):
+            return attr
+
+        def slow(*args, **kwargs):
+            time.sleep(DELAY)
+            return attr(*args, **kwargs)
+        return slow
+
+
+async def replay(application, updates):
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    for data in updates:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    await application.update_queue.join()
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+    return elapsed
+
+
+def expected_replies(user_id):
+    render = bot.catalog.render
+    return [render("welcome", "en"), render("ask_name", "en"), render("ask_number", "en"), render("ask_email", "en"),
+            render("ask_godfather", "en"), render("choose_payment", "en"), render("payment_mtn", "en"),
+            render("pending_approval", "en")]
+
+
+def test_interleaved_registrations_stay_in_order_and_run_concurrently(monkeypatch, notifier, mongo_users, build_app):
+    updates = interleaved()
+
+    def run(max_concurrent_updates):
+        mongo_users.delete_many({})
+        monkeypatch.setattr(bot, "users_repo", UserRepository(SlowCollection(mongo_users), max_workers=USERS))
+        processor = PerChatUpdateProcessor(max_concurrent_updates)
+        application, request = build_app(update_processor=processor)
+        elapsed = asyncio.run(replay(application, updates))
+        assert processor.active_keys == 0
+        return elapsed, request
+
+    serial, _ = run(1)
+    concurrent, request = run(64)
+
+    for user_id in range(100, 100 + USERS):
+        replies = [params["text"] for name, params in request.calls
+                   if name in ("sendMessage", "editMessageText") and params.get("chat_id") == user_id]
+        assert replies == expected_replies(user_id)
+        doc = mongo_users.find_one({"user_id": user_id})
+        assert (doc["name"], doc["transaction_id"], doc["status"]) == (f"Name {user_id}", f"TX{user_id}", "Pending")
+    # Each user's updates wait on Mongo one after another; different users overlap
+    assert concurrent < serial / 3
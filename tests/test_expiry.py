@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime
+
+import bot
+from expiry import run_renewal_cycle
+
+NOW = datetime(2025, 7, 23, 0, 15)
+
+
+def seed(mongo_users):
+    mongo_users.insert_many([
+        # Renewal date passed on the 25th of last month
+        {"user_id": 1, "status": "Approved", "language": "en", "subscription_renewal_date": datetime(2025, 6, 25)},
+        {"user_id": 2, "status": "Approved", "language": "fr", "subscription_renewal_date": datetime(2025, 6, 25)},
+        # Due in two days
+        {"user_id": 3, "status": "Approved", "language": "en", "subscription_renewal_date": datetime(2025, 7, 25)},
+        # Due next month
+        {"user_id": 4, "status": "Approved", "language": "en", "subscription_renewal_date": datetime(2025, 8, 25)},
+        {"user_id": 5, "status": "Pending", "language": "en"},
+    ])
+
+
+def run_cycle(repo, notifier, fake_bot, **kwargs):
+    async def run():
+        await notifier.start(fake_bot)
+        result = await run_renewal_cycle(repo, notifier, bot.catalog, days_ahead=3, batch_size=1, now=NOW, **kwargs)
+        await notifier.join()
+        await notifier.stop()
+        return result
+    return asyncio.run(run())
+
+
+def test_expires_overdue_users_and_reminds_once(repo, notifier, mongo_users, fake_bot):
+    seed(mongo_users)
+
+    assert run_cycle(repo, notifier, fake_bot) == {"expired": 2, "reminded": 1}
+    statuses = {doc["user_id"]: doc["status"] for doc in mongo_users.find()}
+    assert statuses == {1: "Expired", 2: "Expired", 3: "Approved", 4: "Approved", 5: "Pending"}
+    sent = dict(fake_bot.sent)
+    assert sent[1] == bot.catalog.render("subscription_expired", "en")
+    assert sent[2] == bot.catalog.render("subscription_expired", "fr")
+    assert sent[3] == bot.catalog.render("renewal_reminder", "en", renewal_date="25 July 2025")
+
+    # A second run the same day neither re-expires nor re-reminds
+    fake_bot.sent.clear()
+    assert run_cycle(repo, notifier, fake_bot) == {"expired": 0, "reminded": 0}
+    assert fake_bot.sent == []
+
+
+def test_user_id_ranges_split_the_work_without_gaps(repo, notifier, mongo_users, fake_bot):
+    seed(mongo_users)
+    ranges = asyncio.run(repo.user_id_ranges(2))
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    assert all(ranges[i][1] == ranges[i + 1][0] for i in range(len(ranges) - 1))
+
+    totals = [run_cycle(repo, notifier, fake_bot, min_user_id=lo, max_user_id=hi) for lo, hi in ranges]
+    assert sum(t["expired"] for t in totals) == 2
+    assert sum(t["reminded"] for t in totals) == 1
+
+
+def test_shards_of_one_run_share_their_ranges(repo, mongo_users):
+    seed(mongo_users)
+    first = asyncio.run(repo.planned_user_id_ranges("expiry:2025-07-23:2", 2))
+    # Users registering between two shards' start-up don't shift the split
+    mongo_users.insert_many([{"user_id": 100 + i, "status": "Pending"} for i in range(10)])
+    assert asyncio.run(repo.planned_user_id_ranges("expiry:2025-07-23:2", 2)) == first
+    assert asyncio.run(repo.planned_user_id_ranges("expiry:2025-07-24:2", 2)) != first
+
+
+def test_a_reminder_marked_by_another_process_is_not_sent_again(monkeypatch, repo, notifier, mongo_users, fake_bot):
+    seed(mongo_users)
+    bulk_update_users = repo.bulk_update_users
+
+    async def racing_bulk_update_users(updates):
+        if any("renewal_reminder_for" in update["$set"] for _, _, update in updates):
+            # An overlapping shard reminds user 3 between this run's read and its write
+            mongo_users.update_one({"user_id": 3}, {"$set": {"renewal_reminder_for": datetime(2025, 7, 25)}})
+        return await bulk_update_users(updates)
+
+    monkeypatch.setattr(repo, "bulk_update_users", racing_bulk_update_users)
+    assert run_cycle(repo, notifier, fake_bot)["reminded"] == 0
+    assert 3 not in dict(fake_bot.sent)
@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import mongomock
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+from jobs import JobScheduler
+
+
+async def run_inline(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+class Replica:
+    def __init__(self, database, name, now, calls):
+        self.now = now
+        self.scheduler = JobScheduler(database, run_inline, owner=name, lease_seconds=60, misfire_grace=3600,
+                                      clock=lambda: self.now)
+        self.scheduler.add_job("daily", self.job, CronTrigger(hour=0, minute=15, timezone="UTC"), args=[name])
+        self.calls = calls
+
+    async def job(self, name):
+        self.calls.append((name, self.now))
+
+    async def tick(self, now):
+        self.now = now
+        tasks = await self.scheduler.tick(now)
+        await asyncio.gather(*tasks)
+        return len(tasks)
+
+
+def test_only_the_leader_runs_each_job_once(monkeypatch):
+    database = mongomock.MongoClient().db
+    start = datetime(2025, 6, 1, 0, 0)
+    calls = []
+    a, b = Replica(database, "a", start, calls), Replica(database, "b", start, calls)
+
+    async def run():
+        await a.tick(start)
+        await b.tick(start)
+        due = datetime(2025, 6, 1, 0, 15)
+        started = [await a.tick(due), await b.tick(due)]
+        # a dies without releasing its lease; b takes over once it has run out
+        later = datetime(2025, 6, 2, 0, 15, 30)
+        leader_while_fresh = (await b.tick(due + timedelta(seconds=30)), b.scheduler.is_leader)
+        started.append(await b.tick(later))
+        return started, leader_while_fresh
+
+    started, leader_while_fresh = asyncio.run(run())
+    assert started == [1, 0, 1]
+    assert leader_while_fresh == (0, False)
+    assert calls == [("a", datetime(2025, 6, 1, 0, 15)), ("b", datetime(2025, 6, 2, 0, 15, 30))]
+    runs = list(database.scheduler_runs.find({}, {"_id": 0}).sort("started_at", 1))
+    assert [(run["owner"], run["status"], run["scheduled_for"]) for run in runs] == [
+        ("a", "ok", datetime(2025, 6, 1, 0, 15)), ("b", "ok", datetime(2025, 6, 2, 0, 15)),
+    ]
+    assert all(run["duration"] >= 0 for run in runs)
+    job = database.scheduler_jobs.find_one({"_id": "daily"})
+    assert (job["next_run_at"], job["last_status"]) == (datetime(2025, 6, 3, 0, 15), "ok")
+
+
+def test_missed_runs_are_caught_up_once_within_the_misfire_window():
+    database = mongomock.MongoClient().db
+    start = datetime(2025, 6, 1, 0, 0)
+    calls = []
+
+    async def run():
+        first = Replica(database, "a", start, calls)
+        await first.tick(start)
+        await first.scheduler.stop()
+        # Down from before 00:15 until 00:50: caught up with a single run
+        second = Replica(database, "b", start, calls)
+        second.scheduler.add_job("often", second.job, IntervalTrigger(minutes=10, start_date=start, timezone="UTC"),
+                                 args=["often"])
+        await second.tick(datetime(2025, 6, 1, 0, 50))
+        # Down for three days: yesterday's 00:15 run is far past the window and is not run
+        await second.tick(datetime(2025, 6, 4, 12, 0))
+        return second
+
+    second = asyncio.run(run())
+    assert calls == [("b", datetime(2025, 6, 1, 0, 50)), ("often", datetime(2025, 6, 1, 0, 50))]
+    statuses = [(run["job"], run["status"]) for run in database.scheduler_runs.find().sort("started_at", 1)]
+    assert sorted(statuses) == [("daily", "missed"), ("daily", "ok"), ("often", "missed"), ("often", "ok")]
+    assert database.scheduler_jobs.find_one({"_id": "daily"})["next_run_at"] == datetime(2025, 6, 5, 0, 15)
+    history = asyncio.run(second.scheduler.history("daily"))
+    assert [run["status"] for run in history] == ["missed", "ok"]
+
+
+def test_a_job_with_its_own_misfire_grace_is_caught_up_days_late():
+    database = mongomock.MongoClient().db
+    start = datetime(2025, 6, 24, 12, 0)
+    calls = []
+
+    async def run():
+        replica = Replica(database, "a", start, calls)
+        replica.scheduler.add_job("monthly", replica.job, CronTrigger(day=25, hour=0, minute=5, timezone="UTC"),
+                                  args=["monthly"], misfire_grace=27 * 24 * 3600)
+        await replica.tick(start)
+        # Down over the 25th: the daily job is past its hour of grace, the monthly one is not
+        await replica.tick(datetime(2025, 6, 27, 9, 0))
+
+    asyncio.run(run())
+    assert calls == [("monthly", datetime(2025, 6, 27, 9, 0))]
+    statuses = sorted((run["job"], run["status"]) for run in database.scheduler_runs.find())
+    assert statuses == [("daily", "missed"), ("monthly", "ok")]
+    assert database.scheduler_jobs.find_one({"_id": "monthly"})["next_run_at"] == datetime(2025, 7, 25, 0, 5)
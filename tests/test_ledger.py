@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import bot
+
+
+def test_approval_and_rejection_are_recorded_in_the_ledger(repo, ledger, notifier, mongo_users, fake_bot,
+                                                           make_callback, make_update):
+    mongo_users.insert_many([
+        {"user_id": 10, "name": "Godfather", "status": "Approved"},
+        {"user_id": 20, "name": "Referral", "godfather": 10, "status": "Pending", "registration_date": datetime.now()},
+        {"user_id": 30, "name": "Referral", "godfather": 10, "status": "Pending", "registration_date": datetime.now()},
+    ])
+    reward = bot.settings.REFERRAL_REWARD
+
+    async def run():
+        await notifier.start(fake_bot)
+        for data in ("approve_20", "approve_20", "approve_30", "reject_30"):
+            await bot.admin_callback(make_callback(data), SimpleNamespace(bot=fake_bot))
+        await notifier.stop()
+        # A reward from an earlier period only shows in the all-time total
+        await ledger.record_reward(10, 40, reward, now=datetime(2020, 1, 1))
+        update = make_update(10)
+        await bot.referral_earnings(update, None)
+        return update.message.replies[0]
+
+    reply = asyncio.run(run())
+    entries = [(e["type"], e["user_id"], e["amount"]) for e in mongo_users.database.ledger.find({"user_id": {"$ne": 40}})]
+    assert entries == [("reward", 20, reward), ("reward", 30, reward), ("reversal", 30, -reward)]
+    assert f"All-time: 2 referrals = {2 * reward} FCFA" in reply
+    assert f"This month: 1 referrals = {reward} FCFA" in reply
+
+
+def test_referral_earnings_without_referrals_reads_zero(repo, ledger, mongo_users, make_update):
+    update = make_update(10)
+    asyncio.run(bot.referral_earnings(update, None))
+    assert "All-time: 0 referrals = 0 FCFA" in update.message.replies[0]
+    assert "This month: 0 referrals = 0 FCFA" in update.message.replies[0]
+
+
+def test_history_import_settles_earlier_periods(repo, ledger, mongo_users):
+    now = datetime(2025, 6, 10)
+    mongo_users.insert_many([
+        {"user_id": 1, "godfather": 10, "status": "Approved", "subscription_start_date": datetime(2025, 3, 1)},
+        {"user_id": 2, "godfather": 10, "status": "Expired", "subscription_start_date": datetime(2025, 6, 1)},
+        {"user_id": 3, "godfather": 10, "status": "Pending", "registration_date": datetime(2025, 6, 1)},
+        {"user_id": 4, "godfather": None, "status": "Approved", "subscription_start_date": datetime(2025, 6, 1)},
+    ])
+
+    async def run():
+        imported = await ledger.import_history(mongo_users, 2000, batch_size=1, now=now)
+        summary = await ledger.godfather_summary(10, "2025-05-25")
+        # The old report already paid February's period; May's is still open
+        return imported, summary, await ledger.settle("2025-02-25"), await ledger.settle("2025-05-25", now=now)
+
+    imported, summary, february, may = asyncio.run(run())
+    assert imported == 2
+    assert summary == {"all_time": {"count": 2, "amount": 4000}, "period": {"count": 1, "amount": 2000}}
+    assert february is None
+    assert may["amount"] == 2000
+
+
+def test_totals_are_rebuilt_from_the_entries(repo, ledger, mongo_users, make_update):
+    now = datetime(2025, 6, 10)
+
+    async def run():
+        await ledger.record_reward(10, 1, 2000, now=now)
+        # The entry lands but its totals write times out
+        entry = ledger._entry("reward", 10, 2, 2000, now)
+        await ledger._run(ledger.entries.insert_one, entry)
+        await ledger.record_reward(11, 3, 2000, now=now)
+        await ledger.record_reversal(11, 3, now=now)
+        return await ledger.rebuild_totals(), await ledger.rebuild_totals(fix=True, batch_size=1)
+
+    report, fixed = asyncio.run(run())
+    period = ledger.period_key(now)
+    assert sorted(report["mismatched"]) == [f"godfather:10:{period}", "godfather:10:all", f"period:{period}"]
+    assert fixed["fixed"] is True
+    summary = asyncio.run(ledger.godfather_summary(10, period))
+    assert summary == {"all_time": {"count": 2, "amount": 4000}, "period": {"count": 2, "amount": 4000}}
+    assert asyncio.run(ledger.period_summary(period)) == {"count": 2, "amount": 4000}
+    assert asyncio.run(ledger.rebuild_totals())["mismatched"] == []
+
+    update = make_update(1)
+    asyncio.run(bot.verify_ledger(update, SimpleNamespace(args=[])))
+    assert update.message.replies == ["📒 Ledger totals: 5 checked, 0 mismatched."]
@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+from telegram import Bot, Update
+
+import bot
+from conftest import TEST_TOKEN, StubTelegramRequest
+from metrics import Histogram, InstrumentedRequest, Metrics, MetricsServer, MongoCommandListener, MongoPoolListener
+
+
+def command_update(update_id, text, user_id=42):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def test_histogram_quantiles_stay_within_bucket_bounds():
+    histogram = Histogram()
+    for _ in range(90):
+        histogram.observe(0.004)
+    for _ in range(10):
+        histogram.observe(0.2, error=True)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["errors"] == 10
+    assert 0.0025 <= summary["p50"] <= 0.005
+    assert 0.1 <= summary["p95"] <= 0.2
+    assert summary["max"] == 0.2
+
+
+def test_handlers_are_timed_including_conversation_states(monkeypatch, repo, build_app):
+    monkeypatch.setattr(bot, "metrics", Metrics())
+    application, _ = build_app()
+
+    async def run():
+        async with application:
+            await application.process_update(Update.de_json(command_update(1, "/aboutus"), application.bot))
+            await application.process_update(Update.de_json(command_update(2, "/start"), application.bot))
+
+    asyncio.run(run())
+    handlers = bot.metrics.summary("handler")
+    assert handlers["about_us"]["count"] == 1
+    assert handlers["start"]["count"] == 1
+    assert handlers["start"]["errors"] == 0
+
+
+def test_mongo_and_telegram_calls_are_recorded():
+    metrics = Metrics()
+    listener = MongoCommandListener(metrics)
+    listener.succeeded(SimpleNamespace(command_name="find", duration_micros=1500))
+    listener.failed(SimpleNamespace(command_name="insert", duration_micros=800))
+    pool = MongoPoolListener(metrics, "reports")
+    pool.connection_checked_out(SimpleNamespace(duration=0.002))
+    pool.connection_check_out_failed(SimpleNamespace(duration=0.5))
+    stub = StubTelegramRequest()
+
+    async def run():
+        async with Bot(TEST_TOKEN, request=InstrumentedRequest(stub, metrics)) as telegram_bot:
+            await telegram_bot.send_message(chat_id=7, text="hi")
+
+    asyncio.run(run())
+    mongo = metrics.summary("mongo")
+    assert mongo["find"]["count"] == 1 and mongo["find"]["max"] == 0.0015
+    assert mongo["insert"]["errors"] == 1
+    waits = metrics.summary("mongo_pool")["reports"]
+    assert (waits["count"], waits["errors"], waits["max"]) == (2, 1, 0.5)
+    telegram = metrics.summary("telegram")
+    assert telegram["getMe"]["count"] == 1
+    assert telegram["sendMessage"]["count"] == 1
+    assert stub.sent_texts() == ["hi"]
+
+
+def test_metrics_endpoint_and_perf_command(monkeypatch, make_update):
+    metrics = Metrics()
+    metrics.observe("handler", "my_info", 0.02)
+    monkeypatch.setattr(bot, "metrics", metrics)
+    server = MetricsServer(metrics, port=0)
+
+    async def run():
+        await server.start()
+        try:
+            async with httpx.AsyncClient() as client:
+                found = await client.get(f"http://127.0.0.1:{server.port}/metrics")
+                missing = await client.get(f"http://127.0.0.1:{server.port}/")
+        finally:
+            await server.stop()
+        update = make_update(1, "/perf")
+        await bot.perf(update, SimpleNamespace(args=[]))
+        return found, missing, update.message.replies
+
+    found, missing, replies = asyncio.run(run())
+    assert found.status_code == 200
+    assert 'godly_handler_seconds_count{name="my_info"} 1' in found.text
+    assert 'godly_handler_seconds_bucket{name="my_info",le="0.025"} 1' in found.text
+    assert missing.status_code == 404
+    assert "my_info: 1x" in replies[0]
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+from telegram.error import Forbidden, RetryAfter
+
+from notifications import NotificationDispatcher
+
+
+class FlakyBot:
+    """Records sends and raises the queued errors first."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def make_dispatcher(outbox, repo, **kwargs):
+    options = dict(concurrency=4, global_rate=0, chat_interval=0, backoff_base=0)
+    options.update(kwargs)
+    return NotificationDispatcher(outbox, repo.run, **options)
+
+
+def test_retry_after_is_retried_and_outbox_cleared(repo, mongo_users):
+    outbox = mongo_users.database.outbox
+    bot = FlakyBot([RetryAfter(0)])
+    dispatcher = make_dispatcher(outbox, repo)
+
+    async def run():
+        await dispatcher.start(bot)
+        delivered = await dispatcher.send(42, "hello")
+        await dispatcher.stop()
+        return delivered
+
+    assert asyncio.run(run()) is True
+    assert bot.sent == [(42, "hello")]
+    assert outbox.count_documents({}) == 0
+
+
+def test_permanent_failure_is_kept_as_failed(repo, mongo_users):
+    outbox = mongo_users.database.outbox
+    dispatcher = make_dispatcher(outbox, repo)
+
+    async def run():
+        await dispatcher.start(FlakyBot([Forbidden("bot was blocked by the user")]))
+        delivered = await dispatcher.send(42, "hello")
+        await dispatcher.stop()
+        return delivered
+
+    assert asyncio.run(run()) is False
+    assert outbox.find_one()["status"] == "failed"
+
+
+def test_unsent_messages_survive_restart(repo, mongo_users):
+    outbox = mongo_users.database.outbox
+    bot = FlakyBot()
+
+    async def run():
+        # Queued but never started, as if the process died before sending; their leases have run out
+        await make_dispatcher(outbox, repo, lease_seconds=0).enqueue(1, "first")
+        await make_dispatcher(outbox, repo, lease_seconds=0).enqueue(1, "second")
+        restarted = make_dispatcher(outbox, repo)
+        await restarted.start(bot)
+        await restarted.join()
+        await restarted.stop()
+
+    asyncio.run(run())
+    assert bot.sent == [(1, "first"), (1, "second")]
+    assert outbox.count_documents({}) == 0
+
+
+def test_messages_queued_by_a_live_process_are_not_taken_over(repo, mongo_users):
+    outbox = mongo_users.database.outbox
+    live_bot, other_bot, successor_bot = FlakyBot(), FlakyBot(), FlakyBot()
+    live = make_dispatcher(outbox, repo, owner="live")
+    other = make_dispatcher(outbox, repo, owner="other")
+
+    async def run():
+        # Another replica starting up, as in a rolling deploy, leaves it alone
+        await live.enqueue(1, "payout")
+        await other.start(other_bot)
+        await other.join()
+        await live.start(live_bot)
+        await live.join()
+        await live.stop()
+        await other.stop()
+        # A process that stops hands over what it hasn't sent
+        stopping = make_dispatcher(outbox, repo, owner="stopping")
+        await stopping.enqueue(2, "handover")
+        await stopping.stop()
+        successor = make_dispatcher(outbox, repo, owner="successor")
+        await successor.start(successor_bot)
+        await successor.join()
+        await successor.stop()
+
+    asyncio.run(run())
+    assert (live_bot.sent, other_bot.sent, successor_bot.sent) == ([(1, "payout")], [], [(2, "handover")])
+    assert outbox.count_documents({}) == 0
+
+
+def test_sends_are_paced_per_chat_and_keep_order(repo, mongo_users):
+    bot = FlakyBot()
+    dispatcher = make_dispatcher(mongo_users.database.outbox, repo, chat_interval=0.05)
+
+    async def run():
+        await dispatcher.start(bot)
+        for i in range(4):
+            await dispatcher.enqueue(7, f"msg {i}")
+        started = time.perf_counter()
+        await dispatcher.join()
+        await dispatcher.stop()
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    assert [text for _, text in bot.sent] == [f"msg {i}" for i in range(4)]
+    assert elapsed >= 0.05 * 3
@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import bot
+
+
+def pending(user_id, minutes_ago, godfather=None, **fields):
+    return {"user_id": user_id, "name": f"User {user_id}", "status": "Pending", "godfather": godfather,
+            "payment_method": "mtn", "transaction_id": f"TX{user_id}",
+            "registration_date": datetime.utcnow() - timedelta(minutes=minutes_ago), **fields}
+
+
+def user_buttons(markup):
+    return [button for row in markup.inline_keyboard for button in row if ":t:" in button.callback_data]
+
+
+def press(make_callback, data, markup):
+    update = make_callback(data, reply_markup=markup)
+    asyncio.run(bot.pending_callback(update, None))
+    return update.callback_query
+
+
+def test_pending_view_selects_and_approves_in_bulk(monkeypatch, repo, notifier, mongo_users, make_update,
+                                                    make_callback):
+    monkeypatch.setattr(bot.settings, "PENDING_PAGE_SIZE", 3)
+    mongo_users.insert_one({"user_id": 7, "name": "Root", "status": "Approved", "referral_path": "/",
+                            "referral_depth": 0, "phone": "670000001", "payment_method": "orange"})
+    # 12 was referred by 11, and both are approved in the same batch
+    mongo_users.insert_many([pending(11, 50, godfather=7), pending(12, 40, godfather=11), pending(13, 30),
+                             pending(14, 20), pending(15, 10)])
+
+    update = make_update(1)
+    asyncio.run(bot.pending_command(update, SimpleNamespace(args=[])))
+    markup = update.message.markups[0]
+    assert [button.callback_data for button in user_buttons(markup)] == ["pq:0:t:11", "pq:0:t:12", "pq:0:t:13"]
+    assert update.message.replies[0].splitlines()[1].startswith("• User 11 [11] — MTN TX11, godfather 7, waiting 0h 50m")
+
+    query = press(make_callback, "pq:0:t:11", markup)
+    query = press(make_callback, "pq:0:t:12", query.message.reply_markup)
+    assert bot.selected_user_ids(query.message.reply_markup) == [11, 12]
+    query = press(make_callback, "pq:0:a", query.message.reply_markup)
+
+    statuses = {doc["user_id"]: doc["status"] for doc in mongo_users.find()}
+    assert statuses == {7: "Approved", 11: "Approved", 12: "Approved", 13: "Pending", 14: "Pending", 15: "Pending"}
+    assert mongo_users.find_one({"user_id": 12})["referral_path"] == "/7/11/"
+    assert mongo_users.find_one({"user_id": 7})["referral_counts"]["approved"] == 1
+    assert mongo_users.find_one({"user_id": 11})["referral_counts"]["approved"] == 1
+    assert mongo_users.database.ledger.count_documents({"type": "reward"}) == 2
+
+    outbox = list(mongo_users.database.outbox.find())
+    admin_notes = [doc["text"] for doc in outbox if doc["chat_id"] == bot.settings.ADMIN_CHAT_ID]
+    assert len(admin_notes) == 1 and admin_notes[0].startswith("💸 PAY REFERRALS: 2 ×")
+    assert sorted(doc["chat_id"] for doc in outbox if doc["parse_mode"] == "Markdown") == [11, 12]
+
+    # The page now shows what is still pending, under a summary of what was done
+    lines = query.edits[-1].splitlines()
+    assert lines[0] == "✅ 2 user(s) APPROVED by Admin"
+    assert [button.callback_data for button in user_buttons(query.message.reply_markup)] == [
+        "pq:0:t:13", "pq:0:t:14", "pq:0:t:15"
+    ]
+
+
+def test_bulk_reject_skips_users_no_longer_pending(repo, notifier, mongo_users, make_update, make_callback):
+    mongo_users.insert_many([pending(21, 30), pending(22, 20), pending(23, 10)])
+    update = make_update(1)
+    asyncio.run(bot.pending_command(update, SimpleNamespace(args=[])))
+    query = press(make_callback, "pq:0:s", update.message.markups[0])
+    assert bot.selected_user_ids(query.message.reply_markup) == [21, 22, 23]
+    mongo_users.update_one({"user_id": 22}, {"$set": {"status": "Approved"}})
+
+    query = press(make_callback, "pq:0:r", query.message.reply_markup)
+    assert query.edits[-1].splitlines()[0] == "❌ 2 user(s) REJECTED by Admin (1 no longer pending)"
+    assert query.edits[-1].splitlines()[1] == "✅ No pending approvals."
+    assert sorted(doc["chat_id"] for doc in mongo_users.database.outbox.find()) == [21, 23]
+
+    mongo_users.insert_one(pending(24, 5))
+    page = make_update(1)
+    asyncio.run(bot.pending_command(page, SimpleNamespace(args=[])))
+    nothing = press(make_callback, "pq:0:a", page.message.markups[0])
+    assert nothing.answers == ["Select at least one user first."] and nothing.edits == []
+
+
+def test_digest_mode_sums_up_new_submissions(monkeypatch, repo, notifier, mongo_users, make_update):
+    monkeypatch.setattr(bot.settings, "ADMIN_DIGEST_MINUTES", 15)
+    for user_id, transaction_id in ((31, "SAME"), (32, "SAME"), (33, "OTHER")):
+        context = SimpleNamespace(user_data={
+            "language": "en", "name": f"User {user_id}", "phone": "670000000", "email": "u@example.com",
+            "godfather": None, "payment_method": "mtn",
+        })
+        asyncio.run(bot.handle_transaction_id(make_update(user_id, transaction_id), context))
+    outbox = mongo_users.database.outbox
+    assert outbox.count_documents({"chat_id": bot.settings.ADMIN_CHAT_ID}) == 0
+
+    application = SimpleNamespace(bot_data={})
+    assert asyncio.run(bot.send_pending_digest(application)) == 3
+    digest = outbox.find_one({"chat_id": bot.settings.ADMIN_CHAT_ID})
+    lines = digest["text"].splitlines()
+    assert lines[0].startswith("🔔 3 new payment submission(s) since")
+    assert [line.endswith("⚠️ reused transaction ID") for line in lines[1:]] == [True, True, False]
+    assert digest["reply_markup"]["inline_keyboard"][0][0]["callback_data"] == "pq:0:p"
+    assert asyncio.run(bot.send_pending_digest(application)) == 0
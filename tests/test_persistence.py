@@ -0,0 +1,120 @@
+import asyncio
+
+from telegram import Update
+
+import bot
+from persistence import MongoPersistence
+
+USER_ID = 42
+
+
+def message_update(update_id, text):
+    message = {
+        "message_id": update_id,
+        "date": 0,
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": USER_ID, "type": "private"}, "text": "..."},
+        },
+    }
+
+
+class CountingDatabase:
+    """Wraps a database so bulk writes per collection can be counted."""
+
+    def __init__(self, database):
+        self.database = database
+        self.bulk_writes = 0
+
+    def __getattr__(self, name):
+        collection = getattr(self.database, name)
+        outer = self
+
+        class Counting:
+            def bulk_write(self, *args, **kwargs):
+                outer.bulk_writes += 1
+                return collection.bulk_write(*args, **kwargs)
+
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+        return Counting()
+
+
+async def feed(application, *updates):
+    for data in updates:
+        await application.process_update(Update.de_json(data, application.bot))
+
+
+def test_registration_resumes_after_restart(repo, mongo_users, build_app):
+    database = mongo_users.database
+
+    async def first_process():
+        application, _ = build_app(MongoPersistence(database, repo.run, update_interval=60))
+        await application.initialize()
+        await feed(application, message_update(1, "/start"), callback_update(2, "lang_en"),
+                   message_update(3, "Alice Doe"))
+        # What the periodic persistence job does; the process then dies without shutting down
+        await application.update_persistence()
+        await application.persistence.flush()
+
+    async def second_process():
+        application, request = build_app(MongoPersistence(database, repo.run, update_interval=60))
+        await application.initialize()
+        await feed(application, message_update(4, "670000000"))
+        return application, request
+
+    asyncio.run(first_process())
+    application, request = asyncio.run(second_process())
+
+    assert request.sent_texts()[-1] == bot.catalog.render("ask_email", "en")
+    assert application.user_data[USER_ID]["name"] == "Alice Doe"
+    assert application.user_data[USER_ID]["phone"] == "670000000"
+
+
+def test_writes_are_batched_per_persistence_run(repo, mongo_users, build_app):
+    database = CountingDatabase(mongo_users.database)
+
+    async def run():
+        application, _ = build_app(MongoPersistence(database, repo.run, update_interval=60))
+        await application.initialize()
+        await feed(application, message_update(1, "/start"), callback_update(2, "lang_en"),
+                   message_update(3, "Alice Doe"), message_update(4, "670000000"))
+        assert database.bulk_writes == 0  # handling messages never touches Mongo
+        await application.update_persistence()
+        await application.persistence.flush()
+
+    asyncio.run(run())
+    # One bulk write for conversation states and one for user_data
+    assert database.bulk_writes == 2
+    assert mongo_users.database.conversations.find_one()["state"] == bot.EMAIL_INPUT
+
+
+def test_finished_conversation_is_removed(repo, mongo_users):
+    persistence = MongoPersistence(mongo_users.database, repo.run)
+
+    async def run():
+        await persistence.update_conversation("registration", (USER_ID, USER_ID), bot.NAME_INPUT)
+        await persistence.flush()
+        stored = await persistence.get_conversations("registration")
+        await persistence.update_conversation("registration", (USER_ID, USER_ID), None)
+        await persistence.flush()
+        return stored, await persistence.get_conversations("registration")
+
+    stored, after = asyncio.run(run())
+    assert stored == {(USER_ID, USER_ID): bot.NAME_INPUT}
+    assert after == {}
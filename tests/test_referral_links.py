@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+from cache import TTLCache
+
+
+class CountingCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.finds = 0
+
+    def find_one(self, *args, **kwargs):
+        self.finds += 1
+        return self.collection.find_one(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_deep_link_skips_the_godfather_question(repo, mongo_users, make_update):
+    context = SimpleNamespace(args=["7"], user_data={})
+    start = make_update(42, "/start 7")
+    assert asyncio.run(bot.start(start, context)) == bot.LANGUAGE_SELECTION
+    context.user_data.update(language="en", name="Alice", phone="670000000")
+    email = make_update(42, "Alice@Example.com")
+    assert asyncio.run(bot.handle_email(email, context)) == bot.PAYMENT_METHOD
+    assert context.user_data["godfather"] == 7
+    assert email.message.replies == [bot.catalog.render("choose_payment", "en")]
+
+    # A link to oneself attributes nobody
+    own = SimpleNamespace(args=["42"], user_data={})
+    asyncio.run(bot.start(make_update(42, "/start 42"), own))
+    assert "referred_by" not in own.user_data
+
+
+def test_link_godfather_is_forgotten_once_used_or_without_a_link(repo, notifier, mongo_users, make_update):
+    context = SimpleNamespace(args=["7"], user_data={})
+    asyncio.run(bot.start(make_update(42, "/start 7"), context))
+    context.user_data.update(language="en", name="Alice", phone="670000000", email="a@example.com",
+                             godfather=7, payment_method="mtn")
+    asyncio.run(bot.handle_transaction_id(make_update(42, "TX1"), context))
+    assert mongo_users.find_one({"user_id": 42})["godfather"] == 7
+    assert "referred_by" not in context.user_data
+
+    # Rejected, then registering again without a link: the godfather question comes back
+    mongo_users.update_one({"user_id": 42}, {"$set": {"status": "Rejected"}})
+    context.user_data["referred_by"] = 7
+    asyncio.run(bot.start(make_update(42, "/start"), SimpleNamespace(args=[], user_data=context.user_data)))
+    assert "referred_by" not in context.user_data
+    email = make_update(42, "a@example.com")
+    assert asyncio.run(bot.handle_email(email, context)) == bot.GODFATHER_INPUT
+
+
+def test_usernames_resolve_case_insensitively_through_the_cache(repo, mongo_users):
+    counting = CountingCollection(mongo_users)
+    repo.collection = counting
+    repo.usernames = TTLCache(maxsize=10, ttl=60)
+    # Registered before username keys were stored
+    mongo_users.insert_one({"user_id": 1, "telegram_username": "Alice"})
+
+    async def run():
+        await repo.save_registration(2, {"telegram_username": "BobTheBuilder"})
+        found = [await repo.resolve_username(name) for name in ("@bobthebuilder", "BOBTHEBUILDER", "Alice", "alice")]
+        finds = counting.finds
+        await repo.update_username(2, "Robert")
+        renamed = [await repo.resolve_username(name) for name in ("bobthebuilder", "robert")]
+        # Someone else takes the old name
+        await repo.update_username(1, "BobTheBuilder")
+        taken = await repo.resolve_username("bobthebuilder")
+        return found, finds, renamed, taken
+
+    found, finds, renamed, taken = asyncio.run(run())
+    assert found == [2, 2, 1, 1]
+    # Only "Alice" reached the database: by key, then by the legacy exact match
+    assert finds == 2
+    assert renamed == [None, 2]
+    assert taken == 1
+    assert mongo_users.find_one({"user_id": 2})["username_key"] == "robert"
+
+
+def test_start_records_a_changed_username(repo, mongo_users, make_update):
+    repo.usernames = TTLCache(maxsize=10, ttl=60)
+    mongo_users.insert_one({"user_id": 5, "telegram_username": "old_name", "username_key": "old_name"})
+    assert asyncio.run(repo.resolve_username("old_name")) == 5
+
+    asyncio.run(bot.start(make_update(5, "/start", username="New_Name"), SimpleNamespace(args=[], user_data={})))
+    assert mongo_users.find_one({"user_id": 5})["telegram_username"] == "New_Name"
+    assert asyncio.run(repo.resolve_username("old_name")) is None
+    assert asyncio.run(repo.resolve_username("new_name")) == 5
+
+
+def test_backfill_makes_earlier_usernames_case_insensitive(repo, mongo_users):
+    mongo_users.insert_many([
+        {"user_id": 1, "telegram_username": "Alice"},
+        {"user_id": 2, "telegram_username": "Bob", "username_key": "bob"},
+        {"user_id": 3, "telegram_username": None},
+        # A stale copy of a name that changed hands; the later registration keeps it
+        {"user_id": 4, "telegram_username": "carol"},
+        {"user_id": 5, "telegram_username": "Carol"},
+    ])
+    assert asyncio.run(repo.backfill_username_keys(batch_size=2)) == 3
+    assert asyncio.run(repo.backfill_username_keys(fix=True, batch_size=2)) == 3
+    assert asyncio.run(repo.backfill_username_keys()) == 0
+
+    keys = {doc["user_id"]: doc.get("username_key") for doc in mongo_users.find()}
+    assert keys == {1: "alice", 2: "bob", 3: None, 4: None, 5: "carol"}
+    # Now found by key alone, in any case
+    repo.collection = CountingCollection(mongo_users)
+    assert asyncio.run(repo.resolve_username("ALICE")) == 1
+    assert repo.collection.finds == 1
@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import bot
+
+
+def user(user_id, godfather=None, status="Pending", **fields):
+    return {"user_id": user_id, "name": f"User {user_id}", "godfather": godfather, "status": status,
+            "registration_date": datetime.now(), **fields}
+
+
+def paths(mongo_users):
+    return {doc["user_id"]: doc.get("referral_path") for doc in mongo_users.find({}, {"_id": 0})}
+
+
+def test_approval_writes_paths_and_moves_earlier_referrals(repo, notifier, mongo_users, fake_bot, make_callback):
+    mongo_users.insert_many([user(1), user(2, 1), user(3, 2), user(4, 2), user(5, 4)])
+
+    async def run():
+        await notifier.start(fake_bot)
+        # 5 is approved while its godfather 4 is still pending, then 4 is approved
+        for user_id in (1, 2, 5, 4, 3):
+            await bot.admin_callback(make_callback(f"approve_{user_id}"), SimpleNamespace(bot=fake_bot))
+        tree = await repo.referral_tree(1)
+        await bot.admin_callback(make_callback("reject_3"), SimpleNamespace(bot=fake_bot))
+        after_reject = await repo.referral_tree(1)
+        await notifier.stop()
+        return tree, after_reject
+
+    tree, after_reject = asyncio.run(run())
+    assert tree == {"size": 4, "depth": 3, "levels": {1: 1, 2: 2, 3: 1}}
+    assert after_reject == {"size": 3, "depth": 3, "levels": {1: 1, 2: 1, 3: 1}}
+    assert paths(mongo_users) == {1: "/", 2: "/1/", 3: None, 4: "/1/2/", 5: "/1/2/4/"}
+    assert mongo_users.find_one({"user_id": 5})["referral_depth"] == 3
+
+
+def test_backfill_computes_paths_from_the_roots(repo, mongo_users):
+    mongo_users.insert_many([
+        user(1, status="Approved"),
+        user(2, 1, status="Approved"),
+        user(3, 2, status="Expired", referral_path="/wrong/"),
+        user(4, 9, status="Approved"),  # godfather 9 was never approved
+        user(5, 1, status="Pending"),
+        user(6, 7, status="Approved"),  # 6 and 7 refer each other
+        user(7, 6, status="Approved"),
+    ])
+
+    report = asyncio.run(repo.rebuild_referral_paths())
+    assert sorted(report["mismatched"]) == [1, 2, 3, 4]
+    assert report["unreached"] == 2
+    assert paths(mongo_users)[3] == "/wrong/"
+
+    asyncio.run(repo.rebuild_referral_paths(fix=True, batch_size=1))
+    assert paths(mongo_users) == {1: "/", 2: "/1/", 3: "/1/2/", 4: "/9/", 5: None, 6: None, 7: None}
+    assert asyncio.run(repo.rebuild_referral_paths())["mismatched"] == []
+
+
+def test_referraltree_command_lists_levels(repo, mongo_users, make_update):
+    mongo_users.insert_many([
+        user(1, status="Approved", referral_path="/", referral_depth=0, language="fr"),
+        user(2, 1, status="Approved", referral_path="/1/", referral_depth=1),
+        user(3, 2, status="Approved", referral_path="/1/2/", referral_depth=2),
+        user(4, status="Approved", referral_path="/", referral_depth=0),
+    ])
+    update = make_update(1)
+    asyncio.run(bot.referral_tree(update, None))
+    assert update.message.replies[0] == bot.catalog.render("referral_tree", "fr", size=2, depth=2) + (
+        "\nNiveau 1 : 1\nNiveau 2 : 1"
+    )
+    empty = make_update(4)
+    asyncio.run(bot.referral_tree(empty, None))
+    assert empty.message.replies[0] == bot.catalog.render("referral_tree_empty", "en")
+
+
+def test_tree_report_covers_top_referrers(repo, mongo_users, make_update):
+    mongo_users.insert_many([
+        user(1, status="Approved", referral_path="/", referral_counts={"approved": 1}, telegram_username="one"),
+        user(2, 1, status="Approved", referral_path="/1/", referral_depth=1, referral_counts={"approved": 1}),
+        user(3, 2, status="Approved", referral_path="/1/2/", referral_depth=2),
+    ])
+    update = make_update(1)
+    asyncio.run(bot.tree_report(update, SimpleNamespace(args=[])))
+    assert update.message.replies[0].splitlines()[1:] == [
+        "User 1 @one [1]: 2 in downline, 2 level(s) — L1 1 · L2 1",
+        "User 2 [2]: 1 in downline, 1 level(s) — L1 1",
+    ]
+
+
+def test_rejecting_a_godfather_moves_their_downline_like_the_backfill(repo, notifier, mongo_users, fake_bot,
+                                                                      make_callback):
+    mongo_users.insert_many([user(7), user(8, 7), user(9, 8), user(11), user(12, 11), user(13, 12)])
+
+    async def run():
+        await notifier.start(fake_bot)
+        for user_id in (7, 8, 9, 11, 12, 13):
+            await bot.admin_callback(make_callback(f"approve_{user_id}"), SimpleNamespace(bot=fake_bot))
+        await bot.admin_callback(make_callback("reject_8"), SimpleNamespace(bot=fake_bot))
+        # A pending user who kept a path, say one registering again after expiry
+        await repo.set_status(12, "Pending")
+        await bot.bulk_reject([12])
+        await notifier.stop()
+        return await repo.referral_tree(7), await repo.referral_tree(8), await repo.rebuild_referral_paths()
+
+    tree_7, tree_8, report = asyncio.run(run())
+    assert tree_7 == {"size": 0, "depth": 0, "levels": {}}
+    assert tree_8 == {"size": 1, "depth": 1, "levels": {1: 1}}
+    assert paths(mongo_users) == {7: "/", 8: None, 9: "/8/", 11: "/", 12: None, 13: "/12/"}
+    assert report["mismatched"] == []
+
+
+def test_bulk_approval_moves_downlines_from_the_paths_users_kept(repo, notifier, mongo_users, fake_bot):
+    # 8 and 9 expired and registered again under new godfathers; 20 stayed approved below them
+    mongo_users.insert_many([
+        user(7, status="Approved", referral_path="/", referral_depth=0),
+        user(10, status="Approved", referral_path="/", referral_depth=0),
+        user(30, status="Approved", referral_path="/", referral_depth=0),
+        user(8, 10, referral_path="/7/", referral_depth=1),
+        user(9, 30, referral_path="/7/8/", referral_depth=2),
+        user(20, 9, status="Approved", referral_path="/7/8/9/", referral_depth=3),
+    ])
+
+    async def run():
+        await notifier.start(fake_bot)
+        await bot.bulk_approve([8, 9])
+        await notifier.stop()
+        return await repo.rebuild_referral_paths()
+
+    report = asyncio.run(run())
+    assert paths(mongo_users) == {7: "/", 10: "/", 30: "/", 8: "/10/", 9: "/30/", 20: "/30/9/"}
+    assert report["mismatched"] == []
@@ -0,0 +1,166 @@
+import asyncio
+import csv
+import gzip
+import io
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import bot
+from bot import current_referral_period, send_monthly_referral_report, settings
+
+
+def read_csv(content, compressed=False):
+    if compressed:
+        content = gzip.decompress(content)
+    return list(csv.reader(io.StringIO(content.decode("utf-8"))))
+
+
+def test_current_referral_period_spans_from_last_renewal_day():
+    start, end = current_referral_period(datetime(2025, 6, 10, 15, 30))
+    assert start == datetime(2025, 5, settings.RENEWAL_DAY)
+    assert end == datetime(2025, 6, 10, 23, 59, 59, 999999)
+
+
+def test_periods_use_the_ledgers_utc_clock(monkeypatch):
+    class AheadOfUtc(datetime):
+        # A host at UTC+14, already on the renewal day while UTC is still on the day before
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2025, 6, settings.RENEWAL_DAY, 13, 0)
+
+        @classmethod
+        def utcnow(cls):
+            return datetime(2025, 6, settings.RENEWAL_DAY - 1, 23, 0)
+
+    monkeypatch.setattr(bot, "datetime", AheadOfUtc)
+    start, _ = current_referral_period()
+    assert start == datetime(2025, 5, settings.RENEWAL_DAY)
+    assert bot.last_completed_period() == f"2025-04-{settings.RENEWAL_DAY}"
+
+
+def test_monthly_report_pays_out_the_last_period_once(repo, ledger, notifier, mongo_users, fake_bot):
+    period_start, _ = current_referral_period()
+    in_last_period = period_start - timedelta(days=3)
+    mongo_users.insert_one({"user_id": 10, "name": "Alice", "telegram_username": "alice", "status": "Approved"})
+    reward = settings.REFERRAL_REWARD
+
+    async def run():
+        await notifier.start(fake_bot)
+        for godfather_id, user_id in ((10, 1), (10, 2), (10, 3), (99, 4)):
+            await ledger.record_reward(godfather_id, user_id, reward, now=in_last_period)
+        await ledger.record_reversal(10, 3, now=in_last_period)
+        # Earned in the running period, so not part of this payout
+        await ledger.record_reward(10, 5, reward, now=period_start)
+        await send_monthly_referral_report(SimpleNamespace(bot=fake_bot))
+        await notifier.join()
+        sent = list(fake_bot.sent)
+        await send_monthly_referral_report(SimpleNamespace(bot=fake_bot))
+        await notifier.join()
+        await notifier.stop()
+        return sent
+
+    sent = asyncio.run(run())
+
+    # The report is one CSV document, captioned with the totals
+    [(chat_id, filename, content, caption)] = fake_bot.documents
+    assert chat_id == settings.ADMIN_CHAT_ID and filename.startswith("referral-payouts-")
+    assert read_csv(content) == [
+        ["godfather_id", "name", "username", "referrals", "amount_fcfa"],
+        ["10", "Alice", "alice", "2", str(2 * reward)],
+        ["99", "", "", "1", str(reward)],
+    ]
+    assert caption.splitlines()[1:] == ["2 godfather(s), 3 referral(s)", f"Total payout: {3 * reward} FCFA"]
+    # Only godfathers with a profile are notified, and a rerun sends nothing
+    assert [chat_id for chat_id, _ in sent] == [10]
+    assert fake_bot.sent == sent
+
+
+def test_a_report_cut_short_resumes_after_the_last_godfather_notified(monkeypatch, repo, ledger, notifier,
+                                                                      mongo_users, fake_bot):
+    monkeypatch.setattr(settings, "REPORT_BATCH_SIZE", 2)
+    period_start, _ = current_referral_period()
+    mongo_users.insert_many([{"user_id": 10 + i, "name": f"Godfather {i}"} for i in range(5)])
+    application = SimpleNamespace(bot=fake_bot)
+    enqueue_many = notifier.enqueue_many
+    calls = []
+
+    async def flaky_enqueue_many(messages):
+        calls.append(len(messages))
+        if len(calls) == 2:
+            raise TimeoutError("operation exceeded time limit")
+        return await enqueue_many(messages)
+
+    async def run():
+        await notifier.start(fake_bot)
+        for i in range(5):
+            await ledger.record_reward(10 + i, 100 + i, settings.REFERRAL_REWARD,
+                                       now=period_start - timedelta(days=3))
+        monkeypatch.setattr(notifier, "enqueue_many", flaky_enqueue_many)
+        try:
+            await send_monthly_referral_report(application)
+        except TimeoutError:
+            pass
+        cut_short = await ledger.get_settlement(bot.last_completed_period())
+        await send_monthly_referral_report(application)
+        await send_monthly_referral_report(application)
+        await notifier.join()
+        await notifier.stop()
+        return cut_short
+
+    cut_short = asyncio.run(run())
+    assert (cut_short["notified_through"], cut_short.get("reported_at")) == (11, None)
+    # Every godfather is told once, and the CSV goes out once, in full
+    assert sorted(chat_id for chat_id, _ in fake_bot.sent) == [10, 11, 12, 13, 14]
+    [(_, _, content, _)] = fake_bot.documents
+    assert len(read_csv(content)) == 6
+    assert asyncio.run(ledger.get_settlement(bot.last_completed_period()))["reported_at"] is not None
+
+
+def test_referral_totals_stream_in_batches(repo, mongo_users):
+    start, end = current_referral_period()
+    mongo_users.insert_many([
+        {"user_id": i, "godfather": 1000 + i, "status": "Approved", "registration_date": start}
+        for i in range(7)
+    ])
+
+    async def collect():
+        return [len(batch) async for batch in repo.stream_referral_totals(start, end, batch_size=3)]
+
+    assert asyncio.run(collect()) == [3, 3, 1]
+
+
+def test_export_streams_filtered_referrals_as_gzipped_csv(monkeypatch, repo, notifier, mongo_users, fake_bot,
+                                                          make_update):
+    monkeypatch.setattr(settings, "REPORT_BATCH_SIZE", 2)
+    mongo_users.insert_one({"user_id": 10, "name": "Alice", "telegram_username": "alice", "status": "Approved"})
+    mongo_users.insert_many([
+        {"user_id": 100 + i, "godfather": 10 + i % 3, "status": status,
+         "registration_date": datetime(2025, 3, 1 + i)}
+        for i, status in enumerate(["Approved", "Expired", "Approved", "Pending", "Approved", "Rejected", "Approved"])
+    ])
+    # Outside the range
+    mongo_users.insert_one({"user_id": 200, "godfather": 10, "status": "Approved",
+                            "registration_date": datetime(2025, 3, 20)})
+
+    def export(*args):
+        update = make_update(1)
+        asyncio.run(bot.export_command(update, SimpleNamespace(args=list(args), bot=fake_bot)))
+        return update.message.replies
+
+    assert export("2025-03-01", "2025-03-10", "approved", "expired", "gz") == []
+    [(chat_id, filename, content, caption)] = fake_bot.documents
+    assert filename == "referrals-2025-03-01-2025-03-10.csv.gz"
+    reward = settings.REFERRAL_REWARD
+    assert read_csv(content, compressed=True)[1:] == [
+        ["10", "Alice", "alice", "2", str(2 * reward)],
+        ["11", "", "", "2", str(2 * reward)],
+        ["12", "", "", "1", str(reward)],
+    ]
+    assert caption.splitlines()[1] == f"3 godfather(s), 5 referral(s), {5 * reward} FCFA at {reward} FCFA each"
+
+    assert export("2025-03-10", "2025-03-01") == ["⚠️ The end date is before the start date."]
+    assert export("2025-03-01", "2025-03-10", "paid") == [
+        "⚠️ Unknown status paid. Use any of: Pending, Approved, Rejected, Expired."
+    ]
+    assert export("March") == [bot.EXPORT_USAGE]
+    assert len(fake_bot.documents) == 1
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from repository import UserRepository
+
+
+class SlowCollection:
+    """Blocking stand-in that sleeps like a slow Mongo round-trip."""
+    delay = 0.2
+
+    def find_one(self, query):
+        time.sleep(self.delay)
+        return {"user_id": query["user_id"], "name": "Test", "status": "Approved"}
+
+
+def test_concurrent_my_info_calls_overlap(monkeypatch, make_update):
+    import bot
+    calls = 8
+    monkeypatch.setattr(bot, "users_repo", UserRepository(SlowCollection(), max_workers=calls))
+    updates = [make_update(user_id) for user_id in range(calls)]
+
+    async def run_all():
+        await asyncio.gather(*(bot.my_info(update, None) for update in updates))
+
+    started = time.perf_counter()
+    asyncio.run(run_all())
+    elapsed = time.perf_counter() - started
+    # Serial execution would take calls * delay; overlapping calls finish in about one delay.
+    assert elapsed < SlowCollection.delay * calls / 2
+    assert all("Status: Approved" in update.message.replies[0] for update in updates)
+
+
+def test_event_loop_stays_responsive_during_query():
+    repo = UserRepository(SlowCollection(), max_workers=1)
+
+    async def run():
+        ticks = 0
+        query = asyncio.ensure_future(repo.get_user(1))
+        while not query.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks, await query
+
+    ticks, user = asyncio.run(run())
+    assert ticks > 5
+    assert user["user_id"] == 1
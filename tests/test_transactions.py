@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+
+
+def submit(make_update, user_id, transaction_id, payment_method="mtn"):
+    update = make_update(user_id, transaction_id)
+    context = SimpleNamespace(user_data={
+        "language": "en", "name": f"User {user_id}", "phone": "670000000", "email": "u@example.com",
+        "godfather": None, "payment_method": payment_method,
+    })
+    asyncio.run(bot.handle_transaction_id(update, context))
+
+
+def test_reused_transaction_id_is_flagged_to_the_admin(repo, notifier, mongo_users, make_update):
+    submit(make_update, 1, "TX100")
+    submit(make_update, 2, "TX100", payment_method="orange")
+    submit(make_update, 3, "TX100")
+    # Resubmitting one's own transaction is not a duplicate
+    submit(make_update, 1, "TX100")
+
+    outbox = mongo_users.database.outbox
+    admin_texts = [doc["text"] for doc in outbox.find({"chat_id": bot.settings.ADMIN_CHAT_ID}).sort("created_at", 1)]
+    assert [("DUPLICATE TRANSACTION ID" in text) for text in admin_texts] == [False, False, True, True]
+    assert "• User 1 [1] — Pending" in admin_texts[2]
+    assert "User 2" not in admin_texts[2]
+    assert "• User 3 [3] — Pending" in admin_texts[3]
+
+
+def test_duplicates_command_lists_clusters(repo, mongo_users, make_update):
+    mongo_users.insert_many([
+        {"user_id": 1, "name": "A", "status": "Approved", "payment_method": "mtn", "transaction_id": "T1"},
+        {"user_id": 2, "name": "B", "status": "Pending", "payment_method": "mtn", "transaction_id": "T1"},
+        {"user_id": 3, "name": "C", "status": "Pending", "payment_method": "orange", "transaction_id": "T1"},
+        {"user_id": 4, "name": "D", "status": "Pending", "payment_method": "orange", "transaction_id": "T2"},
+        {"user_id": 5, "name": "E", "status": "Rejected", "payment_method": "orange", "transaction_id": "T2"},
+        {"user_id": 6, "name": "F", "status": "Pending", "payment_method": "orange", "transaction_id": "T2"},
+    ])
+    update = make_update(1)
+    asyncio.run(bot.duplicate_transactions(update, None))
+    assert update.message.replies[0].splitlines() == [
+        "⚠️ 2 reused transaction ID(s)",
+        "",
+        "ORANGE T2 × 3",
+        "• D [4] — Pending",
+        "• E [5] — Rejected",
+        "• F [6] — Pending",
+        "",
+        "MTN T1 × 2",
+        "• A [1] — Approved",
+        "• B [2] — Pending",
+    ]
+
+    mongo_users.delete_many({"transaction_id": "T2"})
+    mongo_users.delete_one({"user_id": 2})
+    clean = make_update(1)
+    asyncio.run(bot.duplicate_transactions(clean, None))
+    assert clean.message.replies == ["✅ No transaction ID has been submitted twice."]
@@ -3,12 +3,15 @@ from datetime import date
 from dateutil.relativedelta import relativedelta
 from bot import calculate_renewal_date, settings
 
-def test_calculate_renewal_date():
+def test_calculate_renewal_date(monkeypatch):
     today = date(2025, 6, 10)
     expected = date(2025, 7, settings.RENEWAL_DAY)
     # Patch date.today
-    import bot
-    bot.date = lambda: today
+    class FixedDate(date):
+        @classmethod
+        def today(cls):
+            return today
+    monkeypatch.setattr("bot.date", FixedDate)
     assert calculate_renewal_date() == expected
 
 def test_referral_earnings_logic(monkeypatch):
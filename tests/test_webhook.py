@@ -0,0 +1,71 @@
+import asyncio
+import socket
+
+import httpx
+from telegram import Update
+
+import bot
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def command_update(update_id, text, user_id=42):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def test_allowed_updates_are_narrowed_to_registered_handlers(build_app):
+    application, _ = build_app()
+    assert bot.allowed_update_types(application) == [Update.CALLBACK_QUERY, Update.MESSAGE]
+
+
+def test_webhook_serves_synthetic_updates_and_checks_secret(monkeypatch, build_app):
+    port = free_port()
+    monkeypatch.setattr(bot.settings, "WEBHOOK_URL", "https://bot.example.com/")
+    monkeypatch.setattr(bot.settings, "WEBHOOK_LISTEN", "127.0.0.1")
+    monkeypatch.setattr(bot.settings, "WEBHOOK_PORT", port)
+    monkeypatch.setattr(bot.settings, "WEBHOOK_SECRET_TOKEN", "s3cret")
+    application, request = build_app()
+    url = f"http://127.0.0.1:{port}/{bot.settings.WEBHOOK_PATH}"
+
+    async def run():
+        await application.initialize()
+        await application.start()
+        await application.updater.start_webhook(**bot.webhook_options(application))
+        try:
+            async with httpx.AsyncClient() as client:
+                rejected = await client.post(url, json=command_update(1, "/aboutus"),
+                                             headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+                accepted = await client.post(url, json=command_update(2, "/aboutus"),
+                                             headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"})
+            for _ in range(100):
+                if any(name == "sendMessage" for name, _ in request.calls):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
+        return rejected.status_code, accepted.status_code
+
+    rejected, accepted = asyncio.run(run())
+    assert (rejected, accepted) == (403, 200)
+    webhook = dict(request.calls)["setWebhook"]
+    assert webhook["url"] == "https://bot.example.com/telegram"
+    assert webhook["secret_token"] == "s3cret"
+    assert sorted(webhook["allowed_updates"]) == ["callback_query", "message"]
+    sent = [params for name, params in request.calls if name == "sendMessage"]
+    assert len(sent) == 1 and "About Us" in sent[0]["text"]